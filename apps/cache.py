@@ -0,0 +1,185 @@
+"""
+計算した材料の配列をセッション中に保持するキャッシュ。
+
+カラーマップや透過率、unsharpn mask、コントラストの設定を変更しても材料の数値は変わらない。
+ここでは材料の配列（カラーマップを適用する前）を、入力ファイルとその材料の数値に影響する
+設定だけをキーにして保持する。見た目の設定だけを変更して再実行した場合は、DEM を読み込まずに
+キャッシュした配列から画像を作成する。
+"""
+
+from collections import OrderedDict
+from dataclasses import astuple
+import os
+import threading
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # 型注釈だけに使用する。GDAL と QGIS の無い環境（単体テスト）でも読み込める様にする
+    from .options import TopoMapSpec
+
+
+class LayerCache(object):
+    """
+    ## Summary
+        材料の配列の LRU キャッシュ。合計のバイト数が上限を超えた場合は、最も古く使用された
+        配列から削除する。
+    Args:
+        max_bytes (int): 保持する配列の合計バイト数の上限
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024**3):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """
+        ## Summary
+            キャッシュした配列を返す。返す配列は読み取り専用。
+        Args:
+            key (Hashable): `layer_keys` で作成したキー
+        Returns:
+            np.ndarray: 材料の配列。キャッシュにない場合は None。
+        """
+        with self._lock:
+            ary = self._items.get(key)
+            if ary is not None:
+                self._items.move_to_end(key)
+            return ary
+
+    def put(self, key: Hashable, ary: np.ndarray) -> None:
+        """
+        ## Summary
+            配列をキャッシュに追加する。上限を超える配列は追加しない。
+        Args:
+            key (Hashable): `layer_keys` で作成したキー
+            ary (np.ndarray): 材料の配列
+        """
+        if self.max_bytes < ary.nbytes:
+            return
+        ary = np.asarray(ary)
+        ary.flags.writeable = False
+        with self._lock:
+            if key in self._items:
+                self._nbytes -= self._items.pop(key).nbytes
+            self._items[key] = ary
+            self._nbytes += ary.nbytes
+            while self.max_bytes < self._nbytes:
+                _, old = self._items.popitem(last=False)
+                self._nbytes -= old.nbytes
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        ## Summary
+            上限を変更し、超えた分を削除する。
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._items and self.max_bytes < self._nbytes:
+                _, old = self._items.popitem(last=False)
+                self._nbytes -= old.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+
+# セッション中に共有するキャッシュ
+layer_cache = LayerCache()
+
+
+def source_key(file_path: str) -> Tuple[str, int, int]:
+    """
+    ## Summary
+        入力ファイルを識別するキー。ファイルが更新された場合は別のキーになる。
+    Args:
+        file_path (str): 入力ラスターのパス
+    Returns:
+        Tuple[str, int, int]: (絶対パス, 更新時刻, ファイルサイズ)
+    """
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def layer_keys(file_path: str, spec: "TopoMapSpec") -> Dict[str, Hashable]:
+    """
+    ## Summary
+        材料毎のキャッシュのキーを作成する。キーには入力ファイル、リサンプルとサンプリングの設定、
+        その材料の数値に影響する設定だけを含め、カラーマップ、透過率、外れ値処理、
+        unsharpn mask、コントラストの設定は含めない。
+    Args:
+        file_path (str): 入力ラスターのパス
+        spec (TopoMapSpec): 微地形図の設定
+    Returns:
+        Dict[str, Hashable]: 'slope', 'tpi', 'mtpi', 'tri', 'hillshade' のキー
+    """
+    output = spec.output
+    source = (
+        source_key(file_path),
+        astuple(spec.resample),
+        output.sample_only,
+        output.sampling_max_rows if output.sample_only else None,
+        output.sampling_max_cols if output.sample_only else None,
+        # 平滑化の近似の設定
+        spec.execution.smoothing_truncate,
+        spec.execution.smoothing_nodata,
+        # ピラミッドの設定
+        spec.execution.pyramid,
+        spec.execution.pyramid_min_kernel if spec.execution.pyramid else None,
+        spec.execution.pyramid_max_factor if spec.execution.pyramid else None,
+    )
+    slope = spec.slope
+    tpi = spec.tpi
+    tri = spec.tri
+    hillshade = spec.hillshade
+    tpi_key = (
+        tpi.kernel_spec,
+        tpi.metre_spec,
+        tpi.distance,
+        tpi.cells,
+        tpi.sigma,
+        tpi.coef,
+        tpi.algorithm,
+    )
+    return {
+        "slope": (
+            source,
+            "slope",
+            slope.metre_spec,
+            slope.distance,
+            slope.cells,
+            slope.execute_gaussian_filter,
+            slope.sigma,
+        ),
+        "tpi": (source, "tpi", tpi_key),
+        "mtpi": (source, "mtpi", tpi_key, tpi.multiples_distance),
+        "tri": (
+            source,
+            "tri",
+            tri.execute_gaussian_filter,
+            tri.sigma,
+        ),
+        "hillshade": (
+            source,
+            "hillshade",
+            hillshade.hillshade_type,
+            hillshade.azimuth,
+            hillshade.altitude,
+            hillshade.z_factor,
+            hillshade.combined,
+            hillshade.execute_gaussian_filter,
+            hillshade.sigma,
+        ),
+    }
@@ -0,0 +1,136 @@
+"""
+材料の配列をカラーマップで画像に変換する。
+
+`LinearColorMap.values_to_img` は渡された配列の最小値と最大値で正規化するので、
+タイル毎に呼び出すとタイル毎に色が変わってしまう。ここでは正規化に使用する値の範囲を
+外から指定できるようにしている。
+
+また、matplotlib のカラーマップは画素毎に float64 の RGBA を作成するので、1画素 32 バイトの
+配列が材料毎に作成される。ここではカラーマップを1度だけ uint8 の RGBA のルックアップテーブルに
+変換し、正規化した値をインデックスにして呼び出し側が用意した uint8 の配列に直接書き込む。
+"""
+
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from ..gdal_drawer.utils.colors import LinearColorMap
+
+# ルックアップテーブルの色数
+LUT_SIZE = 4096
+
+
+class ColorLut(object):
+    """
+    ## Summary
+        カラーマップを変換した uint8 の RGBA のルックアップテーブル。
+        最後の要素は np.nan 用の透明色。
+    Args:
+        colors (List[List[float]]): 0 ~ 1 の RGBA のリスト。等間隔に並んでいるものとして線形補間する。
+        size (int): テーブルの色数
+        alpha_coef (float): アルファに掛ける係数
+    """
+
+    def __init__(
+        self, colors: List[List[float]], size: int = LUT_SIZE, alpha_coef: float = 1.0
+    ):
+        colors = np.asarray(colors, dtype="float64")
+        positions = np.linspace(0.0, 1.0, len(colors))
+        x = np.linspace(0.0, 1.0, size)
+        table = np.zeros((size + 1, 4), dtype="uint8")
+        for i in range(4):
+            table[:size, i] = (np.interp(x, positions, colors[:, i]) * 255).astype(
+                "uint8"
+            )
+        if alpha_coef != 1.0:
+            table[:size, 3] = (table[:size, 3] * alpha_coef).astype("uint8")
+        self.size = size
+        self.table = table
+
+    @classmethod
+    def from_cmap(
+        cls, cmap: LinearColorMap, size: int = LUT_SIZE, alpha_coef: float = 1.0
+    ) -> "ColorLut":
+        """
+        ## Summary
+            LinearColorMap からテーブルを作成する。
+        Args:
+            cmap (LinearColorMap): matplotlib.colors.LinearSegmentedColormap のラッパークラス。
+            size (int): テーブルの色数
+            alpha_coef (float): アルファに掛ける係数
+        Returns:
+            ColorLut: ルックアップテーブル
+        """
+        return cls(cmap.get_registered_color("rgba"), size, alpha_coef)
+
+    def indices(
+        self, ary: np.ndarray, value_range: Optional[Tuple[float, float]] = None
+    ) -> np.ndarray:
+        """
+        ## Summary
+            配列を正規化してテーブルのインデックスに変換する。
+        Args:
+            ary (np.ndarray): 材料の配列
+            value_range (Tuple[float, float]): 正規化に使用する(最小値, 最大値)。
+                範囲外の値は端の色になる。None の場合は配列の最小値と最大値を使用する。
+        Returns:
+            np.ndarray: uint16 のインデックス。np.nan は透明色のインデックスになる。
+        """
+        if value_range is None:
+            value_range = (np.nanmin(ary), np.nanmax(ary))
+        vmin, vmax = value_range
+        scale = vmax - vmin
+        if not np.isfinite(scale) or scale <= 0:
+            scale = 1.0
+        normed = np.subtract(ary, vmin, dtype="float32")
+        normed *= (self.size - 1) / scale
+        np.clip(normed, 0, self.size - 1, out=normed)
+        normed += 0.5
+        normed[np.isnan(normed)] = self.size
+        return normed.astype("uint16")
+
+    def apply(
+        self,
+        ary: np.ndarray,
+        value_range: Optional[Tuple[float, float]] = None,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        ## Summary
+            配列をRGBAの画像に変換する。
+        Args:
+            ary (np.ndarray): 材料の配列
+            value_range (Tuple[float, float]): 正規化に使用する(最小値, 最大値)。
+            out (np.ndarray): 書き込む (rows, cols, 4) の uint8 の配列。None の場合は新しく作成する。
+        Returns:
+            np.ndarray: (rows, cols, 4) の uint8 の画像。np.nan は透明になる。
+        """
+        if out is None:
+            out = np.empty(ary.shape + (4,), dtype="uint8")
+        np.take(self.table, self.indices(ary, value_range), axis=0, out=out)
+        return out
+
+
+def values_to_img(
+    cmap: LinearColorMap,
+    ary: np.ndarray,
+    value_range: Optional[Tuple[float, float]] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    ## Summary
+        配列をカラーマップでRGBAの画像に変換する。同じカラーマップを繰り返し使用する場合は
+        `ColorLut` を作成して使い回す。
+    Args:
+        cmap (LinearColorMap | ColorLut): カラーマップ、または変換済みのテーブル。
+        ary (np.ndarray): 材料の配列
+        value_range (Tuple[float, float]): 正規化に使用する(最小値, 最大値)。
+            None の場合は配列の最小値と最大値を使用する。
+        out (np.ndarray): 書き込む (rows, cols, 4) の uint8 の配列。
+    Returns:
+        np.ndarray: (rows, cols, 4) の uint8 の画像。np.nan は透明になる。
+    """
+    lut = cmap if isinstance(cmap, ColorLut) else ColorLut.from_cmap(cmap)
+    return lut.apply(ary, value_range, out)
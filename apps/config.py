@@ -27,6 +27,28 @@ def read_config(config_path: str) -> dict:
         return json.load(f)
 
 
+def execution_config() -> dict:
+    """
+    ## Summary
+        計算方法の設定（'Execution'）を読み込む。実行する度に読み込むので、QGIS を
+        再起動せずに変更できる。
+    Returns:
+        dict: `apps.options.ExecutionOptions` に渡す引数。
+    """
+    return read_config(CONFIG_FILE_PATH).get("Execution", {})
+
+
+def xyz_tiles_config() -> dict:
+    """
+    ## Summary
+        XYZ タイルの書き出しの設定（'XyzTiles'）を読み込む。出力ファイルの拡張子が
+        '.mbtiles' または '.gpkg' の場合に使用する。
+    Returns:
+        dict: `apps.options.OutputSpec` の 'tile_format', 'min_zoom', 'max_zoom'。
+    """
+    return read_config(CONFIG_FILE_PATH).get("XyzTiles", {})
+
+
 ################################################################################
 # ----------------------------------- Colors -----------------------------------#
 class MapColors(object):
@@ -16,6 +16,7 @@ from qgis.PyQt.QtWidgets import QBoxLayout  # type: ignore
 from qgis.PyQt.QtWidgets import QMessageBox  # type: ignore
 from qgis.PyQt.QtWidgets import QSizePolicy  # type: ignore
 
+from .colorize import values_to_img
 from .config import Configs
 from .config import CONFIG_FILE_PATH
 from .config import CustomMapColors
@@ -303,7 +304,7 @@ class CustomColorDialog(QtWidgets.QDialog, configs.custom_color_form):
             imgs = []
             for raster, colors in zip(rasters, self.COLOR_RAMP.values()):
                 cmap = custom_cmap.color_list_to_linear_cmap(colors)
-                img = cmap.values_to_img(raster, "inta").astype("uint8")
+                img = values_to_img(cmap, raster)
                 img = Image.fromarray(img)
                 imgs.append(img)
             composited_img = None
@@ -0,0 +1,218 @@
+"""
+1回の実行で使用する DEM の配列。
+
+各材料の計算で毎回 GDAL から DEM を読み直すと、大きな DEM ではデコードとコピーが
+何度も発生する。ここでは DEM を1度だけ float32 で読み込み、Nodata のマスクも1度だけ
+計算する。配列は読み取り専用で、全ての材料の計算はこの配列を参照する。
+gdal_drawer のメソッドを使用する計算には、配列をコピーせずに参照する MEM データセットを渡す。
+"""
+
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from ..gdal_drawer.custom import CustomGdalDataset
+from ..gdal_drawer.custom import gdal_open
+from .pool import SharedArray
+from .pyramid import decimate
+from .tiling import Window
+from .tiling import iter_windows
+from .writer import set_config_options
+
+
+class DemBuffer(object):
+    """
+    ## Summary
+        float32 で読み込んだ DEM と、その Nodata のマスク。
+    Args:
+        array (np.ndarray): DEM の配列。Nodata は np.nan。
+        transform (tuple): GeoTransform
+        projection (str): 座標系のWKT
+        shared (SharedArray): 配列が共有メモリ上にある場合はその SharedArray
+    """
+
+    def __init__(
+        self,
+        array: np.ndarray,
+        transform: tuple,
+        projection: str,
+        shared: Optional[SharedArray] = None,
+    ):
+        self.array = np.ascontiguousarray(array, dtype="float32")
+        self.array.flags.writeable = False
+        self.transform = tuple(transform)
+        self.projection = projection
+        self.shared = shared
+        self._mask = None
+
+    @classmethod
+    def read(
+        cls,
+        dst: CustomGdalDataset,
+        window: Optional[Window] = None,
+        shared: bool = False,
+    ) -> "DemBuffer":
+        """
+        ## Summary
+            データセットから DEM を float32 で1度だけ読み込む。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット
+            window (Window): タイルの範囲。指定した場合はハローを含めた範囲を読み込む。
+            shared (bool): 共有メモリ上に読み込むかどうか。プロセスプールで計算する場合に
+                使用すると、ワーカーに渡す為のコピーが不要になる。
+        Returns:
+            DemBuffer: DEM の配列
+        """
+        if window is None:
+            x_off, y_off = 0, 0
+            x_size, y_size = dst.RasterXSize, dst.RasterYSize
+        else:
+            x_off, y_off = window.pad_x_off, window.pad_y_off
+            x_size, y_size = window.pad_x_size, window.pad_y_size
+        band = dst.GetRasterBand(1)
+        shared_array = None
+        if shared:
+            shared_array = SharedArray((y_size, x_size), "float32")
+            ary = shared_array.array
+            band.ReadAsArray(x_off, y_off, x_size, y_size, buf_obj=ary)
+        else:
+            ary = band.ReadAsArray(x_off, y_off, x_size, y_size).astype(
+                "float32", copy=False
+            )
+        nodata = band.GetNoDataValue()
+        if nodata is not None and not np.isnan(nodata):
+            ary[ary == np.float32(nodata)] = np.nan
+        transform = window_transform(dst.GetGeoTransform(), x_off, y_off)
+        return cls(ary, transform, dst.GetProjection(), shared_array)
+
+    @classmethod
+    def read_decimated(
+        cls, dst: CustomGdalDataset, factor: int, tile_size: int = 2048
+    ) -> "DemBuffer":
+        """
+        ## Summary
+            DEM をタイル毎に読み込み、倍率 x 倍率 のセルの平均で縮小してつなぎ合わせる。
+            全体を元の解像度で読み込まないので、大きな DEM でも縮小後の大きさのメモリで済む。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット
+            factor (int): 間引く倍率
+            tile_size (int): 1度に読み込むタイルの1辺のセル数
+        Returns:
+            DemBuffer: セルサイズが 'factor' 倍の DEM
+        """
+        x_size, y_size = dst.RasterXSize, dst.RasterYSize
+        coarse = np.empty((-(-y_size // factor), -(-x_size // factor)), dtype="float32")
+        # タイルの開始位置を倍率の倍数に揃えるので、全体を縮小した場合と同じ値になる
+        for window in iter_windows(x_size, y_size, tile_size, 0, align=factor):
+            tile = cls.read(dst, window)
+            block = decimate(tile.array, factor)
+            tile.release()
+            top = window.y_off // factor
+            left = window.x_off // factor
+            coarse[top : top + block.shape[0], left : left + block.shape[1]] = block
+        transform = decimated_transform(dst.GetGeoTransform(), factor)
+        return cls(coarse, transform, dst.GetProjection())
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.array.shape
+
+    @property
+    def cell_size(self) -> Tuple[float, float]:
+        """
+        ## Summary
+            (東西方向, 南北方向) のセルサイズ。計算用のデータセットはメートル単位の座標系。
+        """
+        return (abs(self.transform[1]), abs(self.transform[5]))
+
+    @property
+    def mask(self) -> np.ndarray:
+        """
+        ## Summary
+            Nodata のマスク。最初に参照した時に1度だけ計算する。
+        """
+        if self._mask is None:
+            self._mask = np.isnan(self.array)
+            self._mask.flags.writeable = False
+        return self._mask
+
+    @property
+    def has_nodata(self) -> bool:
+        return bool(self.mask.any())
+
+    def decimate(self, factor: int) -> "DemBuffer":
+        """
+        ## Summary
+            倍率 x 倍率 のセルの平均で縮小した DEM を作成する（`apps.pyramid.decimate`）。
+        Args:
+            factor (int): 間引く倍率
+        Returns:
+            DemBuffer: セルサイズが 'factor' 倍の DEM
+        """
+        coarse = decimate(self.array, factor)
+        transform = decimated_transform(self.transform, factor)
+        return DemBuffer(coarse, transform, self.projection)
+
+    def dataset(self) -> CustomGdalDataset:
+        """
+        ## Summary
+            配列をコピーせずに参照する MEM データセットを作成する。
+            GDAL のデータセットはスレッド間で共有できないので、呼び出す度に新しく作成する。
+            ポインタを参照する MEM データセットを開く設定（GDAL_MEM_ENABLE_OPEN）は、
+            このスレッドで開く間だけ有効にして元に戻す。
+        Returns:
+            CustomGdalDataset: DEM のデータセット
+        """
+        rows, cols = self.array.shape
+        path = (
+            f"MEM:::DATAPOINTER={self.array.ctypes.data},"
+            f"PIXELS={cols},LINES={rows},BANDS=1,DATATYPE=Float32"
+        )
+        config = {"GDAL_MEM_ENABLE_OPEN": "YES"}
+        previous = set_config_options(config, thread_local=True)
+        try:
+            dst = gdal_open(path)
+        finally:
+            set_config_options(previous, thread_local=True)
+        dst.SetGeoTransform(self.transform)
+        dst.SetProjection(self.projection)
+        dst.GetRasterBand(1).SetNoDataValue(np.nan)
+        return dst
+
+    def release(self) -> None:
+        """
+        ## Summary
+            共有メモリ上にある場合は解放する。
+        """
+        self.array = None
+        self._mask = None
+        if self.shared is not None:
+            self.shared.release()
+            self.shared = None
+
+
+def window_transform(transform: tuple, x_off: int, y_off: int) -> tuple:
+    """
+    ## Summary
+        ラスターの一部分を切り出した場合の GeoTransform を計算する。
+    """
+    return (
+        transform[0] + x_off * transform[1] + y_off * transform[2],
+        transform[1],
+        transform[2],
+        transform[3] + x_off * transform[4] + y_off * transform[5],
+        transform[4],
+        transform[5],
+    )
+
+
+def decimated_transform(transform: tuple, factor: int) -> tuple:
+    """
+    ## Summary
+        セルサイズを 'factor' 倍にした場合の GeoTransform を計算する。
+    """
+    transform = list(transform)
+    for i in (1, 2, 4, 5):
+        transform[i] *= factor
+    return tuple(transform)
@@ -0,0 +1,215 @@
+"""
+DEM の 3x3 近傍から計算する材料（傾斜、陰影起伏図、TRI）を NumPy で計算する。
+
+gdal_drawer（gdal.DEMProcessing）で材料毎に計算すると、材料毎に中間のデータセットが作成され、
+DEM 全体を何度も走査する。ここでは Horn 法で dz/dx と dz/dy を1度だけ計算し、同じ近傍から
+傾斜、陰影起伏図、TRI を行のブロック毎にまとめて計算する。
+"""
+
+import math
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from .options import HillshadeOptions
+
+# 複数方向の陰影起伏図で使用する光源の方位
+MULTI_DIRECTIONS = (225.0, 270.0, 315.0, 360.0)
+
+
+def _neighbour(
+    padded: np.ndarray, pad: int, rows: slice, cols: int, dy: int, dx: int
+) -> np.ndarray:
+    """
+    ## Summary
+        周囲を広げた配列から、(dy, dx) だけずらした近傍のビューを返す。
+    """
+    return padded[
+        pad + rows.start + dy : pad + rows.stop + dy,
+        pad + dx : pad + cols + dx,
+    ]
+
+
+def horn_gradient(
+    padded: np.ndarray,
+    pad: int,
+    rows: slice,
+    cols: int,
+    x_res: float,
+    y_res: float,
+    step: int = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ## Summary
+        Horn 法で東向きと北向きの勾配を計算する。
+    Args:
+        padded (np.ndarray): 周囲を `pad` セル広げた DEM
+        pad (int): 広げたセル数
+        rows (slice): 計算する行の範囲（広げる前の行番号）
+        cols (int): 列数（広げる前）
+        x_res (float): 東西方向のセルサイズ（メートル）
+        y_res (float): 南北方向のセルサイズ（メートル）
+        step (int): 近傍とするセルの間隔
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (dz/dx, dz/dy)。dz/dy は北向きが正。
+    """
+    s = step
+
+    def nb(dy, dx):
+        return _neighbour(padded, pad, rows, cols, dy * s, dx * s).astype("float64")
+
+    nw, n, ne = nb(-1, -1), nb(-1, 0), nb(-1, 1)
+    w, e = nb(0, -1), nb(0, 1)
+    sw, so, se = nb(1, -1), nb(1, 0), nb(1, 1)
+    dzdx = ((ne + 2 * e + se) - (nw + 2 * w + sw)) / (8 * s * x_res)
+    dzdy = ((nw + 2 * n + ne) - (sw + 2 * so + se)) / (8 * s * y_res)
+    return dzdx, dzdy
+
+
+def slope_from_gradient(dzdx: np.ndarray, dzdy: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        勾配から傾斜（度）を計算する。
+    """
+    return np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+
+
+def _illumination(
+    dzdx: np.ndarray, dzdy: np.ndarray, azimuth: float, altitude: float
+) -> np.ndarray:
+    """
+    ## Summary
+        光源の方向と地表面の法線の内積（cos）を計算する。方位は北から時計回りの度。
+    """
+    az = math.radians(azimuth)
+    alt = math.radians(altitude)
+    cang = (
+        math.sin(alt)
+        - dzdx * math.sin(az) * math.cos(alt)
+        - dzdy * math.cos(az) * math.cos(alt)
+    )
+    return cang / np.sqrt(1 + dzdx * dzdx + dzdy * dzdy)
+
+
+def hillshade_from_gradient(
+    dzdx: np.ndarray, dzdy: np.ndarray, options: HillshadeOptions
+) -> np.ndarray:
+    """
+    ## Summary
+        勾配から陰影起伏図を計算する。gdal.DEMProcessing と同じく 1 ~ 255 の値を返す。
+    Args:
+        dzdx (np.ndarray): 東向きの勾配
+        dzdy (np.ndarray): 北向きの勾配
+        options (HillshadeOptions): 陰影起伏図の設定
+    Returns:
+        np.ndarray: 陰影起伏図の配列
+    """
+    dzdx = dzdx * options.z_factor
+    dzdy = dzdy * options.z_factor
+    if options.hillshade_type == "multiple":
+        # 傾斜の方向に応じて4方向の光源を重み付けする（Mark, 1992）
+        xx = dzdx * dzdx
+        yy = dzdy * dzdy
+        xx_plus_yy = xx + yy
+        xy = dzdx * dzdy
+        weights = {
+            225.0: 0.5 * xx_plus_yy + xy,
+            270.0: xx,
+            315.0: 0.5 * xx_plus_yy - xy,
+            360.0: yy,
+        }
+        total = np.zeros_like(dzdx)
+        for azimuth in MULTI_DIRECTIONS:
+            cang = _illumination(dzdx, dzdy, azimuth, options.altitude)
+            total += weights[azimuth] * np.maximum(cang, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cang = total / (2 * xx_plus_yy)
+        # 平坦な場所は方位に依存しない
+        flat = xx_plus_yy == 0
+        cang[flat] = math.sin(math.radians(options.altitude))
+    else:
+        cang = _illumination(dzdx, dzdy, options.azimuth, options.altitude)
+        if options.combined:
+            # 陰影と傾斜を組み合わせる
+            angle = np.arccos(np.clip(cang, -1.0, 1.0))
+            slope = np.arctan(np.hypot(dzdx, dzdy))
+            cang = 1 - angle * slope / (math.pi / 2) ** 2
+    hillshade = 1 + 254 * np.maximum(cang, 0.0)
+    hillshade[np.isnan(cang)] = np.nan
+    return hillshade
+
+
+def tri_from_neighbours(
+    padded: np.ndarray, pad: int, rows: slice, cols: int
+) -> np.ndarray:
+    """
+    ## Summary
+        TRI（Riley, 1999）を計算する。中心と8近傍の差の二乗和の平方根。
+    """
+    center = _neighbour(padded, pad, rows, cols, 0, 0).astype("float64")
+    total = np.zeros_like(center)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0:
+                continue
+            diff = _neighbour(padded, pad, rows, cols, dy, dx) - center
+            total += diff * diff
+    return np.sqrt(total)
+
+
+def terrain_derivatives(
+    dem: np.ndarray,
+    x_res: float,
+    y_res: float,
+    slope_step: int = 1,
+    hillshade: Optional[HillshadeOptions] = None,
+    tri: bool = True,
+    block_rows: int = 256,
+) -> Dict[str, np.ndarray]:
+    """
+    ## Summary
+        傾斜、陰影起伏図、TRI を行のブロック毎にまとめて計算する。
+        ラスターの端は端のセルを複製して計算するので、Nodata は DEM の Nodata の周囲だけになる。
+    Args:
+        dem (np.ndarray): DEM の配列。Nodata は np.nan。
+        x_res (float): 東西方向のセルサイズ（メートル）
+        y_res (float): 南北方向のセルサイズ（メートル）
+        slope_step (int): 傾斜を計算する近傍の間隔（セル数）。1 の場合は陰影起伏図と同じ勾配を使用する。
+        hillshade (HillshadeOptions): 陰影起伏図の設定。None の場合は計算しない。
+        tri (bool): TRI を計算するかどうか。
+        block_rows (int): 1度に計算する行数
+    Returns:
+        Dict[str, np.ndarray]: 'slope', 'hillshade', 'tri' の float32 の配列。
+    """
+    rows, cols = dem.shape
+    slope_step = max(1, int(slope_step))
+    pad = slope_step
+    padded = np.pad(dem, pad, mode="edge")
+    outputs = {"slope": np.empty(dem.shape, dtype="float32")}
+    if hillshade is not None:
+        outputs["hillshade"] = np.empty(dem.shape, dtype="float32")
+    if tri:
+        outputs["tri"] = np.empty(dem.shape, dtype="float32")
+    for start in range(0, rows, block_rows):
+        block = slice(start, min(rows, start + block_rows))
+        if slope_step == 1 or hillshade is not None:
+            dzdx, dzdy = horn_gradient(padded, pad, block, cols, x_res, y_res)
+        if slope_step == 1:
+            outputs["slope"][block] = slope_from_gradient(dzdx, dzdy)
+        else:
+            outputs["slope"][block] = slope_from_gradient(
+                *horn_gradient(padded, pad, block, cols, x_res, y_res, slope_step)
+            )
+        if hillshade is not None:
+            outputs["hillshade"][block] = hillshade_from_gradient(dzdx, dzdy, hillshade)
+        if tri:
+            outputs["tri"][block] = tri_from_neighbours(padded, pad, block, cols)
+        # Horn 法は中心のセルを使用しないので、gdal.DEMProcessing と同じく Nodata に戻す
+        void = np.isnan(_neighbour(padded, pad, block, cols, 0, 0))
+        if void.any():
+            outputs["slope"][block][void] = np.nan
+            if hillshade is not None:
+                outputs["hillshade"][block][void] = np.nan
+    return outputs
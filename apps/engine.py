@@ -0,0 +1,1560 @@
+"""
+微地形図の計算エンジン。
+
+`TopoMapsDialog` や `QgsTask` に依存せず、`apps.options` のデータクラスと DEM から
+微地形図を作成する。QGIS のプラグインからはダイアログとタスクがこのエンジンを呼び出し、
+QGIS の外（サーバー上でのバッチ処理など）からは直接呼び出す事ができる。
+
+Examples:
+    >>> from apps.engine import TopoMapEngine
+    >>> engine = TopoMapEngine(spec)
+    >>> new_dst = engine.run("path/to/dem.tif")
+    >>> new_dst.save_dst("path/to/topo_map.tif")
+"""
+
+import concurrent.futures
+from dataclasses import replace
+import logging
+import os
+import tempfile
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from osgeo import gdal
+from PIL import Image
+from PIL import ImageEnhance
+from PIL import ImageFilter
+
+from ..gdal_drawer.custom import CustomGdalDataset
+from ..gdal_drawer.custom import gdal_open
+from ..gdal_drawer.kernels import kernels
+from ..gdal_drawer.utils.colors import CustomCmap
+from ..gdal_drawer.utils.colors import LinearColorMap
+from .cache import layer_cache
+from .cache import layer_keys
+from .colorize import ColorLut
+from .composite import Compositor
+from .dem_buffer import DemBuffer
+from .dem_buffer import window_transform
+from .derivatives import terrain_derivatives
+from .focal import fast_focal_mean
+from .focal import is_sparse_uniform
+from .focal import sparse_focal_mean
+from .options import FirstResampleSpec
+from .options import TopoMapSpec
+from .options import TpiOptions
+from .memory import MemoryMonitor
+from .pool import iter_layers_in_processes
+from .pyramid import decimate
+from .pyramid import decimation_factor
+from .pyramid import error_stats
+from .pyramid import upsample
+from .sampling import SamplingRaster
+from .smoothing import gaussian_filter
+from .smoothing import gaussian_radius
+from .spectral import convolved_means
+from .stats import LayerStats
+from .stats import StatsSketch
+from .stats import layer_stats
+from .stats import stats_cache
+from .tiling import FILL_NODATA_ITERATIONS
+from .tiling import EmptyTiles
+from .tiling import compute_halo
+from .tiling import fill_nodata_margin
+from .tiling import iter_windows
+from .tiling import slope_step
+from .tiling import unsharpn_mask_halo
+from .tiling import void_windows
+from .vsimem import is_memory_path
+from .vsimem import output_location
+from .writer import ArrayBlockWriter
+from .writer import GeoTiffBlockWriter
+from .writer import OutputProfile
+from .writer import image_dataset
+from .writer import output_profile
+from .writer import warp_to_profile
+from .xyz import TileExportOptions
+from .xyz import export_xyz_tiles
+from .xyz import is_tile_output
+
+custom_cmap = CustomCmap()
+
+MESSAGE_CATEGORY = "TopoMaps Plugin"
+
+# 材料を重ねる順番（下から）
+COMPOSITE_ORDER = ["hillshade", "tri", "mtpi", "tpi", "slope"]
+
+# 材料のグループ毎の進捗の増分。2枚目のTPIは 'tpi' のグループで計算する
+GROUP_PROGRESS = {"derivatives": 30, "tpi": 20, "mtpi": 25}
+
+RESAMPLE_ALGS = {
+    "Nearest Neighbour": gdal.GRA_NearestNeighbour,
+    "Bilinear": gdal.GRA_Bilinear,
+    "Cubic": gdal.GRA_Cubic,
+    "Cubic Spline": gdal.GRA_CubicSpline,
+}
+
+
+def group_progress(group: str, names: List[str]) -> int:
+    """
+    ## Summary
+        材料のグループの計算が終わった時の進捗の増分。
+    Args:
+        group (str): グループ名
+        names (List[str]): そのグループで計算した材料の名前
+    Returns:
+        int: 進捗の増分
+    """
+    progress = GROUP_PROGRESS[group]
+    if group == "tpi" and "mtpi" in names:
+        progress += GROUP_PROGRESS["mtpi"]
+    return progress
+
+
+def generate_kernel(
+    dst: CustomGdalDataset, options: TpiOptions, multiples: float = 1.0
+) -> np.ndarray:
+    """
+    ## Summary
+        TPIの畳み込み用のカーネルを生成する。
+    Args:
+        dst (CustomGdalDataset): 入力データセット
+        options (TpiOptions): TPIの設定
+        multiples (float): tpiのカーネルサイズを大きくする場合の倍率
+    Returns:
+        np.ndarray: カーネル。'org'の場合は None。
+    """
+    # multiplesが指定されている場合は、カーネルサイズを大きくする
+    sigma = options.sigma * multiples
+    distance = options.distance * multiples
+    cells = int(options.cells * multiples)
+    if options.kernel_spec == "org":
+        # gdal.DEMProcessing で計算するため、カーネルは不要
+        kernel = None
+    elif options.kernel_spec == "gauss":
+        kernel = kernels.gaussian_kernel(sigma, options.coef)
+    elif options.kernel_spec == "inv_gauss":
+        kernel = kernels.inverse_gaussian_kernel(sigma, options.coef)
+    elif options.metre_spec:
+        # 畳み込みのカーネルサイズをメートル単位で指定
+        if options.kernel_spec == "mean":
+            kernel = dst.mean_kernel_from_distance(distance, True)
+        else:
+            kernel = dst.doughnut_kernel_from_distance(distance, True)
+    else:
+        # 畳み込みのカーネルサイズをセル数で指定
+        if options.kernel_spec == "mean":
+            kernel = kernels.mean_kernel(cells)
+        else:
+            kernel = kernels.doughnut_kernel(cells)
+    return kernel
+
+
+def relative_alpha_change(cmap: LinearColorMap, coef: float) -> LinearColorMap:
+    """
+    ## Summary:
+        カラーマップの透過率を変更する。
+    Args:
+        cmap (LinearColorMap): matplotlib.colors.LinearSegmentedColormap のラッパークラス。
+        coef (float): 透過率の係数。
+    Returns:
+        LinearColorMap: 透過率を変更したカラーマップ。
+    """
+    new_colors = []
+    for color in cmap.get_registered_color("rgba"):
+        alpha = color[-1] * coef
+        if 1.0 < alpha:
+            alpha = 1.0
+        elif alpha < 0.0:
+            alpha = 0.0
+        new_colors.append([color[0], color[1], color[2], alpha])
+    new_cmap = custom_cmap.color_list_to_linear_cmap(new_colors)
+    return new_cmap
+
+
+class EngineReporter(object):
+    """
+    ## Summary
+        QGISの外でエンジンを実行する場合に使用するレポーター。
+        `apps.message.Message` と同じ名前のメソッドを受け付け、内容を logging に出力する。
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(MESSAGE_CATEGORY)
+
+    def __getattr__(self, name: str):
+        def report(MESSAGE_CATEGORY: str, *args) -> None:
+            txt = " ".join([name] + [str(arg) for arg in args])
+            self.logger.info(f"[{MESSAGE_CATEGORY}] {txt}")
+
+        return report
+
+
+class TopoMapEngine(object):
+    """
+    ## Summary
+        DEMから微地形図を作成するエンジン。
+    Args:
+        spec (TopoMapSpec): 微地形図の設定。`read_raster` と `resampling` だけを使用する
+            場合は None でもよい。
+        reporter (Any): ログの出力先。QGIS内では `apps.message.msg` を渡す。
+            Noneの場合は `EngineReporter` を使用する。
+        progress_callback (Callable[[float], None]): 進捗の増分を受け取る関数。
+        is_canceled (Callable[[], bool]): キャンセルされたかどうかを返す関数。
+    """
+
+    def __init__(
+        self,
+        spec: TopoMapSpec,
+        reporter=None,
+        progress_callback: Optional[Callable[[float], None]] = None,
+        is_canceled: Optional[Callable[[], bool]] = None,
+    ):
+        self.spec = spec
+        self.reporter = reporter if reporter is not None else EngineReporter()
+        self.progress_callback = progress_callback
+        self.is_canceled = is_canceled
+        # 透過率を変更したカラーマップとそのルックアップテーブル（タイル毎に作り直さない為）
+        self._cmaps = {}
+        self._luts = {}
+        # 入力データが投影座標系でなかった場合の元の座標系
+        self.in_crs = False
+        # 入力ラスターのパス。キャッシュのキーに使用する
+        self.source_path = None
+        # 材料毎のキャッシュのキー。統計値のキャッシュにも使用する
+        self._layer_keys = {}
+        # 全ての材料の画像化に使用する統計値。別の実行やワーカーと同じ色にする場合に、
+        # `decimated_stats` で求めた統計値や、前回の実行の `last_stats` を設定する。
+        self.frozen_stats: Optional[Dict[str, LayerStats]] = None
+        # 最後のタイル処理で使用した統計値
+        self.last_stats: Optional[Dict[str, LayerStats]] = None
+        # 最後の実行で実際に書き込んだ出力ファイルのパス。/vsimem 上の出力が上限を超える
+        # 場合は一時ファイルのパスになる
+        self.output_path = None
+
+    def _progress(self, value: float) -> None:
+        if self.progress_callback is not None:
+            self.progress_callback(value)
+
+    def _canceled(self) -> bool:
+        if self.is_canceled is None:
+            return False
+        return self.is_canceled()
+
+    def read_raster(self, file_path: str) -> CustomGdalDataset:
+        """
+        ## Summary:
+            Rasterの読み込み。メートル単位でない場合はUTM座標系に変換する。
+        Args:
+            file_path (str): 入力ラスターのパス。
+        Returns:
+            CustomGdalDataset: gdal.Dataset のラッパークラス。
+        """
+        self.reporter.start_read_raster(MESSAGE_CATEGORY)
+        dst = gdal_open(file_path)
+        self.in_crs = False
+        if not dst.check_crs_is_metre():
+            # メートル単位でない場合はUTM座標系に変換。
+            self.in_crs = dst.GetProjection()
+            dst = dst.estimate_utm_and_reprojected_dataset()
+        self.reporter.end_read_raster(MESSAGE_CATEGORY)
+        return dst
+
+    def resampling(
+        self, dst: CustomGdalDataset, spec: Optional[FirstResampleSpec] = None
+    ) -> CustomGdalDataset:
+        """
+        ## Summary:
+            Rasterのリサンプリング。
+        Args:
+            dst (CustomGdalDataset): 入力データセット。
+            spec (FirstResampleSpec): リサンプルの設定。Noneの場合はエンジンの設定を使用する。
+        Returns:
+            CustomGdalDataset: リサンプリング後のgdal.Dataset のラッパークラス。
+        """
+        spec = spec if spec is not None else self.spec.resample
+        if not spec.execute:
+            # リサンプリングを行わない場合はそのまま返す
+            return dst
+
+        self.reporter.start_resampling_raster(MESSAGE_CATEGORY)
+        self.reporter.resampling_spec(MESSAGE_CATEGORY, spec)
+        if spec.metre_spec:
+            # メートル単位でリサンプリング
+            new_dst = dst.resample_with_resol_spec(
+                x_resolution=spec.resolution,
+                y_resolution=spec.resolution,
+                resample_algorithm=RESAMPLE_ALGS.get(spec.smooth_alg),
+            )
+        else:
+            # セル数でリサンプリング
+            x_size = int(dst.RasterXSize * spec.denominator)
+            y_size = int(dst.RasterYSize * spec.denominator)
+            new_dst = dst.resample_with_cells_spec(
+                x_cells=x_size,
+                y_cells=y_size,
+                resample_algorithm=RESAMPLE_ALGS.get(spec.smooth_alg),
+            )
+        self.reporter.end_resampling_raster(MESSAGE_CATEGORY)
+        return new_dst
+
+    def prepare(self, file_path: str) -> CustomGdalDataset:
+        """
+        ## Summary:
+            入力ラスターを読み込み、リサンプルとサンプリングを行った計算用のデータセットを返す。
+        Args:
+            file_path (str): 入力ラスターのパス。
+        Returns:
+            CustomGdalDataset: 計算用のデータセット。
+        """
+        dst = self.read_raster(file_path)
+        dst = self.resampling(dst)
+        self._progress(10)
+        output_spec = self.spec.output
+        if output_spec.sample_only:
+            # サンプルを表示する場合は一部の範囲のみを切り抜く
+            sampling_raster = SamplingRaster(
+                dst, output_spec.sampling_max_rows, output_spec.sampling_max_cols
+            )
+            dst = sampling_raster.sample_dst
+        return dst
+
+    def derivative_arrays(self, dem: DemBuffer) -> Dict[str, np.ndarray]:
+        """
+        ## Summary:
+            傾斜、陰影起伏図、TRIを DEM の1回の走査で計算し、それぞれ平滑化する。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+        Returns:
+            Dict[str, np.ndarray]: 'slope', 'hillshade', 'tri' の配列。TRIを計算しない場合は
+                'tri' を含まない。
+        """
+        x_res, y_res = dem.cell_size
+        arrays = terrain_derivatives(
+            dem.array,
+            x_res,
+            y_res,
+            slope_step=slope_step(x_res, self.spec),
+            hillshade=self.spec.hillshade,
+            tri=self.spec.tri.execute,
+        )
+        arrays["slope"] = self.smooth_slope(arrays["slope"], dem)
+        tri_options = self.spec.tri
+        if "tri" in arrays and tri_options.execute_gaussian_filter:
+            # ガウシアンフィルタを適用
+            arrays["tri"] = self.smooth(arrays["tri"], tri_options.sigma)
+        hillshade_options = self.spec.hillshade
+        if hillshade_options.execute_gaussian_filter:
+            # ガウシアンフィルタを適用
+            arrays["hillshade"] = self.smooth(
+                arrays["hillshade"], hillshade_options.sigma
+            )
+        return arrays
+
+    def smooth(self, ary: np.ndarray, sigma: float) -> np.ndarray:
+        """
+        ## Summary:
+            ガウシアンフィルタを適用する。カーネルの打ち切り位置、FFT に切り替える半径、
+            FFT のブロックの大きさと Nodata の扱いは `ExecutionOptions` の設定を使用する。
+        Args:
+            ary (np.ndarray): 平滑化する配列。
+            sigma (float): 標準偏差（セル数）。
+        Returns:
+            np.ndarray: 平滑化した配列。
+        """
+        execution = self.spec.execution
+        kwargs = dict(
+            truncate=execution.smoothing_truncate,
+            fft_min_radius=execution.smoothing_fft_min_radius,
+            max_block=execution.fft_max_block,
+            normalized=execution.smoothing_nodata == "normalized",
+        )
+        radius = gaussian_radius(sigma, execution.smoothing_truncate)
+        factor = self.pyramid_factor(2 * radius + 1)
+        if factor == 1:
+            return gaussian_filter(ary, sigma, **kwargs)
+        # σ が大きい場合は、間引いた配列で平滑化してから元の解像度に戻す
+        nan_idx = np.isnan(ary)
+        coarse = gaussian_filter(decimate(ary, factor), sigma / factor, **kwargs)
+        smoothed = upsample(coarse, factor, ary.shape)
+        smoothed[nan_idx] = np.nan
+        return smoothed
+
+    def pyramid_factor(self, kernel_cells: int) -> int:
+        """
+        ## Summary:
+            カーネルの大きさから、ピラミッドで計算する場合の間引く倍率を決める。
+        Args:
+            kernel_cells (int): カーネルの1辺のセル数。
+        Returns:
+            int: 間引く倍率。ピラミッドを使用しない場合は 1。
+        """
+        execution = self.spec.execution
+        if not execution.pyramid:
+            return 1
+        return decimation_factor(
+            kernel_cells, execution.pyramid_min_kernel, execution.pyramid_max_factor
+        )
+
+    def smooth_slope(self, slope_ary: np.ndarray, dem: DemBuffer) -> np.ndarray:
+        """
+        ## Summary:
+            傾斜にガウシアンフィルタを適用する。
+        Args:
+            slope_ary (np.ndarray): 傾斜の配列。
+            dem (DemBuffer): 読み込み済みの DEM。Nodataを埋める際の座標に使用する。
+        Returns:
+            np.ndarray: 平滑化した傾斜の配列。
+        """
+        options = self.spec.slope
+        if not options.execute_gaussian_filter:
+            return slope_ary
+        if self.spec.execution.smoothing_nodata == "normalized":
+            # 正規化畳み込みでは Nodata を埋める必要がない
+            return self.smooth(slope_ary, options.sigma)
+        nan_idx = np.isnan(slope_ary)
+        voids = int(np.count_nonzero(nan_idx))
+        if voids:
+            # Nodata(np.nan)の周囲は平滑化で値が小さくなるので、Nodataを埋める。
+            slope_ary = self.fill_slope_voids(slope_ary, nan_idx, voids, dem)
+            _nan_idx = np.isnan(slope_ary)
+            if _nan_idx.any():
+                # Nodataが残っている場合は0.0に変更
+                slope_ary[_nan_idx] = 0.0
+        # ガウシアンフィルタを適用
+        slope_ary = self.smooth(slope_ary, options.sigma)
+        if voids:
+            # np.nanが含まれていた場合は、元に戻す
+            slope_ary[nan_idx] = np.nan
+        return slope_ary
+
+    def fill_slope_voids(
+        self, slope_ary: np.ndarray, nan_idx: np.ndarray, voids: int, dem: DemBuffer
+    ) -> np.ndarray:
+        """
+        ## Summary:
+            傾斜の Nodata を fill_nodata で埋める。ラスター全体ではなく、Nodata の領域毎に
+            探索距離と平滑化の繰り返し回数の分だけ広げた範囲で埋める。
+        Args:
+            slope_ary (np.ndarray): 傾斜の配列。書き換えられる。
+            nan_idx (np.ndarray): Nodata の位置
+            voids (int): Nodata のセル数
+            dem (DemBuffer): 読み込み済みの DEM。範囲の座標に使用する。
+        Returns:
+            np.ndarray: Nodata を埋めた傾斜の配列。
+        """
+        options = self.spec.slope
+        start = time.perf_counter()
+        margin = fill_nodata_margin(options.distance, min(dem.cell_size))
+        windows = void_windows(nan_idx, margin)
+        patches = []
+        for window, fill_idx in windows:
+            # 他の範囲で埋めた値を使わない様に、全ての範囲を埋めてから書き込む
+            rows, cols = window
+            transform = window_transform(dem.transform, cols.start, rows.start)
+            buffer = DemBuffer(np.array(slope_ary[window]), transform, dem.projection)
+            filled = buffer.dataset().fill_nodata(
+                options.distance, FILL_NODATA_ITERATIONS
+            ).array()
+            patches.append((window, fill_idx, filled[fill_idx]))
+        for window, fill_idx, values in patches:
+            slope_ary[window][fill_idx] = values
+        self.reporter.nodata_fill(
+            MESSAGE_CATEGORY, voids, len(windows), time.perf_counter() - start
+        )
+        return slope_ary
+
+    def tpi_scales(self) -> List[float]:
+        """
+        ## Summary:
+            計算するTPIのカーネルの倍率。1枚目は 1.0、2枚目は 'multiples_distance'。
+        """
+        options = self.spec.tpi
+        if options.multiple_tpi:
+            return [1.0, options.multiples_distance]
+        return [1.0]
+
+    def focal_mean(
+        self, dem: DemBuffer, kernel: np.ndarray, multiples: float = 1.0
+    ) -> Optional[np.ndarray]:
+        """
+        ## Summary:
+            FFT で畳み込むよりも速く計算できるカーネルの場合に、近傍の平均を計算する。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+            kernel (np.ndarray): TPIのカーネル
+            multiples (float): カーネルの倍率
+        Returns:
+            np.ndarray: 近傍の平均。FFT で畳み込む場合は None。
+        """
+        options = self.spec.tpi
+        mean = None
+        if options.algorithm == "fast":
+            # カーネルの大きさに依存しない計算量で近傍の平均を計算
+            mean = fast_focal_mean(
+                dem.array, options.kernel_spec, kernel, options.sigma * multiples
+            )
+        if mean is None and is_sparse_uniform(kernel, dem.shape, dem.has_nodata):
+            # ドーナツカーネル等の疎なカーネルは、非ゼロの区間だけを合計
+            mean = sparse_focal_mean(dem.array, kernel)
+        return mean
+
+    def tpi_stack(self, dem: DemBuffer, scales: List[float]) -> List[np.ndarray]:
+        """
+        ## Summary:
+            カーネルの倍率を変えた複数のTPIを計算する。FFT で畳み込むカーネルは、DEM の FFT を
+            1度だけ計算して全ての倍率で使い回す。ピラミッドを使用する場合、大きなカーネルの
+            近傍の平均は間引いた DEM で計算し、元の解像度に補間してから DEM との差を取る。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+            scales (List[float]): カーネルの倍率のリスト
+        Returns:
+            List[np.ndarray]: 倍率毎のTPIの配列。
+        """
+        options = self.spec.tpi
+        dst = dem.dataset()
+        tpi_arrays: List[Optional[np.ndarray]] = [None] * len(scales)
+        levels: Dict[int, List[Tuple[int, float, Optional[np.ndarray]]]] = {}
+        for i, multiples in enumerate(scales):
+            kernel = generate_kernel(dst, options, multiples)
+            if kernel is None:
+                # gdal.DEMProcessing()を使ってTPIを計算
+                tpi_arrays[i] = dst.tpi(return_array=True)
+                continue
+            factor = self.pyramid_factor(max(kernel.shape))
+            if 1 < factor:
+                # 間引いた DEM の解像度でカーネルを作り直す
+                kernel = None
+            levels.setdefault(factor, []).append((i, multiples, kernel))
+        for factor, items in levels.items():
+            level = dem if factor == 1 else dem.decimate(factor)
+            means = self.focal_means(
+                level, [(multiples, kernel) for _, multiples, kernel in items], factor
+            )
+            for (i, _, _), mean in zip(items, means):
+                if 1 < factor:
+                    mean = upsample(mean, factor, dem.shape)
+                tpi_arrays[i] = dem.array - mean
+        return tpi_arrays
+
+    def focal_means(
+        self,
+        level: DemBuffer,
+        items: List[Tuple[float, Optional[np.ndarray]]],
+        factor: int = 1,
+    ) -> List[np.ndarray]:
+        """
+        ## Summary:
+            TPIの近傍の平均を計算する。FFT で畳み込むカーネルは、DEM の FFT を共有する。
+        Args:
+            level (DemBuffer): DEM、またはピラミッドで間引いた DEM。
+            items (List[Tuple[float, np.ndarray]]): カーネルの倍率とカーネルのリスト。
+                カーネルが None の場合は 'level' の解像度で作成する。
+            factor (int): 'level' の間引いた倍率
+        Returns:
+            List[np.ndarray]: 'level' の解像度の近傍の平均のリスト。
+        """
+        options = self.spec.tpi
+        level_dst = None
+        means: List[Optional[np.ndarray]] = [None] * len(items)
+        convolved = {}
+        for j, (multiples, kernel) in enumerate(items):
+            if not (options.metre_spec and options.kernel_spec in ("mean", "doughnut")):
+                # セル数で指定するカーネルは、間引いた分だけ小さくする
+                multiples = multiples / factor
+            if kernel is None:
+                level_dst = level_dst or level.dataset()
+                kernel = generate_kernel(level_dst, options, multiples)
+            mean = self.focal_mean(level, kernel, multiples)
+            if mean is None:
+                convolved[j] = kernel
+                continue
+            means[j] = mean
+        if convolved:
+            # 同じ種類と解像度のカーネルのスペクトルは、タイルや実行を跨いで使い回す
+            key = (options.kernel_spec, level.cell_size)
+            convolved_ary = convolved_means(
+                level.array,
+                list(convolved.values()),
+                [key] * len(convolved),
+                max_block=self.spec.execution.fft_max_block,
+            )
+            for j, mean in zip(convolved, convolved_ary):
+                means[j] = mean
+        return means
+
+    def tpi_array(self, dem: DemBuffer, multiples: bool = False) -> np.ndarray:
+        """
+        ## Summary:
+            TPIを計算する。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+            multiples (bool): 2枚目のTPIを計算するかどうか。
+        Returns:
+            np.ndarray: TPIの配列。
+        """
+        scale = self.spec.tpi.multiples_distance if multiples else 1.0
+        return self.tpi_stack(dem, [scale])[0]
+
+    def pyramid_error_report(
+        self, dst: CustomGdalDataset
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        ## Summary:
+            ピラミッドで計算した材料と、元の解像度で計算した材料の差をログに出力する。
+            'pyramid_min_kernel' と 'pyramid_max_factor' を選ぶ為に使用する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+        Returns:
+            Dict[str, Dict[str, float]]: 材料毎の `apps.pyramid.error_stats` の結果。
+        """
+        dem = DemBuffer.read(dst)
+        try:
+            arrays = {}
+            for pyramid in (False, True):
+                execution = replace(self.spec.execution, pyramid=pyramid)
+                engine = TopoMapEngine(
+                    replace(self.spec, execution=execution), reporter=self.reporter
+                )
+                arrays[pyramid] = engine.layer_arrays(dem, report=False)
+        finally:
+            dem.release()
+        report = {}
+        for name, full in arrays[False].items():
+            report[name] = error_stats(full, arrays[True][name])
+            self.reporter.pyramid_error(MESSAGE_CATEGORY, name, report[name])
+        return report
+
+    def start_generating_derivatives(self, dem: DemBuffer) -> Dict[str, np.ndarray]:
+        self.reporter.start_slope_calculation(MESSAGE_CATEGORY)
+        self.reporter.slope_spec(MESSAGE_CATEGORY, self.spec.slope)
+        self.reporter.start_tri_calculation(MESSAGE_CATEGORY)
+        if self.spec.tri.execute:
+            self.reporter.tri_spec(MESSAGE_CATEGORY, self.spec.tri)
+        self.reporter.start_hillshade_calculation(MESSAGE_CATEGORY)
+        self.reporter.hillshade_spec(MESSAGE_CATEGORY, self.spec.hillshade)
+        arrays = self.derivative_arrays(dem)
+        self._progress(30)
+        self.reporter.end_slope_calculation(MESSAGE_CATEGORY)
+        self.reporter.end_tri_calculation(MESSAGE_CATEGORY)
+        self.reporter.end_hillshade_calculation(MESSAGE_CATEGORY)
+        return arrays
+
+    def start_generating_tpi(self, dem: DemBuffer) -> Dict[str, np.ndarray]:
+        self.reporter.start_tpi_calculation(MESSAGE_CATEGORY)
+        self.reporter.tpi_spec(MESSAGE_CATEGORY, self.spec.tpi)
+        arrays = self.tpi_arrays(dem)
+        self._progress(group_progress("tpi", list(arrays)))
+        self.reporter.end_tpi_calculation(MESSAGE_CATEGORY)
+        return arrays
+
+    def tpi_arrays(self, dem: DemBuffer) -> Dict[str, np.ndarray]:
+        """
+        ## Summary:
+            TPIと2枚目のTPIを、DEM の FFT を共有して計算する。
+        Returns:
+            Dict[str, np.ndarray]: 'tpi' と 'mtpi' の配列。
+        """
+        names = ["tpi", "mtpi"]
+        return dict(zip(names, self.tpi_stack(dem, self.tpi_scales())))
+
+    def report_specs(self) -> None:
+        """
+        ## Summary:
+            各材料の設定をログに出力する。タイル処理ではタイル毎には出力しない。
+        """
+        self.reporter.slope_spec(MESSAGE_CATEGORY, self.spec.slope)
+        self.reporter.tpi_spec(MESSAGE_CATEGORY, self.spec.tpi)
+        if self.spec.tri.execute:
+            self.reporter.tri_spec(MESSAGE_CATEGORY, self.spec.tri)
+        self.reporter.hillshade_spec(MESSAGE_CATEGORY, self.spec.hillshade)
+
+    def layer_groups(self) -> Dict[str, List[str]]:
+        """
+        ## Summary:
+            一緒に計算する材料のグループ。傾斜、陰影起伏図、TRIは同じ勾配から計算する。
+        Returns:
+            Dict[str, List[str]]: グループ名と、そのグループで計算する材料の名前
+        """
+        derivatives = ["slope", "hillshade"]
+        if self.spec.tri.execute:
+            derivatives.append("tri")
+        # 2枚目のTPIは、1枚目と DEM の FFT を共有する為に同じグループで計算する
+        tpi = ["tpi", "mtpi"] if self.spec.tpi.multiple_tpi else ["tpi"]
+        return {"derivatives": derivatives, "tpi": tpi}
+
+    def compute_group(
+        self, group: str, dem: DemBuffer, report: bool = False
+    ) -> Dict[str, np.ndarray]:
+        """
+        ## Summary:
+            材料のグループを計算する。
+        Args:
+            group (str): 'derivatives', 'tpi'
+            dem (DemBuffer): 読み込み済みの DEM。
+            report (bool): 開始と終了をログに出力し、進捗を更新するかどうか。
+        Returns:
+            Dict[str, np.ndarray]: 材料毎の配列
+        """
+        if group == "derivatives":
+            if report:
+                return self.start_generating_derivatives(dem)
+            return self.derivative_arrays(dem)
+        if report:
+            return self.start_generating_tpi(dem)
+        return self.tpi_arrays(dem)
+
+    def iter_layer_arrays(
+        self,
+        dem: DemBuffer,
+        report: bool = True,
+        groups: Optional[Dict[str, List[str]]] = None,
+    ) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        ## Summary:
+            各材料を並列で計算し、グループの計算が終わった順に返す。全ての材料は同じ DEM の
+            配列を参照する。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+            report (bool): 各材料の開始と終了をログに出力し、進捗を更新するかどうか。
+            groups (Dict[str, List[str]]): 計算する材料のグループ。None の場合は全て。
+        Yields:
+            Tuple[str, np.ndarray]: 材料の名前と float32 の配列。計算しない材料は返さない。
+        """
+        execution = self.spec.execution
+        if groups is None:
+            groups = self.layer_groups()
+        if execution.backend == "process":
+            # 共有メモリに置いたDEMを使い、プロセスプールで計算する
+            if report:
+                self.report_specs()
+            for name, ary in iter_layers_in_processes(
+                dem, self.spec, groups, execution.max_workers
+            ):
+                yield name, ary
+            if report:
+                progress = [group_progress(g, names) for g, names in groups.items()]
+                self._progress(sum(progress))
+            return
+        # 並列処理で各材料を計算
+        with concurrent.futures.ThreadPoolExecutor(execution.max_workers) as executor:
+            futures = [
+                executor.submit(self.compute_group, group, dem, report)
+                for group in groups
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                for name, ary in future.result().items():
+                    if ary is not None:
+                        # タイル処理と全体の処理で結果を一致させる為、全て float32 に揃える
+                        yield name, np.asarray(ary, dtype="float32")
+
+    def layer_arrays(
+        self,
+        dem: DemBuffer,
+        report: bool = True,
+        groups: Optional[Dict[str, List[str]]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        ## Summary:
+            各材料を並列で計算する。
+        Args:
+            dem (DemBuffer): 読み込み済みの DEM。
+            report (bool): 各材料の開始と終了をログに出力し、進捗を更新するかどうか。
+            groups (Dict[str, List[str]]): 計算する材料のグループ。None の場合は全て。
+        Returns:
+            Dict[str, np.ndarray]: 'slope', 'tpi', 'mtpi', 'tri', 'hillshade' の配列（float32）。
+                計算しない材料は含まない。
+        """
+        return dict(self.iter_layer_arrays(dem, report, groups))
+
+    def iter_cached_layer_arrays(
+        self, dst: CustomGdalDataset
+    ) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        ## Summary:
+            キャッシュにある材料を先に返し、キャッシュにない材料は計算が終わった順に返す。
+            全ての材料がキャッシュにある場合は DEM を読み込まない。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+        Yields:
+            Tuple[str, np.ndarray]: 材料の名前と float32 の配列。
+        """
+        execution = self.spec.execution
+        groups = self.layer_groups()
+        keys = {}
+        if self.source_path is not None and 0 < execution.cache_max_bytes:
+            layer_cache.resize(execution.cache_max_bytes)
+            keys = layer_keys(self.source_path, self.spec)
+        self._layer_keys = keys
+        cached = {}
+        for name, key in keys.items():
+            ary = layer_cache.get(key)
+            if ary is not None:
+                cached[name] = ary
+        missing = {
+            group: names
+            for group, names in groups.items()
+            if not all(name in cached for name in names)
+        }
+        hit_groups = [group for group in groups if group not in missing]
+        if hit_groups:
+            names = [name for group in hit_groups for name in groups[group]]
+            self.reporter.layer_cache_hit(MESSAGE_CATEGORY, names)
+            progress = [group_progress(group, groups[group]) for group in hit_groups]
+            self._progress(sum(progress))
+            for name in names:
+                yield name, cached.pop(name)
+        cached = None
+        if not missing:
+            return
+        # DEM は1度だけ読み込み、全ての材料で同じ配列を使用する
+        dem = DemBuffer.read(dst, shared=execution.backend == "process")
+        try:
+            for name, ary in self.iter_layer_arrays(dem, groups=missing):
+                if name in keys:
+                    layer_cache.put(keys[name], ary)
+                yield name, ary
+        finally:
+            dem.release()
+
+    def composite_incrementally(
+        self, dst: CustomGdalDataset, monitor: Optional[MemoryMonitor] = None
+    ) -> Optional[np.ndarray]:
+        """
+        ## Summary:
+            材料を計算しながら合成する。重ねる順番が来た材料から画像に変換して重ね、
+            重ねた材料の配列はすぐに解放する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            monitor (MemoryMonitor): メモリ使用量の記録先。
+        Returns:
+            np.ndarray: 合成した (rows, cols, 4) の uint8 の配列。`Compositor` の配列を
+                コピーせずに返す。キャンセルされた場合は None。
+        """
+        monitor = monitor if monitor is not None else MemoryMonitor()
+        enabled = [name for names in self.layer_groups().values() for name in names]
+        order = [name for name in COMPOSITE_ORDER if name in enabled]
+        pending = {}
+        compositor = None
+        img = None
+        for name, ary in self.iter_cached_layer_arrays(dst):
+            pending[name] = ary
+            ary = None
+            monitor.sample()
+            if self._canceled():
+                return None
+            while order and order[0] in pending:
+                layer = order.pop(0)
+                layer_ary = pending.pop(layer)
+                if compositor is None:
+                    self.reporter.start_composite_image(MESSAGE_CATEGORY)
+                    shape = layer_ary.shape
+                    compositor = Compositor(shape, self.spec.execution.max_workers)
+                    img = np.empty(shape + (4,), dtype="uint8")
+                stats = self.cached_layer_stats(layer, layer_ary)
+                self.layer_to_img(layer, layer_ary, stats, out=img)
+                layer_ary = None
+                compositor.over(img)
+                monitor.sample()
+        img = None
+        self.reporter.end_composite_image(MESSAGE_CATEGORY)
+        return compositor.image
+
+    def outlier_threshold(self, name: str) -> Optional[float]:
+        """
+        ## Summary:
+            材料の外れ値処理に使用するIQRの倍率を返す。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+        Returns:
+            float: IQRの倍率。外れ値処理を行わない場合は None。
+        """
+        options = {
+            "tpi": self.spec.tpi,
+            "mtpi": self.spec.tpi,
+            "tri": self.spec.tri,
+            "hillshade": self.spec.hillshade,
+        }.get(name)
+        if options is None or not options.execute_outlier_treatment:
+            return None
+        return options.iqr
+
+    def layer_cmap(self, name: str) -> LinearColorMap:
+        """
+        ## Summary:
+            材料のカラーマップを返す。透過率の変更が指定されている場合は変更したもの。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+        Returns:
+            LinearColorMap: カラーマップ
+        """
+        if name in self._cmaps:
+            return self._cmaps[name]
+        output = self.spec.output
+        cmap, options = {
+            "slope": (output.slope_cmap, self.spec.slope),
+            "tpi": (output.tpi_cmap, self.spec.tpi),
+            "mtpi": (output.tpi_cmap, self.spec.tpi),
+            "tri": (output.tri_cmap, self.spec.tri),
+            "hillshade": (output.hillshade_cmap, None),
+        }[name]
+        if options is not None and options.change_alpha:
+            # 透過率を変更
+            cmap = relative_alpha_change(cmap, options.alpha)
+        self._cmaps[name] = cmap
+        return cmap
+
+    def layer_lut(self, name: str) -> ColorLut:
+        """
+        ## Summary:
+            材料のカラーマップを変換したルックアップテーブルを返す。2枚目のTPIはアルファを
+            0.6倍したものを返す。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+        Returns:
+            ColorLut: ルックアップテーブル
+        """
+        if name not in self._luts:
+            alpha_coef = 0.6 if name == "mtpi" else 1.0
+            self._luts[name] = ColorLut.from_cmap(
+                self.layer_cmap(name), alpha_coef=alpha_coef
+            )
+        return self._luts[name]
+
+    def layer_stats(self, arrays: Dict[str, np.ndarray]) -> Dict[str, LayerStats]:
+        """
+        ## Summary:
+            各材料の統計値を計算する。
+        Args:
+            arrays (Dict[str, np.ndarray]): 材料の配列。タイル処理では全体をつなぎ合わせたもの。
+        Returns:
+            Dict[str, LayerStats]: 材料毎の統計値
+        """
+        return {
+            name: self.cached_layer_stats(name, ary) for name, ary in arrays.items()
+        }
+
+    def cached_layer_stats(self, name: str, ary: np.ndarray) -> LayerStats:
+        """
+        ## Summary:
+            材料の統計値を計算する。キャッシュした材料の配列を使用した場合は、統計値も
+            同じキーでキャッシュしたものを使用する。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+            ary (np.ndarray): 材料の配列
+        Returns:
+            LayerStats: 統計値
+        """
+        if self.frozen_stats is not None and name in self.frozen_stats:
+            return self.frozen_stats[name]
+        execution = self.spec.execution
+        quartiles = self.outlier_threshold(name) is not None
+        method = execution.quantile_method
+        key = self._layer_keys.get(name)
+        if key is not None:
+            key = (key, quartiles, method, execution.stats_pass)
+            stats = stats_cache.get(key)
+            if stats is not None:
+                return stats
+        if execution.stats_pass == "sketch":
+            # タイル処理と同じ方法で求め、全体を一度に計算した場合と同じ色にする
+            sketch = self.stats_sketch(name)
+            sketch.add(ary)
+            stats = sketch.stats()
+        else:
+            stats = layer_stats(ary, quartiles, method)
+        if key is not None:
+            stats_cache.put(key, stats)
+        return stats
+
+    def stats_sketch(self, name: str) -> StatsSketch:
+        """
+        ## Summary:
+            材料の統計値をタイル毎に追加して求める `StatsSketch` を作成する。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+        Returns:
+            StatsSketch: 外れ値処理を行う材料は四分位数も求める。
+        """
+        return StatsSketch(self.outlier_threshold(name) is not None)
+
+    def decimated_stats(
+        self, dst: CustomGdalDataset, factor: int
+    ) -> Dict[str, LayerStats]:
+        """
+        ## Summary:
+            間引いた DEM で各材料を計算し、その統計値を求める。タイルを計算する前に
+            全体の統計値を決める為に使用する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            factor (int): 間引く倍率
+        Returns:
+            Dict[str, LayerStats]: 材料毎の統計値
+        """
+        execution = self.spec.execution
+        dem = DemBuffer.read_decimated(dst, factor, execution.tile_size)
+        try:
+            arrays = self.layer_arrays(dem, report=False)
+        finally:
+            dem.release()
+        return {
+            name: layer_stats(
+                ary,
+                self.outlier_threshold(name) is not None,
+                execution.quantile_method,
+            )
+            for name, ary in arrays.items()
+        }
+
+    def layer_to_img(
+        self,
+        name: str,
+        ary: np.ndarray,
+        stats: LayerStats,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        ## Summary:
+            材料の配列に外れ値処理を行い、カラーマップで画像に変換する。
+        Args:
+            name (str): 'slope', 'tpi', 'mtpi', 'tri', 'hillshade'
+            ary (np.ndarray): 材料の配列
+            stats (LayerStats): 全体の統計値
+            out (np.ndarray): 書き込む (rows, cols, 4) の uint8 の配列。
+        Returns:
+            np.ndarray: (rows, cols, 4) の uint8 の画像。
+        """
+        # 外れ値処理後の範囲で正規化すると、範囲外の値は端の色になるので、外れ値を丸めた
+        # 配列を別に作成する必要はない
+        value_range = stats.value_range(self.outlier_threshold(name))
+        return self.layer_lut(name).apply(ary, value_range, out)
+
+    def composite_images(
+        self,
+        slope_img: np.ndarray,
+        tpi_img: np.ndarray,
+        mtpi_img: np.ndarray,
+        tri_img: np.ndarray,
+        hillshade_img: np.ndarray,
+    ) -> Image.Image:
+        """
+        ## Summary:
+            画像を合成する。陰影起伏図、TRI、2枚目のTPI、TPI、傾斜の順に重ねる。
+        Args:
+            slope_img (np.ndarray): 傾斜の画像データ。
+            tpi_img (np.ndarray): TPIの画像データ。
+            mtpi_img (np.ndarray): 2枚目のTPIの画像データ。None の場合は重ねない。
+            tri_img (np.ndarray): TRIの画像データ。None の場合は重ねない。
+            hillshade_img (np.ndarray): 陰影起伏図の画像データ。
+        Returns:
+            Image.Image: 合成された画像データ。
+        """
+        imgs = {
+            "hillshade": hillshade_img,
+            "tri": tri_img,
+            "mtpi": mtpi_img,
+            "tpi": tpi_img,
+            "slope": slope_img,
+        }
+        compositor = Compositor(
+            hillshade_img.shape[:2], self.spec.execution.max_workers
+        )
+        for name in COMPOSITE_ORDER:
+            if imgs[name] is not None:
+                compositor.over(imgs[name])
+        return Image.fromarray(compositor.image)
+
+    def composite_layers(
+        self, arrays: Dict[str, np.ndarray], stats: Dict[str, LayerStats]
+    ) -> Image.Image:
+        """
+        ## Summary:
+            材料の配列を画像に変換して合成する。画像に変換する配列は1枚だけ用意して使い回す。
+        Args:
+            arrays (Dict[str, np.ndarray]): 材料の配列
+            stats (Dict[str, LayerStats]): 全体の統計値
+        Returns:
+            Image.Image: 合成された画像データ。
+        """
+        shape = np.shape(arrays["hillshade"])
+        compositor = Compositor(shape, self.spec.execution.max_workers)
+        img = np.empty(shape + (4,), dtype="uint8")
+        for name in COMPOSITE_ORDER:
+            if name in arrays:
+                self.layer_to_img(name, np.asarray(arrays[name]), stats[name], out=img)
+                compositor.over(img)
+        return Image.fromarray(compositor.image)
+
+    def unsharpn_mask(self, img: Image.Image) -> Image.Image:
+        """
+        ## Summary:
+            unsharpn maskを適用して画像をシャープにする。
+        Args:
+            img (Image.Image): 画像データ。
+        Returns:
+            Image.Image: unsharpn maskを適用した画像データ。
+        """
+        options = self.spec.others
+        if not options.execute_unsharpn_mask:
+            return img
+        filter_ = ImageFilter.UnsharpMask(
+            radius=options.unsharpn_radius,
+            percent=options.unsharpn_percent,
+            threshold=options.unsharpn_threshold,
+        )
+        return img.filter(filter_)
+
+    def change_contrast(
+        self, img: Image.Image, mean: Optional[int] = None
+    ) -> Image.Image:
+        """
+        ## Summary:
+            画像のコントラストを変更する。
+        Args:
+            img (Image.Image): 画像データ。
+            mean (int): コントラストの基準にする輝度の平均値。タイル処理では全体の平均値を渡す。
+                None の場合は画像から計算する。
+        Returns:
+            Image.Image: コントラストを変更した画像データ。
+        """
+        options = self.spec.others
+        if not options.execute_contrast:
+            return img
+        enhancer = ImageEnhance.Contrast(img)
+        if mean is not None:
+            # ImageEnhance.Contrast は画像自身の平均輝度を基準にするので、全体の平均値に置き換える
+            degenerate = Image.new("L", img.size, mean).convert(img.mode)
+            if "A" in img.getbands():
+                degenerate.putalpha(img.getchannel("A"))
+            enhancer.degenerate = degenerate
+        return enhancer.enhance(options.contrast_value)
+
+    def image_to_gdal_dataset(
+        self, img: np.ndarray, dst: CustomGdalDataset
+    ) -> CustomGdalDataset:
+        """
+        ## Summary:
+            画像をGDALデータセットに変換する。
+        Args:
+            img (np.ndarray): 画像データ。
+            dst (CustomGdalDataset): gdal.Dataset のラッパークラス。
+        Returns:
+            CustomGdalDataset: 画像をGDALデータセットに変換したもの。
+        """
+        # バンド毎の配列にコピーせず、画像の配列をそのまま参照する
+        return image_dataset(img, dst.GetGeoTransform(), dst.GetProjection())
+
+    def use_tiles(self, dst: CustomGdalDataset) -> bool:
+        """
+        ## Summary:
+            タイルに分割して計算するかどうかを判定する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+        Returns:
+            bool: タイルで計算する場合は True。
+        """
+        execution = self.spec.execution
+        if self.spec.output.sample_only:
+            return False
+        if execution.tiled is not None:
+            return execution.tiled
+        cells = dst.RasterXSize * dst.RasterYSize
+        return execution.whole_raster_max_cells < cells
+
+    def generate(
+        self, dst: CustomGdalDataset, sink: Optional[GeoTiffBlockWriter] = None
+    ) -> Optional[CustomGdalDataset]:
+        """
+        ## Summary:
+            計算用のデータセットから各材料を計算し、合成した微地形図を返す。
+            ラスターが大きい場合はタイルに分割して計算する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            sink (GeoTiffBlockWriter): 出力先。指定した場合は出来上がったブロックから順に
+                書き込み、書き込んだファイルを開いて返す。None の場合はメモリ上に作成する。
+        Returns:
+            CustomGdalDataset: 微地形図のデータセット。キャンセルされた場合は None。
+        """
+        if self.use_tiles(dst):
+            return self.generate_tiled(dst, sink)
+        monitor = MemoryMonitor()
+        # 材料の計算と画像の合成
+        composited = self.composite_incrementally(dst, monitor)
+        if composited is None:
+            return None
+        self._progress(5)
+        others = self.spec.others
+        if others.execute_unsharpn_mask or others.execute_contrast:
+            composited = Image.fromarray(composited)
+            # 画像をシャープにする
+            composited = self.unsharpn_mask(composited)
+            self._progress(3)
+            # コントラストを変更
+            composited = self.change_contrast(composited)
+            self._progress(3)
+        else:
+            self._progress(6)
+        monitor.sample()
+        self.reporter.peak_memory(MESSAGE_CATEGORY, monitor.peak, monitor.increase)
+        if sink is not None:
+            self.write_rows(composited, sink)
+            composited = None
+            return gdal_open(sink.close())
+        # 画像をGDALデータセットに変換
+        return self.image_to_gdal_dataset(np.asarray(composited), dst)
+
+    def write_rows(self, img, sink: GeoTiffBlockWriter) -> None:
+        """
+        ## Summary:
+            画像を出力先のブロックの高さ毎に書き込む。全体を1度に配列へ変換すると画像が
+            2枚分メモリに載るので、PIL の画像は1ブロック分ずつ切り出して変換する。
+        Args:
+            img (Image.Image | np.ndarray): 書き込む画像。配列はそのまま参照して書き込む。
+            sink (GeoTiffBlockWriter): 出力先。
+        """
+        is_pil = isinstance(img, Image.Image)
+        cols, rows = img.size if is_pil else img.shape[1::-1]
+        for y_off in range(0, rows, sink.block_size):
+            y_end = min(rows, y_off + sink.block_size)
+            if is_pil:
+                block = np.asarray(img.crop((0, y_off, cols, y_end)))
+            else:
+                block = img[y_off:y_end]
+            sink.write(block, 0, y_off)
+
+    def generate_tiled(
+        self, dst: CustomGdalDataset, sink: Optional[GeoTiffBlockWriter] = None
+    ) -> Optional[CustomGdalDataset]:
+        """
+        ## Summary:
+            ラスターをタイルに分割して微地形図を作成する。
+            各タイルはカーネルの半径分広げて計算し、ハローを切り取ってから一時ファイル上の
+            配列につなぎ合わせる。外れ値処理の閾値とカラーマップの範囲は全体の統計値から
+            決めるので、全てのタイルが同じ色の基準になる。統計値はタイルを計算しながら
+            `StatsSketch` にまとめるか、'stats_decimation' を指定した場合は間引いた DEM で
+            事前に求め、`frozen_stats` を設定した場合はそれを使用する。
+            'skip_empty_tiles' が True の場合、Nodata だけのタイルは計算せずに配列を np.nan で
+            埋める。Nodata のセルではどの材料も np.nan になるので、結果は変わらない。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            sink (GeoTiffBlockWriter): 出力先。None の場合はメモリ上に作成する。
+        Returns:
+            CustomGdalDataset: 微地形図のデータセット。キャンセルされた場合は None。
+        """
+        execution = self.spec.execution
+        tpi_options = self.spec.tpi
+        tpi_kernels = [generate_kernel(dst, tpi_options)]
+        if tpi_options.multiple_tpi:
+            tpi_kernels.append(
+                generate_kernel(dst, tpi_options, tpi_options.multiples_distance)
+            )
+        halo = compute_halo(dst, self.spec, tpi_kernels)
+        align = 1
+        if execution.pyramid:
+            # 間引いたセルの境界をタイル間で揃え、補間で参照するセルの分だけハローを広げる
+            align = execution.pyramid_max_factor
+            halo += align
+        x_size, y_size = dst.RasterXSize, dst.RasterYSize
+        windows = list(iter_windows(x_size, y_size, execution.tile_size, halo, align))
+        self.reporter.tiled_spec(
+            MESSAGE_CATEGORY, len(windows), execution.tile_size, halo
+        )
+        self.report_specs()
+        # プロセスプールで計算する場合は、タイルの DEM を直接共有メモリに読み込む
+        shared = execution.backend == "process"
+        # タイル処理ではキャッシュを使用しないので、統計値もキャッシュしない
+        self._layer_keys = {}
+        # 全てのタイルで同じ統計値を使用する。事前に決めない場合はタイルを計算しながら求める
+        stats = self.frozen_stats
+        stats_source = "frozen"
+        if stats is None and 1 < execution.stats_decimation:
+            stats = self.decimated_stats(dst, execution.stats_decimation)
+            stats_source = "decimated"
+        sketches = None
+        if stats is None and execution.stats_pass == "sketch":
+            sketches = {}
+        empty = None
+        if execution.skip_empty_tiles:
+            empty = EmptyTiles(x_size, y_size, execution.tile_size, align)
+        monitor = MemoryMonitor()
+        with tempfile.TemporaryDirectory(suffix="_topoMaps") as temp_dir:
+            # 最初のタイルが Nodata だけの場合も np.nan で埋める為、先に全て作成する
+            layers = {
+                name: np.memmap(
+                    os.path.join(temp_dir, f"{name}.dat"),
+                    dtype="float32",
+                    mode="w+",
+                    shape=(y_size, x_size),
+                )
+                for names in self.layer_groups().values()
+                for name in names
+            }
+            for window in windows:
+                if self._canceled():
+                    return None
+                tile_dem = DemBuffer.read(dst, window, shared=shared)
+                if empty is not None and tile_dem.mask[window.crop].all():
+                    # ハローとして周囲のタイルから読み込まれるだけなので、計算しない
+                    tile_dem.release()
+                    tile_dem = None
+                    empty.add(window)
+                    for ary in layers.values():
+                        ary[window.slices] = np.nan
+                    self._progress(75 / len(windows))
+                    continue
+                try:
+                    arrays = self.layer_arrays(tile_dem, report=False)
+                finally:
+                    tile_dem.release()
+                tile_dem = None
+                for name, ary in arrays.items():
+                    if ary.shape != (window.pad_y_size, window.pad_x_size):
+                        raise ValueError(
+                            f"Tile shape mismatch: {ary.shape} != "
+                            f"{(window.pad_y_size, window.pad_x_size)}"
+                        )
+                    layers[name][window.slices] = ary[window.crop]
+                    if sketches is not None:
+                        if name not in sketches:
+                            sketches[name] = self.stats_sketch(name)
+                        sketches[name].add(ary[window.crop])
+                arrays = None
+                monitor.sample()
+                self._progress(75 / len(windows))
+            if empty is not None:
+                self.reporter.empty_tiles(MESSAGE_CATEGORY, empty.count, len(windows))
+            # 画像の合成
+            self.reporter.start_composite_image(MESSAGE_CATEGORY)
+            if sketches is not None:
+                stats = {name: sketch.stats() for name, sketch in sketches.items()}
+                stats_source = "sketch"
+                sketches = None
+            elif stats is None:
+                stats = self.layer_stats(layers)
+                stats_source = "exact"
+            missing = {name: ary for name, ary in layers.items() if name not in stats}
+            if missing:
+                stats = {**stats, **self.layer_stats(missing)}
+            self.last_stats = stats
+            self.reporter.global_stats(MESSAGE_CATEGORY, stats_source, stats)
+            writer = sink
+            if writer is None:
+                writer = ArrayBlockWriter(
+                    os.path.join(temp_dir, "output.dat"), x_size, y_size
+                )
+            completed = self.composite_tiled(layers, stats, temp_dir, writer, empty)
+            layers = None
+            self.reporter.end_composite_image(MESSAGE_CATEGORY)
+            if not completed:
+                return None
+            monitor.sample()
+            self.reporter.peak_memory(MESSAGE_CATEGORY, monitor.peak, monitor.increase)
+            if sink is not None:
+                return gdal_open(sink.close())
+            # 一時フォルダは削除されるので、memmap をメモリに読み込んでから変換する
+            return self.image_to_gdal_dataset(np.array(writer.array), dst)
+
+    def composite_tiled(
+        self,
+        layers: Dict[str, np.ndarray],
+        stats: Dict[str, LayerStats],
+        temp_dir: str,
+        sink,
+        empty: Optional[EmptyTiles] = None,
+    ) -> bool:
+        """
+        ## Summary:
+            つなぎ合わせた材料の配列をタイル毎に画像に変換し、合成、unsharpn mask、
+            コントラストの変更を行って出力先に書き込む。
+            Nodata だけのタイルに含まれる範囲は透明（全て 0）になるので、合成せずに
+            書き込みも省略する。出力先は書き込まなかった範囲が 0 になる。
+        Args:
+            layers (Dict[str, np.ndarray]): つなぎ合わせた材料の配列
+            stats (Dict[str, LayerStats]): 全体の統計値
+            temp_dir (str): コントラストの変更前の画像を保存する一時フォルダ
+            sink (GeoTiffBlockWriter | ArrayBlockWriter): 出力先
+            empty (EmptyTiles): Nodata だけのタイル。None の場合は全ての範囲を合成する。
+        Returns:
+            bool: 最後まで書き込んだ場合は True。キャンセルされた場合は False。
+        """
+        execution = self.spec.execution
+        others = self.spec.others
+        y_size, x_size = layers["slope"].shape
+        halo = 0
+        if others.execute_unsharpn_mask:
+            halo = unsharpn_mask_halo(others.unsharpn_radius)
+        # コントラストは全体の平均輝度を基準にするので、変更前の画像を一時ファイルに残す
+        first_sink = sink
+        if others.execute_contrast:
+            first_sink = ArrayBlockWriter(
+                os.path.join(temp_dir, "composited.dat"), x_size, y_size
+            )
+        luminance = 0.0
+        for window in iter_windows(x_size, y_size, execution.tile_size, halo):
+            if self._canceled():
+                return False
+            if empty is not None and empty.covers(*window.pad_slices):
+                continue
+            tile_arrays = {name: ary[window.pad_slices] for name, ary in layers.items()}
+            img = self.composite_layers(tile_arrays, stats)
+            img = self.unsharpn_mask(img)
+            rows, cols = window.crop
+            img = img.crop((cols.start, rows.start, cols.stop, rows.stop))
+            if others.execute_contrast:
+                luminance += np.asarray(img.convert("L"), dtype="float64").sum()
+            first_sink.write(np.asarray(img), window.x_off, window.y_off)
+        self._progress(8)
+        if others.execute_contrast:
+            mean = int(luminance / (x_size * y_size) + 0.5)
+            composited = first_sink.array
+            # 透明な画素もコントラストの変更で RGB が変わるので、空の範囲は1画素分だけ計算する
+            blank = np.asarray(self.change_contrast(Image.new("RGBA", (1, 1)), mean))
+            for window in iter_windows(x_size, y_size, execution.tile_size, 0):
+                if empty is not None and empty.covers(*window.slices):
+                    if blank.any():
+                        img = np.empty((window.y_size, window.x_size, 4), dtype="uint8")
+                        img[...] = blank[0, 0]
+                        sink.write(img, window.x_off, window.y_off)
+                    continue
+                img = Image.fromarray(np.asarray(composited[window.slices]))
+                img = self.change_contrast(img, mean)
+                sink.write(np.asarray(img), window.x_off, window.y_off)
+        self._progress(3)
+        return True
+
+    def export_tiles(
+        self, dst: CustomGdalDataset, output_path: str
+    ) -> Optional[CustomGdalDataset]:
+        """
+        ## Summary:
+            微地形図を作成し、Web メルカトルの XYZ タイルとして MBTiles または GeoPackage に
+            書き出す。合成した RGBA の画像を一時ファイルにブロック毎に書き込み、
+            `apps.xyz.export_xyz_tiles` で EPSG:3857 に1度だけ変換してタイルにする。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            output_path (str): 出力ファイルのパス（'.mbtiles' または '.gpkg'）。
+        Returns:
+            CustomGdalDataset: 書き出したタイルのデータセット。キャンセルされた場合は None。
+        """
+        output = self.spec.output
+        options = TileExportOptions(
+            tile_format=output.tile_format,
+            min_zoom=output.min_zoom,
+            max_zoom=output.max_zoom,
+            max_workers=self.spec.execution.max_workers,
+        )
+        with tempfile.TemporaryDirectory(suffix="_topoMaps") as temp_dir:
+            # Nodata を透明にする為、アルファを含めて書き込む
+            temp_path = os.path.join(temp_dir, "topo_map.tif")
+            sink = GeoTiffBlockWriter.like(
+                dst, temp_path, bands=4, profile=OutputProfile()
+            )
+            new_dst = self.generate_into(dst, sink)
+            dst = None
+            if new_dst is None:
+                return None
+            new_dst = None
+            result = export_xyz_tiles(temp_path, output_path, options, self._canceled)
+        if result is None:
+            return None
+        self.reporter.tile_export(
+            MESSAGE_CATEGORY, result["min_zoom"], result["max_zoom"], result["tiles"]
+        )
+        return gdal_open(output_path)
+
+    def run(
+        self, file_path: str, output_path: Optional[str] = None
+    ) -> Optional[CustomGdalDataset]:
+        """
+        ## Summary:
+            入力ラスターの読み込みから微地形図の作成までを実行する。
+        Args:
+            file_path (str): 入力ラスターのパス。
+            output_path (str): 出力する GeoTIFF のパス。指定した場合はブロック毎に直接書き込む。
+                None の場合はメモリ上のデータセットを返す。圧縮方法とオーバービューは
+                'spec.output.profile' に従う。拡張子が '.mbtiles' または '.gpkg' の場合は
+                XYZ タイルを書き出す（`export_tiles`）。/vsimem 上のパスの場合は、
+                'spec.output.memory_max_bytes' を超えなければメモリ上に書き込み、超える
+                場合は一時ファイルに書き込む。どちらも表示の為の一時的な出力なので、
+                'spec.output.temporary_profile' に従う。書き込んだパスは `output_path`
+                に設定する。
+        Returns:
+            CustomGdalDataset: 微地形図のデータセット。入力が投影座標系でなかった場合は
+                元の座標系に戻したもの。キャンセルされた場合は None。
+        """
+        self.source_path = file_path
+        self.output_path = output_path
+        dst = self.prepare(file_path)
+        if is_tile_output(output_path):
+            return self.export_tiles(dst, output_path)
+        if is_memory_path(output_path):
+            profile = output_profile(self.spec.output.temporary_profile)
+        else:
+            profile = output_profile(self.spec.output.profile)
+        max_bytes = self.spec.output.memory_max_bytes
+        output_path, spilled = output_location(
+            output_path, dst.RasterXSize, dst.RasterYSize, 3, profile, max_bytes
+        )
+        if spilled:
+            self.reporter.memory_output_spilled(
+                MESSAGE_CATEGORY, max_bytes, output_path
+            )
+        self.output_path = output_path
+        if output_path is None:
+            new_dst = self.generate(dst)
+            dst = None
+            if new_dst is not None and self.in_crs:
+                # 元の座標系に戻す
+                new_dst = new_dst.reprojected_dataset(self.in_crs)
+            return new_dst
+        if not self.in_crs:
+            sink = GeoTiffBlockWriter.like(dst, output_path, profile=profile)
+            new_dst = self.generate_into(dst, sink)
+            dst = None
+            return new_dst
+        with tempfile.TemporaryDirectory(suffix="_topoMaps") as temp_dir:
+            # 計算した座標系で一時ファイルに書き込み、元の座標系に戻して出力する
+            # 一時ファイルは圧縮せず、変換後の出力だけを指定した方法で圧縮する
+            temp_path = os.path.join(temp_dir, "topo_map.tif")
+            sink = GeoTiffBlockWriter.like(dst, temp_path, profile=OutputProfile())
+            new_dst = self.generate_into(dst, sink)
+            dst = None
+            if new_dst is None:
+                return None
+            new_dst = None
+            try:
+                warp_to_profile(output_path, temp_path, self.in_crs, profile)
+            except Exception:
+                # 変換途中の出力を残さない（/vsimem 上の出力はメモリを解放する）
+                if gdal.VSIStatL(output_path) is not None:
+                    gdal.GetDriverByName("GTiff").Delete(output_path)
+                raise
+        return gdal_open(output_path)
+
+    def generate_into(
+        self, dst: CustomGdalDataset, sink: GeoTiffBlockWriter
+    ) -> Optional[CustomGdalDataset]:
+        """
+        ## Summary:
+            `generate` で出力先に書き込む。キャンセルされた場合と例外が発生した場合は、
+            出力先を閉じて書き込み途中のファイルを削除する。/vsimem 上の出力はレイヤーに
+            登録されず、他に解放する機会が無いので、ここでメモリを解放する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット。
+            sink (GeoTiffBlockWriter): 出力先。
+        Returns:
+            CustomGdalDataset: 書き込んだファイルのデータセット。キャンセルされた場合は None。
+        """
+        new_dst = None
+        try:
+            new_dst = self.generate(dst, sink)
+        finally:
+            if new_dst is None:
+                sink.discard()
+        return new_dst
@@ -0,0 +1,414 @@
+"""
+TPI の近傍の平均を、カーネルの大きさに依存しない計算量で求める。
+
+カーネルで畳み込むと、計算量はカーネルが大きくなるほど増える（0.5m の DEM で半径 100m の
+カーネルは 400x400 セルになる）。ここでは1セル当たりの計算量が一定になる方法を使用する。
+
+- 正方形の平均カーネル: 積分画像（Summed-area table）
+- ガウシアンカーネル: 再帰型（IIR）ガウシアンフィルタ（Young & van Vliet, 1995）
+- 逆ガウシアンカーネル: 正方形の平均カーネルとガウシアンの差として、積分画像と再帰型
+  ガウシアンフィルタの組み合わせ
+
+また、細いドーナツカーネルの様に行毎の非ゼロの区間（ランレングス）が少ないカーネルは、
+区間毎に行方向の累積和の差で合計する。計算量は区間の数に比例するので、区間が少なければ
+FFT の畳み込みより少ない。
+
+いずれも Nodata(np.nan) を除いた重み付き平均を計算するので、Nodata の周囲やラスターの端でも
+値が小さくならない。積分画像の平均は畳み込みと一致するが、再帰型ガウシアンフィルタは近似で、
+インパルス応答はガウシアンと数 % 異なる。
+"""
+
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import scipy.signal
+
+# 逆ガウシアンカーネルを一様な重みとガウシアンの和で近似する際の、許容する残差（最大値との比）
+INV_GAUSS_MAX_RESIDUAL = 1e-6
+# FFT の畳み込みの1セル当たりの計算時間を、区間毎の合計の加算の回数で表した係数。
+# FFT の計算時間は log2(セル数) に比例するものとする。benchmarks/bench_sparse.py で
+# 500 ~ 3000 四方の DEM と幅 1 セルのドーナツカーネルを計測し、区間毎の合計を選ぶ場合は
+# 全て FFT より速くなる値にしている（Nodata が無い 3000 四方では半径 8 セルまで選ぶ）。
+FFT_ADDS_PER_LOG2 = 3.5
+# 区間毎に合計する際に、1度に計算する行の累積和と合計の配列の大きさ（バイト）。
+# CPU のキャッシュに収まる行数毎に計算すると、配列全体を区間の数だけ走査するより速い
+# （3000 x 3000 で 1.6 ~ 1.8 倍）。
+SPARSE_STRIP_BYTES = 384 * 1024
+
+
+################################################################################
+#################### Summed-area table #########################################
+def _window_sums(sat: np.ndarray, radius: int, shape) -> np.ndarray:
+    """
+    ## Summary
+        積分画像から、各セルを中心とする (2 * radius + 1) 四方の合計を計算する。
+        ラスターの外側は合計に含まない。
+    """
+    rows, cols = shape
+    # 端の値を複製すると、範囲外のインデックスを端に丸めたのと同じになる
+    sat = np.pad(sat, radius, mode="edge")
+    size = 2 * radius + 1
+    return (
+        sat[size : size + rows, size : size + cols]
+        - sat[:rows, size : size + cols]
+        - sat[size : size + rows, :cols]
+        + sat[:rows, :cols]
+    )
+
+
+def summed_area_table(ary: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        先頭に 0 の行と列を追加した積分画像を作成する。精度の為に float64 で計算する。
+    Args:
+        ary (np.ndarray): 2次元の配列
+    Returns:
+        np.ndarray: (rows + 1, cols + 1) の積分画像
+    """
+    rows, cols = ary.shape
+    sat = np.zeros((rows + 1, cols + 1), dtype="float64")
+    np.cumsum(ary, axis=0, dtype="float64", out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def box_mean(ary: np.ndarray, radius: int) -> np.ndarray:
+    """
+    ## Summary
+        各セルを中心とする (2 * radius + 1) 四方の平均を計算する。Nodata とラスターの外側は
+        平均に含まない。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        radius (int): 半径（セル数）
+    Returns:
+        np.ndarray: float32 の平均。周囲に有効なセルが無い場合は np.nan。
+    """
+    valid = ~np.isnan(ary)
+    sums = _window_sums(summed_area_table(np.where(valid, ary, 0.0)), radius, ary.shape)
+    counts = _window_sums(summed_area_table(valid), radius, ary.shape)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+    mean[counts < 0.5] = np.nan
+    return mean.astype("float32")
+
+
+def is_square_box(kernel: np.ndarray) -> bool:
+    """
+    ## Summary
+        カーネルが正方形の一様なカーネル（平均カーネル）かどうか。
+    """
+    kernel = np.asarray(kernel)
+    rows, cols = kernel.shape
+    if rows != cols or rows % 2 == 0:
+        return False
+    return bool(np.all(kernel > 0) and np.allclose(kernel, kernel.flat[0]))
+
+
+################################################################################
+#################### Recursive Gaussian ########################################
+def _coefficients(q: float):
+    """
+    ## Summary
+        Young & van Vliet (1995) の3次の再帰型ガウシアンフィルタの係数。
+    Args:
+        q (float): 論文の近似式で σ から求めるパラメーター
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: scipy.signal.lfilter に渡す (b, a)
+    """
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q**2 + 0.422205 * q**3
+    b1 = 2.44413 * q + 2.85619 * q**2 + 1.26661 * q**3
+    b2 = -(1.4281 * q**2 + 1.26661 * q**3)
+    b3 = 0.422205 * q**3
+    gain = 1 - (b1 + b2 + b3) / b0
+    return np.array([gain]), np.array([1.0, -b1 / b0, -b2 / b0, -b3 / b0])
+
+
+def _young_van_vliet(sigma: float):
+    """
+    ## Summary
+        標準偏差 sigma の再帰型ガウシアンフィルタの係数。
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: scipy.signal.lfilter に渡す (b, a)
+    """
+    if 2.5 <= sigma:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * max(sigma, 0.5))
+    return _coefficients(q)
+
+
+def recursive_gaussian(ary: np.ndarray, sigma: float) -> np.ndarray:
+    """
+    ## Summary
+        再帰型ガウシアンフィルタを行方向と列方向に前向きと後ろ向きで適用する。
+        ラスターの外側は 0.0 として扱う。
+    Args:
+        ary (np.ndarray): 2次元の配列。np.nan を含まないこと。
+        sigma (float): 標準偏差（セル数）
+    Returns:
+        np.ndarray: float64 の平滑化した配列
+    """
+    b, a = _young_van_vliet(sigma)
+    out = np.asarray(ary, dtype="float64")
+    for axis in (1, 0):
+        out = scipy.signal.lfilter(b, a, out, axis=axis)
+        out = np.flip(scipy.signal.lfilter(b, a, np.flip(out, axis), axis=axis), axis)
+    return out
+
+
+def gaussian_mean(ary: np.ndarray, sigma: float) -> np.ndarray:
+    """
+    ## Summary
+        ガウシアンで重み付けした近傍の平均を計算する。Nodata とラスターの外側は平均に含まない。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        sigma (float): 標準偏差（セル数）
+    Returns:
+        np.ndarray: float32 の平均。
+    """
+    valid = ~np.isnan(ary)
+    sums = recursive_gaussian(np.where(valid, ary, 0.0), sigma)
+    weights = recursive_gaussian(valid, sigma)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / weights
+    mean[weights <= 1e-12] = np.nan
+    return mean.astype("float32")
+
+
+def box_gaussian_weights(
+    kernel: np.ndarray, sigma: float
+) -> Optional[Tuple[float, float]]:
+    """
+    ## Summary
+        カーネルを、正方形の一様な重み α とガウシアン β * exp(-r^2 / 2σ^2) の和で表す。
+        逆ガウシアンカーネル（ガウシアンの最大値からガウシアンを引いたもの）はこの形になる。
+    Args:
+        kernel (np.ndarray): 奇数の正方形のカーネル
+        sigma (float): ガウシアンの標準偏差（セル数）
+    Returns:
+        Tuple[float, float]: (α, β)。この形で表せないカーネルの場合は None。
+    """
+    kernel = np.asarray(kernel, dtype="float64")
+    rows, cols = kernel.shape
+    if rows != cols or rows % 2 == 0 or sigma <= 0:
+        return None
+    radius = rows // 2
+    y, x = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    gauss = np.exp(-(x * x + y * y) / (2 * sigma * sigma))
+    design = np.stack([np.ones(kernel.size), gauss.ravel()], axis=1)
+    coef, *_ = np.linalg.lstsq(design, kernel.ravel(), rcond=None)
+    residual = np.abs(design @ coef - kernel.ravel()).max()
+    if INV_GAUSS_MAX_RESIDUAL * np.abs(kernel).max() < residual:
+        return None
+    return float(coef[0]), float(coef[1])
+
+
+def box_gaussian_mean(
+    ary: np.ndarray, radius: int, alpha: float, beta: float, sigma: float
+) -> np.ndarray:
+    """
+    ## Summary
+        重みが α + β * exp(-r^2 / 2σ^2) の (2 * radius + 1) 四方のカーネルの平均を計算する。
+        一様な重みの合計は積分画像で、ガウシアンの重みの合計は再帰型ガウシアンフィルタで
+        求める。再帰型ガウシアンフィルタはカーネルの外側の裾も合計するので近似になる。
+        Nodata とラスターの外側は平均に含まない。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        radius (int): 半径（セル数）
+        alpha (float): 一様な重み
+        beta (float): ガウシアンの中心の重み
+        sigma (float): 標準偏差（セル数）
+    Returns:
+        np.ndarray: float32 の平均。周囲に有効なセルが無い場合は np.nan。
+    """
+    valid = ~np.isnan(ary)
+    values = np.where(valid, ary, 0.0)
+    # 再帰型ガウシアンフィルタは合計が 1 になるので、exp(-r^2 / 2σ^2) の合計を掛ける
+    scale = beta * 2 * np.pi * sigma * sigma
+    sums = alpha * _window_sums(summed_area_table(values), radius, ary.shape)
+    sums += scale * recursive_gaussian(values, sigma)
+    weights = alpha * _window_sums(summed_area_table(valid), radius, ary.shape)
+    weights += scale * recursive_gaussian(valid, sigma)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / weights
+    mean[~(1e-12 < np.abs(weights))] = np.nan
+    return mean.astype("float32")
+
+
+################################################################################
+#################### Sparse kernel #############################################
+def kernel_runs(kernel: np.ndarray) -> List[Tuple[int, int, int]]:
+    """
+    ## Summary
+        カーネルの各行の非ゼロの区間を列挙する。
+    Args:
+        kernel (np.ndarray): 2次元のカーネル
+    Returns:
+        List[Tuple[int, int, int]]: (行, 開始列, 終了列 + 1) のリスト
+    """
+    runs = []
+    for row, values in enumerate(np.asarray(kernel) != 0):
+        # 区間の境界で 0 と 1 が切り替わる
+        padded = np.concatenate(([0], values, [0])).astype("int8")
+        edges = np.flatnonzero(np.diff(padded))
+        runs.extend((row, start, end) for start, end in zip(edges[::2], edges[1::2]))
+    return runs
+
+
+def is_sparse_uniform(
+    kernel: np.ndarray,
+    shape: Optional[Tuple[int, int]] = None,
+    has_nodata: bool = True,
+) -> bool:
+    """
+    ## Summary
+        非ゼロの要素が全て同じ値で、行毎の区間の数が少ないカーネルかどうか（細いドーナツ
+        カーネルや小さな平均カーネル等）。`shape` を指定した場合は、区間毎に合計する方が
+        FFT の畳み込みより速い場合だけ True。
+    Args:
+        kernel (np.ndarray): 2次元のカーネル
+        shape (Tuple[int, int]): 畳み込む配列の (rows, cols)
+        has_nodata (bool): 配列に Nodata が含まれるかどうか
+    Returns:
+        bool: `sparse_focal_mean` で計算するかどうか
+    """
+    kernel = np.asarray(kernel)
+    if kernel.ndim != 2 or kernel.shape[0] % 2 == 0 or kernel.shape[1] % 2 == 0:
+        return False
+    values = kernel[kernel != 0]
+    if values.size == 0 or not np.allclose(values, values[0]):
+        return False
+    if shape is None:
+        return True
+    # 区間毎に2回加算する。Nodata が有る場合は有効なセル数も同じ方法で計算する
+    sparse_adds = (4 if has_nodata else 2) * len(kernel_runs(kernel))
+    padded = (shape[0] + kernel.shape[0]) * (shape[1] + kernel.shape[1])
+    return sparse_adds < FFT_ADDS_PER_LOG2 * np.log2(padded)
+
+
+def _strip_prefix(
+    ary: np.ndarray, start: int, stop: int, pad: Tuple[int, int], prefix: np.ndarray
+) -> np.ndarray:
+    """
+    ## Summary
+        'start' から 'stop' の行とその上下 pad[0] 行の、行方向の累積和を `prefix` に書き込む。
+        ラスターの外側の行は 0.0 になる。
+    """
+    rows, cols = ary.shape
+    pad_rows, pad_cols = pad
+    top = max(0, start - pad_rows)
+    bottom = min(rows, stop + pad_rows)
+    prefix[...] = 0.0
+    body = prefix[top - start + pad_rows : bottom - start + pad_rows]
+    np.cumsum(ary[top:bottom], axis=1, out=body[:, pad_cols + 1 : pad_cols + 1 + cols])
+    # 右側の範囲外は、行の合計のまま
+    body[:, pad_cols + 1 + cols :] = body[:, pad_cols + cols : pad_cols + 1 + cols]
+    return prefix
+
+
+def _run_sums(
+    prefix: np.ndarray, runs: List[Tuple[int, int, int]], out: np.ndarray
+) -> np.ndarray:
+    """
+    ## Summary
+        カーネルの区間毎に、行方向の累積和の差で合計して `out` に書き込む。
+    """
+    rows, cols = out.shape
+    out[...] = 0.0
+    for row, start, end in runs:
+        rows_slice = prefix[row : row + rows]
+        out += rows_slice[:, end : end + cols]
+        out -= rows_slice[:, start : start + cols]
+    return out
+
+
+def _edge_lengths(
+    cols: int, runs: List[Tuple[int, int, int]], pad: Tuple[int, int]
+) -> np.ndarray:
+    """
+    ## Summary
+        各列で、区間毎のラスターの内側のセル数。(区間の数, cols) の配列。
+    """
+    starts = np.array([start for _, start, _ in runs]) - pad[1]
+    ends = np.array([end for _, _, end in runs]) - pad[1]
+    x = np.arange(cols)[None, :]
+    lengths = np.minimum(x + ends[:, None], cols) - np.maximum(x + starts[:, None], 0)
+    return np.clip(lengths, 0, None).astype("float64")
+
+
+def sparse_focal_mean(ary: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        非ゼロの要素が全て同じ値のカーネルで、近傍の平均を計算する。
+        Nodata とラスターの外側は平均に含まない。カーネルは点対称であるものとする。
+        累積和と合計は 'SPARSE_STRIP_BYTES' に収まる行数毎に計算し、配列全体を区間の数だけ
+        走査しない。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        kernel (np.ndarray): 非ゼロの要素が全て同じ値のカーネル
+    Returns:
+        np.ndarray: float32 の平均。周囲に有効なセルが無い場合は np.nan。
+    """
+    runs = kernel_runs(kernel)
+    rows, cols = ary.shape
+    pad = (kernel.shape[0] // 2, kernel.shape[1] // 2)
+    strip = max(1, SPARSE_STRIP_BYTES // (8 * cols))
+    valid = ~np.isnan(ary)
+    has_nodata = not valid.all()
+    values = np.where(valid, ary, 0.0) if has_nodata else ary
+    if not has_nodata:
+        # Nodata が無い場合のセル数は、行の位置と列の位置で分離できるので行列の積で計算する
+        run_rows = np.array([row for row, _, _ in runs]) - pad[0]
+        lengths = _edge_lengths(cols, runs, pad)
+    # 累積和の配列は値と有効なセル数で使い回す
+    prefix = np.empty((strip + 2 * pad[0], cols + 2 * pad[1] + 1), dtype="float64")
+    sums = np.empty((strip, cols), dtype="float64")
+    counts = np.empty((strip, cols), dtype="float64")
+    mean = np.empty(ary.shape, dtype="float32")
+    for start in range(0, rows, strip):
+        stop = min(rows, start + strip)
+        n = stop - start
+        strip_prefix = prefix[: n + 2 * pad[0]]
+        _strip_prefix(values, start, stop, pad, strip_prefix)
+        strip_sums = _run_sums(strip_prefix, runs, sums[:n])
+        if has_nodata:
+            _strip_prefix(valid, start, stop, pad, strip_prefix)
+            strip_counts = _run_sums(strip_prefix, runs, counts[:n])
+        else:
+            y = np.arange(start, stop)[:, None] + run_rows[None, :]
+            inside_rows = ((0 <= y) & (y < rows)).astype("float64")
+            strip_counts = np.matmul(inside_rows, lengths, out=counts[:n])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            np.divide(strip_sums, strip_counts, out=strip_sums)
+        strip_sums[strip_counts < 0.5] = np.nan
+        mean[start:stop] = strip_sums
+    return mean
+
+
+################################################################################
+#################### TPI #######################################################
+def fast_focal_mean(
+    dem: np.ndarray, kernel_spec: str, kernel: np.ndarray, sigma: float
+) -> Optional[np.ndarray]:
+    """
+    ## Summary
+        カーネルの大きさに依存しない計算量で、TPI の近傍の平均を計算する。
+    Args:
+        dem (np.ndarray): DEM の配列。Nodata は np.nan。
+        kernel_spec (str): 'mean', 'gauss', 'inv_gauss', 'doughnut'
+        kernel (np.ndarray): 畳み込みで使用するカーネル
+        sigma (float): ガウシアンカーネルの標準偏差（セル数）
+    Returns:
+        np.ndarray: 近傍の平均。この方法で計算できないカーネルの場合は None。
+    """
+    if kernel_spec == "gauss":
+        return gaussian_mean(dem, sigma)
+    if kernel_spec == "mean" and is_square_box(kernel):
+        return box_mean(dem, kernel.shape[0] // 2)
+    if kernel_spec == "inv_gauss":
+        weights = box_gaussian_weights(kernel, sigma)
+        if weights is not None:
+            return box_gaussian_mean(dem, kernel.shape[0] // 2, *weights, sigma)
+    return None
@@ -0,0 +1,91 @@
+"""
+プロセスのメモリ使用量を計測する。
+
+必要なマシンの大きさを見積もれる様に、実行中のメモリ使用量（RSS）の最大値をログに出力する。
+追加の依存パッケージは使用せず、Linux では /proc、Windows では GetProcessMemoryInfo、
+その他では resource モジュールから取得する。
+"""
+
+import os
+import sys
+from typing import Optional
+
+
+def current_rss() -> Optional[int]:
+    """
+    ## Summary
+        現在のプロセスのメモリ使用量（RSS）を返す。
+    Returns:
+        int: バイト数。取得できない場合は None。
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm") as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf("SC_PAGE_SIZE")
+        if os.name == "nt":
+            return _windows_memory_info().WorkingSetSize
+        import resource
+
+        # macOS では現在の値を取得できないので、最大値で代用する
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except Exception:
+        return None
+
+
+def _windows_memory_info():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(
+        process, ctypes.byref(counters), counters.cb
+    )
+    return counters
+
+
+class MemoryMonitor(object):
+    """
+    ## Summary
+        計算の区切り毎にメモリ使用量を記録し、実行中の最大値を保持する。
+        区切りの間の一時的な増加は記録されないので、配列を確保した直後に `sample` を呼び出す。
+    """
+
+    def __init__(self):
+        self.start = current_rss()
+        self.peak = self.start
+
+    def sample(self) -> None:
+        """
+        ## Summary
+            現在のメモリ使用量を記録する。
+        """
+        rss = current_rss()
+        if rss is not None and (self.peak is None or self.peak < rss):
+            self.peak = rss
+
+    @property
+    def increase(self) -> Optional[int]:
+        """
+        ## Summary
+            実行開始時からのメモリ使用量の最大の増加量（バイト数）。
+        """
+        if self.start is None or self.peak is None:
+            return None
+        return self.peak - self.start
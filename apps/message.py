@@ -2,6 +2,9 @@
 import os
 from pathlib import Path
 from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
 
 from osgeo import gdal
 import pyproj
@@ -17,6 +20,7 @@ from .tabs import HillshadeOptions
 from .tabs import SlopeOptions
 from .tabs import TpiOptions
 from .tabs import TriOptions
+from .vsimem import is_memory_path
 
 
 class Message(object):
@@ -94,6 +98,9 @@ class Message(object):
         if is_sample:
             # サンプルのみの場合は出力ファイルを指定しなくともよい
             return True
+        elif is_memory_path(file_path):
+            # 出力ファイルを指定しない場合はメモリ上に出力する
+            return True
         elif not os.path.isdir(os.path.dirname(file_path)):
             # 出力フォルダが存在しない場合にエラーメッセージを表示
             self.err_msg(self._output_folder_does_not_exist)
@@ -260,6 +267,7 @@ class Message(object):
             txt += f"'Relative alpha': {tpi_spec.alpha}, "
         if tpi_spec.multiple_tpi:
             txt += f"'Multiples distance': {tpi_spec.multiples_distance}, "
+        txt += f"'Algorithm': {tpi_spec.algorithm}, "
         QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
 
     def end_tpi_calculation(self, MESSAGE_CATEGORY: str) -> None:
@@ -359,6 +367,161 @@ class Message(object):
             "Hillshade calculation is completed.", MESSAGE_CATEGORY, Qgis.Success
         )
 
+    def tiled_spec(
+        self, MESSAGE_CATEGORY: str, tiles: int, tile_size: int, halo: int
+    ) -> None:
+        """
+        ## Summary
+            タイル処理の設定をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            tiles (int): タイルの数
+            tile_size (int): タイルの1辺のセル数
+            halo (int): タイルの周囲に追加するセル数
+        """
+        txt = (
+            "Tiled processing: {"
+            f"'Tiles': {tiles}, "
+            f"'Tile size': {tile_size}, "
+            f"'Halo': {halo}, "
+        )
+        QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def layer_cache_hit(self, MESSAGE_CATEGORY: str, names: List[str]) -> None:
+        """
+        ## Summary
+            キャッシュした材料を使用することをログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            names (List[str]): キャッシュから読み込んだ材料の名前
+        """
+        QgsMessageLog.logMessage(
+            f"Use cached layers: {', '.join(names)}", MESSAGE_CATEGORY, Qgis.Info
+        )
+
+    def nodata_fill(
+        self, MESSAGE_CATEGORY: str, voids: int, regions: int, seconds: float
+    ) -> None:
+        """
+        ## Summary
+            Nodata を埋めたセル数と時間をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            voids (int): Nodata のセル数
+            regions (int): Nodata を埋めた範囲の数
+            seconds (float): 埋めるのに掛かった時間（秒）
+        """
+        txt = (
+            "Fill nodata: {"
+            f"'Cells': {voids:,}, "
+            f"'Regions': {regions:,}, "
+            f"'Time': {seconds:.2f} s, "
+        )
+        QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def pyramid_error(
+        self, MESSAGE_CATEGORY: str, name: str, stats: Dict[str, float]
+    ) -> None:
+        """
+        ## Summary
+            ピラミッドで計算した材料の、元の解像度で計算した材料との差をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            name (str): 材料の名前
+            stats (Dict[str, float]): `apps.pyramid.error_stats` の結果
+        """
+        txt = (
+            f"Pyramid error of {name}: {{"
+            f"'RMSE': {stats['rmse']:.4g}, "
+            f"'Max': {stats['max']:.4g}, "
+            f"'Relative RMSE': {stats['relative_rmse']:.2%}, "
+        )
+        QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def empty_tiles(self, MESSAGE_CATEGORY: str, empty: int, tiles: int) -> None:
+        """
+        ## Summary
+            計算を省略した Nodata だけのタイルの数をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            empty (int): Nodata だけのタイルの数
+            tiles (int): タイルの数
+        """
+        txt = f"Empty tiles: {{'Skipped': {empty}, 'Tiles': {tiles}}}"
+        QgsMessageLog.logMessage(txt, MESSAGE_CATEGORY, Qgis.Info)
+
+    def memory_output_spilled(
+        self, MESSAGE_CATEGORY: str, max_bytes: int, file_path: str
+    ) -> None:
+        """
+        ## Summary
+            メモリ上の出力の上限を超える為、一時ファイルに書き込むことをログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            max_bytes (int): メモリ上に保持する出力の合計の上限（圧縮前のバイト数）
+            file_path (str): 一時ファイルのパス
+        """
+        txt = (
+            "Memory output spilled to disk: {"
+            f"'Limit(MB)': {max_bytes / 1024**2:.1f}, "
+            f"'Path': '{file_path}'}}"
+        )
+        QgsMessageLog.logMessage(txt, MESSAGE_CATEGORY, Qgis.Info)
+
+    def global_stats(
+        self, MESSAGE_CATEGORY: str, source: str, stats: Dict[str, Any]
+    ) -> None:
+        """
+        ## Summary
+            全てのタイルで共通に使用する統計値をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            source (str): 統計値の求め方（'frozen', 'decimated', 'sketch', 'exact'）
+            stats (Dict[str, LayerStats]): 材料毎の統計値
+        """
+        txt = f"Global stats ({source}): {{"
+        for name, layer in stats.items():
+            txt += f"'{name}': [{layer.vmin:.4g}, {layer.vmax:.4g}"
+            if layer.q1 is not None:
+                txt += f", Q1 {layer.q1:.4g}, Q3 {layer.q3:.4g}"
+            txt += "], "
+        QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def tile_export(
+        self, MESSAGE_CATEGORY: str, min_zoom: int, max_zoom: int, tiles: int
+    ) -> None:
+        """
+        ## Summary
+            書き出した XYZ タイルのズームレベルと枚数をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            min_zoom (int): 最小のズームレベル
+            max_zoom (int): 最大のズームレベル
+            tiles (int): 書き込んだタイルの枚数（全て透明なタイルは含まない）
+        """
+        txt = f"XYZ tiles: {{'Zoom': {min_zoom} - {max_zoom}, 'Tiles': {tiles}}}"
+        QgsMessageLog.logMessage(txt, MESSAGE_CATEGORY, Qgis.Info)
+
+    def peak_memory(
+        self, MESSAGE_CATEGORY: str, peak: Optional[int], increase: Optional[int]
+    ) -> None:
+        """
+        ## Summary
+            実行中のメモリ使用量の最大値をログに表示する。
+        Args:
+            MESSAGE_CATEGORY (str): メッセージカテゴリ。QGISのログコンソールタブのタイトルに使用される。
+            peak (int): メモリ使用量（RSS）の最大値（バイト数）
+            increase (int): 実行開始時からの最大の増加量（バイト数）
+        """
+        if peak is None:
+            return
+        txt = (
+            "Peak memory: {"
+            f"'Peak RSS': {peak / 1024**2:,.1f} MiB, "
+            f"'Increase': {(increase or 0) / 1024**2:,.1f} MiB, "
+        )
+        QgsMessageLog.logMessage(txt + "}", MESSAGE_CATEGORY, Qgis.Info)
+
     def start_composite_image(self, MESSAGE_CATEGORY: str) -> None:
         """
         ## Summary
@@ -0,0 +1,221 @@
+"""
+微地形図の計算に使用する設定値のデータクラス。
+
+QGIS や Qt に依存しないので、`apps.engine.TopoMapEngine` を QGIS の外（ヘッドレス）で
+実行する場合にもこのモジュールから設定を作成できる。
+"""
+
+from dataclasses import dataclass
+from dataclasses import field
+from typing import TYPE_CHECKING
+from typing import Optional
+
+if TYPE_CHECKING:
+    # 型注釈だけに使用する。GDAL の無い環境（単体テスト）でも読み込める様にする
+    from ..gdal_drawer.utils.colors import LinearColorMap
+
+
+################################################################################
+################# Input ########################################################
+@dataclass
+class FirstResampleSpec:
+    execute: bool
+    metre_spec: bool
+    resolution: float
+    denominator: int
+    smooth_alg: str
+
+
+################################################################################
+#################### Output ####################################################
+@dataclass
+class OutputSpec:
+    sample_only: bool
+    sampling_max_cols: int
+    sampling_max_rows: int
+    add_project: bool
+    output_file_path: str
+    slope_cmap: "LinearColorMap"
+    tpi_cmap: "LinearColorMap"
+    tri_cmap: "LinearColorMap"
+    hillshade_cmap: "LinearColorMap"
+    # 出力ファイルの圧縮方法とオーバービュー（`apps.writer.OUTPUT_PROFILES` のキー）。
+    # 保存するファイルは画質が落ちない様に、可逆圧縮の 'deflate' を既定にする。
+    profile: str = "deflate"
+    # 出力ファイルを指定せず、表示の為だけに /vsimem（または一時ファイル）に書き込む
+    # 場合の設定。'fast_view' は JPEG で圧縮するので、小さく速く表示できるが非可逆。
+    temporary_profile: str = "fast_view"
+    # 出力ファイルの拡張子が '.mbtiles' または '.gpkg' の場合の XYZ タイルの設定。
+    # ズームレベルが None の場合は範囲と解像度から決める。ダイアログでは apps/config.json の
+    # 'XyzTiles' で変更できる。
+    tile_format: str = "png"
+    min_zoom: Optional[int] = None
+    max_zoom: Optional[int] = None
+    # 出力ファイルを指定しない場合に /vsimem 上に保持する出力の合計の上限（圧縮前の
+    # バイト数）。超える場合は一時ファイルに書き込む（`apps.vsimem`）。
+    memory_max_bytes: int = 1024**3
+
+
+################################################################################
+#################### Slope #####################################################
+@dataclass
+class SlopeOptions:
+    metre_spec: bool
+    distance: float
+    cells: int
+    execute_gaussian_filter: bool
+    sigma: float
+    change_alpha: bool
+    alpha: float
+
+
+################################################################################
+#################### TPI #######################################################
+@dataclass
+class TpiOptions:
+    kernel_spec: str
+    metre_spec: bool
+    distance: float
+    cells: int
+    sigma: float
+    coef: float
+    execute_outlier_treatment: bool
+    iqr: float
+    change_alpha: bool
+    alpha: float
+    multiple_tpi: bool
+    multiples_distance: float
+    # 'convolve' はカーネルで畳み込む。'fast' は正方形の平均カーネルを積分画像で、
+    # ガウシアンカーネルを再帰型フィルタで、逆ガウシアンカーネルをその2つの差で計算し、
+    # 計算量がカーネルの大きさに依存しない。ドーナツカーネル等のその他のカーネルと、
+    # 一様な重みとガウシアンの差で表せない逆ガウシアンカーネルは 'fast' でも畳み込む。
+    algorithm: str = "convolve"
+
+
+################################################################################
+#################### TRI #######################################################
+@dataclass
+class TriOptions:
+    execute: bool
+    execute_gaussian_filter: bool
+    sigma: float
+    execute_outlier_treatment: bool
+    iqr: float
+    change_alpha: bool
+    alpha: float
+
+
+################################################################################
+#################### Hillshade #################################################
+@dataclass
+class HillshadeOptions:
+    hillshade_type: str
+    azimuth: float
+    altitude: float
+    z_factor: float
+    combined: bool
+    execute_gaussian_filter: bool
+    sigma: float
+    execute_outlier_treatment: bool
+    iqr: float
+
+
+################################################################################
+#################### Others ####################################################
+@dataclass
+class OthersOptions:
+    execute_unsharpn_mask: bool
+    unsharpn_radius: float
+    unsharpn_percent: int
+    unsharpn_threshold: int
+    execute_contrast: bool
+    contrast_value: float
+
+
+################################################################################
+#################### Execution #################################################
+@dataclass
+class ExecutionOptions:
+    """
+    ## Summary
+        計算方法の設定。UIには表示せず、既定値はQGIS上での実行に合わせている。
+        'backend' や 'smoothing_nodata' などは apps/config.json の 'Execution' で変更できる。
+    Args:
+        tiled (bool): タイルに分割して計算するかどうか。None の場合はセル数が
+            'whole_raster_max_cells' を超えた場合にタイルで計算する。
+        tile_size (int): タイルの1辺のセル数（ハローを除く）。
+        whole_raster_max_cells (int): 全体を一度に計算するセル数の上限。
+        max_workers (int): 各材料を並列計算する際のスレッド数またはプロセス数。
+            None の場合は CPU 数に従う。
+        backend (str): 'thread' はスレッドで、'process' は DEM を共有メモリに置いて
+            プロセスプールで各材料を計算する。プロセスプールは実行後も残して使い回す。
+        cache_max_bytes (int): セッション中に保持する材料の配列の合計バイト数の上限。
+            0 の場合はキャッシュを使用しない。タイルで計算する場合は使用しない。
+        smoothing_truncate (float): ガウシアンフィルタのカーネルを打ち切る位置（σ の倍数）。
+        smoothing_fft_min_radius (int): ガウシアンフィルタのカーネルの半径（セル数）が
+            この値を超える場合は FFT で畳み込む。
+        smoothing_nodata (str): 平滑化する材料の Nodata の扱い。'fill'（既定）は傾斜の Nodata を
+            fill_nodata で埋め、残りの Nodata を 0.0 として畳み込む（以前と同じ結果）。
+            'normalized' は正規化畳み込みで Nodata とラスターの外側を平均に含めない。
+            fill_nodata を使用しないので速いが、Nodata とラスターの端の周囲の値が変わる。
+        fft_max_block (int): FFT で畳み込む際のブロックの1辺の長さの上限。TPIとガウシアン
+            フィルタはこの大きさのブロック毎に畳み込むので、メモリ使用量が制限される。
+        pyramid (bool): 大きなカーネルのTPIの近傍の平均とガウシアンフィルタを、間引いた
+            DEM で計算してから双線形補間で戻すかどうか。誤差は
+            `TopoMapEngine.pyramid_error_report` で確認できる。
+        pyramid_min_kernel (int): この大きさ（セル数）以上のカーネルから 2倍に間引き、
+            その2倍以上で 4倍に間引く。
+        pyramid_max_factor (int): 間引く倍率の上限。
+        quantile_method (str): 外れ値処理に使用する四分位数の計算方法。'histogram' は
+            細かいヒストグラムから求め（誤差は値の範囲の 1/65536 以下）、'exact' は
+            np.nanquantile で並べ替えて求める。
+        stats_pass (str): 全体の統計値を求める方法。'sketch' はタイルを計算しながら
+            `apps.stats.StatsSketch` に追加してまとめる（全体を一度に計算する場合も同じ方法で
+            求める）。'exact' は全てのタイルをつなぎ合わせた後に、配列全体から
+            'quantile_method' で計算する。
+        stats_decimation (int): 2以上の場合は、タイルの計算の前にこの倍率で間引いた DEM で
+            各材料を計算し、その統計値を全てのタイルで使用する。傾斜やTRIは解像度で値が
+            変わるので、外れ値処理の閾値とカラーマップの範囲は近似になる。
+        skip_empty_tiles (bool): タイル処理で、Nodata だけのタイルの計算と合成を省略する
+            かどうか。省略したタイルは周囲のタイルのハローとしてだけ読み込み、出力には
+            書き込まない（GeoTIFF では空のブロックになる）。
+    """
+
+    tiled: Optional[bool] = None
+    tile_size: int = 2048
+    whole_raster_max_cells: int = 64_000_000
+    max_workers: Optional[int] = None
+    backend: str = "thread"
+    cache_max_bytes: int = 2 * 1024**3
+    smoothing_truncate: float = 4.0
+    smoothing_fft_min_radius: int = 24
+    smoothing_nodata: str = "fill"
+    fft_max_block: int = 2048
+    pyramid: bool = False
+    pyramid_min_kernel: int = 32
+    pyramid_max_factor: int = 4
+    quantile_method: str = "histogram"
+    stats_pass: str = "sketch"
+    stats_decimation: int = 1
+    skip_empty_tiles: bool = True
+
+
+################################################################################
+#################### TopoMap ###################################################
+@dataclass
+class TopoMapSpec:
+    """
+    ## Summary
+        微地形図を1枚作成する為に必要な設定をまとめたもの。
+        `TopoMapsDialog.get_topo_map_spec` で UI から作成するか、ヘッドレスで実行する場合は
+        各データクラスから直接作成する。
+    """
+
+    resample: FirstResampleSpec
+    output: OutputSpec
+    slope: SlopeOptions
+    tpi: TpiOptions
+    tri: TriOptions
+    hillshade: HillshadeOptions
+    others: OthersOptions
+    execution: ExecutionOptions = field(default_factory=ExecutionOptions)
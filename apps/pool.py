@@ -0,0 +1,281 @@
+"""
+各材料をプロセスプールで計算する為のユーティリティ。
+
+スレッドで並列化しても、カラーマップの適用や gdal_drawer の Python 側の処理は GIL に
+縛られるので、コア数を増やしても速くならない。ここでは DEM を1度だけ
+`multiprocessing.shared_memory` に置き、ワーカーはコピーせずにそれを参照する。
+ワーカーからは計算した材料の配列だけを共有メモリに書き戻す。
+
+プロセスプールはモジュールに保持して使い回すので、2回目以降の実行ではプロセスの起動と
+モジュールの読み込みの時間がかからない。
+"""
+
+import atexit
+import concurrent.futures
+from dataclasses import dataclass
+from dataclasses import replace
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import sys
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from osgeo import gdal
+
+from .options import TopoMapSpec
+
+
+@dataclass
+class SharedArrayInfo:
+    """
+    ## Summary
+        共有メモリ上の配列をワーカーで参照する為の情報。
+    """
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedArray(object):
+    """
+    ## Summary
+        共有メモリ上に置いた numpy の配列。作成したプロセスが `release` で解放する。
+    Args:
+        shape (Tuple[int, ...]): 配列の形
+        dtype (str): 配列の型
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype: str = "float32"):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.info = SharedArrayInfo(self._shm.name, tuple(shape), dtype)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def from_array(cls, ary: np.ndarray, dtype: str = "float32") -> "SharedArray":
+        shared = cls(ary.shape, dtype)
+        shared.array[...] = ary
+        return shared
+
+    def release(self) -> None:
+        """
+        ## Summary
+            共有メモリを解放する。
+        """
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach(info: SharedArrayInfo) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    ## Summary
+        ワーカーから共有メモリ上の配列をコピーせずに参照する。
+    Args:
+        info (SharedArrayInfo): 共有メモリの情報
+    Returns:
+        Tuple[SharedMemory, np.ndarray]: 参照が終わったら SharedMemory を close する。
+    """
+    shm = shared_memory.SharedMemory(name=info.name)
+    return shm, np.ndarray(info.shape, dtype=info.dtype, buffer=shm.buf)
+
+
+################################################################################
+#################### Worker ####################################################
+def _init_worker() -> None:
+    """
+    ## Summary
+        ワーカーの起動時に重いモジュールを読み込んでおく。
+    """
+    gdal.UseExceptions()
+    from . import engine  # noqa: F401
+
+
+def _compute_group(
+    group: str,
+    spec: TopoMapSpec,
+    dem_info: SharedArrayInfo,
+    out_infos: Dict[str, SharedArrayInfo],
+    transform: tuple,
+    projection: str,
+) -> List[str]:
+    """
+    ## Summary
+        ワーカー内で材料のグループを計算し、結果を共有メモリに書き込む。
+    Args:
+        group (str): 'derivatives', 'tpi'
+        spec (TopoMapSpec): 微地形図の設定
+        dem_info (SharedArrayInfo): DEM の共有メモリ
+        out_infos (Dict[str, SharedArrayInfo]): 材料毎の結果を書き込む共有メモリ
+        transform (tuple): GeoTransform
+        projection (str): 座標系のWKT
+    Returns:
+        List[str]: 書き込んだ材料の名前
+    """
+    from .dem_buffer import DemBuffer
+    from .engine import EngineReporter
+    from .engine import TopoMapEngine
+
+    dem_shm, dem_ary = attach(dem_info)
+    try:
+        dem = DemBuffer(dem_ary, transform, projection)
+        engine = TopoMapEngine(spec, reporter=EngineReporter())
+        arrays = engine.compute_group(group, dem)
+        dem = None
+        written = []
+        for name, ary in arrays.items():
+            if ary is None or name not in out_infos:
+                continue
+            out_shm, out = attach(out_infos[name])
+            out[...] = ary
+            out = None
+            out_shm.close()
+            written.append(name)
+        return written
+    finally:
+        dem_ary = None
+        dem_shm.close()
+
+
+################################################################################
+#################### Pool ######################################################
+_POOL: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_POOL_WORKERS: Optional[int] = None
+
+
+def _spawn_context() -> multiprocessing.context.BaseContext:
+    """
+    ## Summary
+        spawn のコンテキストを返す。QGIS に組み込まれた Python では sys.executable が
+        QGIS 本体を指すので、同じ環境の python を使用するように設定する。
+    """
+    context = multiprocessing.get_context("spawn")
+    if "python" not in os.path.basename(sys.executable).lower():
+        if os.name == "nt":
+            candidate = os.path.join(sys.exec_prefix, "python.exe")
+        else:
+            candidate = os.path.join(sys.exec_prefix, "bin", "python3")
+        if os.path.exists(candidate):
+            context.set_executable(candidate)
+    return context
+
+
+def get_process_pool(
+    max_workers: Optional[int] = None,
+) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    ## Summary
+        プロセスプールを返す。既に起動している場合はそれを使い回す。
+    Args:
+        max_workers (int): ワーカーの数。None の場合は CPU 数。
+    Returns:
+        ProcessPoolExecutor: プロセスプール
+    """
+    global _POOL, _POOL_WORKERS
+    max_workers = max_workers or os.cpu_count() or 1
+    if _POOL is not None and _POOL_WORKERS != max_workers:
+        shutdown_process_pool()
+    if _POOL is None:
+        _POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=_spawn_context(),
+            initializer=_init_worker,
+        )
+        _POOL_WORKERS = max_workers
+    return _POOL
+
+
+def shutdown_process_pool() -> None:
+    """
+    ## Summary
+        プロセスプールを終了する。
+    """
+    global _POOL, _POOL_WORKERS
+    if _POOL is not None:
+        _POOL.shutdown(wait=True, cancel_futures=True)
+    _POOL = None
+    _POOL_WORKERS = None
+
+
+atexit.register(shutdown_process_pool)
+
+
+def iter_layers_in_processes(
+    dem,
+    spec: TopoMapSpec,
+    groups: Dict[str, List[str]],
+    max_workers: Optional[int] = None,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    ## Summary
+        各材料をプロセスプールで計算し、グループの計算が終わった順に返す。
+        DEM は共有メモリに1度だけ置き、結果を書き込んだ共有メモリは返した時点で解放する。
+    Args:
+        dem (DemBuffer): 読み込み済みの DEM。共有メモリ上に読み込んだものはコピーせずに使用する。
+        spec (TopoMapSpec): 微地形図の設定
+        groups (Dict[str, List[str]]): グループ名と、そのグループで計算する材料の名前
+        max_workers (int): ワーカーの数
+    Yields:
+        Tuple[str, np.ndarray]: 材料の名前と float32 の配列。計算しない材料は返さない。
+    """
+    # カラーマップはワーカーでは使用しないので渡さない
+    worker_spec = replace(spec, output=None)
+    pool = get_process_pool(max_workers)
+    shared_dem = dem.shared
+    if shared_dem is None:
+        shared_dem = SharedArray.from_array(dem.array)
+    outputs = {
+        name: SharedArray(dem.shape) for names in groups.values() for name in names
+    }
+    try:
+        futures = {
+            pool.submit(
+                _compute_group,
+                group,
+                worker_spec,
+                shared_dem.info,
+                {name: outputs[name].info for name in names},
+                dem.transform,
+                dem.projection,
+            ): names
+            for group, names in groups.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            written = future.result()
+            for name in futures[future]:
+                output = outputs.pop(name)
+                ary = np.array(output.array) if name in written else None
+                output.release()
+                if ary is not None:
+                    yield name, ary
+    finally:
+        if shared_dem is not dem.shared:
+            shared_dem.release()
+        for output in outputs.values():
+            output.release()
+
+
+def compute_layers_in_processes(
+    dem,
+    spec: TopoMapSpec,
+    groups: Dict[str, List[str]],
+    max_workers: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    ## Summary
+        各材料をプロセスプールで計算する。
+    Args:
+        dem (DemBuffer): 読み込み済みの DEM
+        spec (TopoMapSpec): 微地形図の設定
+        groups (Dict[str, List[str]]): グループ名と、そのグループで計算する材料の名前
+        max_workers (int): ワーカーの数
+    Returns:
+        Dict[str, np.ndarray]: 材料毎の float32 の配列。計算しない材料は含まない。
+    """
+    return dict(iter_layers_in_processes(dem, spec, groups, max_workers))
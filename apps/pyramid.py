@@ -0,0 +1,148 @@
+"""
+カーネルの大きい計算を、間引いた DEM（ピラミッド）で行う。
+
+'multiples_distance' の大きい2枚目のTPIや σ の大きいガウシアンフィルタの結果は、
+低い周波数の成分しか含まない。ここではカーネルの大きさ（セル数）から間引く倍率を決め、
+倍率 x 倍率 のセルの平均で縮小した配列で計算してから、元の解像度に双線形補間で戻す。
+
+縮小と補間はどちらも Nodata(np.nan) を除いて計算する。縮小したセルの中心は、元のセルの
+(倍率 - 1) / 2 だけずれた位置になる。
+"""
+
+from typing import Dict
+from typing import Tuple
+
+import numpy as np
+
+# この大きさ（セル数）以上のカーネルから、2倍に間引く
+PYRAMID_MIN_KERNEL = 32
+# 間引く倍率の上限
+PYRAMID_MAX_FACTOR = 4
+
+
+def decimation_factor(
+    kernel_cells: int,
+    min_kernel: int = PYRAMID_MIN_KERNEL,
+    max_factor: int = PYRAMID_MAX_FACTOR,
+) -> int:
+    """
+    ## Summary
+        カーネルの大きさから間引く倍率を決める。カーネルが 'min_kernel' セル以上で 2倍、
+        その2倍以上で 4倍の様に、間引いた後のカーネルが 'min_kernel' / 2 セル以上になる
+        2の累乗を選ぶ。
+    Args:
+        kernel_cells (int): カーネルの1辺のセル数
+        min_kernel (int): 間引き始めるカーネルのセル数
+        max_factor (int): 倍率の上限
+    Returns:
+        int: 間引く倍率。間引かない場合は 1。
+    """
+    factor = 1
+    while factor * 2 <= max_factor and min_kernel * factor <= kernel_cells:
+        factor *= 2
+    return factor
+
+
+def decimate(ary: np.ndarray, factor: int) -> np.ndarray:
+    """
+    ## Summary
+        倍率 x 倍率 のセルの平均で縮小する。端の半端なセルは、有るセルだけで平均する。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        factor (int): 間引く倍率
+    Returns:
+        np.ndarray: float32 の縮小した配列。有効なセルが無い場合は np.nan。
+    """
+    rows, cols = ary.shape
+    coarse_rows = -(-rows // factor)
+    coarse_cols = -(-cols // factor)
+    padded = np.full(
+        (coarse_rows * factor, coarse_cols * factor), np.nan, dtype="float64"
+    )
+    padded[:rows, :cols] = ary
+    blocks = padded.reshape(coarse_rows, factor, coarse_cols, factor)
+    valid = ~np.isnan(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coarse = sums / counts
+    return coarse.astype("float32")
+
+
+def _linear_weights(
+    size: int, coarse_size: int, factor: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ## Summary
+        1つの軸の双線形補間のインデックスと重み。範囲外は端のセルの値を使用する。
+    """
+    # 縮小したセルの中心を基準にした、元のセルの中心の位置
+    position = (np.arange(size) + 0.5) / factor - 0.5
+    position = np.clip(position, 0, coarse_size - 1)
+    lower = np.floor(position).astype("int64")
+    upper = np.minimum(lower + 1, coarse_size - 1)
+    weight = position - lower
+    return lower, upper, weight
+
+
+def _interpolate_axis(ary: np.ndarray, size: int, factor: int, axis: int) -> np.ndarray:
+    """
+    ## Summary
+        1つの軸を線形補間で拡大する。
+    """
+    lower, upper, weight = _linear_weights(size, ary.shape[axis], factor)
+    shape = [1, 1]
+    shape[axis] = size
+    weight = weight.reshape(shape)
+    return np.take(ary, lower, axis=axis) * (1 - weight) + np.take(
+        ary, upper, axis=axis
+    ) * weight
+
+
+def upsample(coarse: np.ndarray, factor: int, shape: Tuple[int, int]) -> np.ndarray:
+    """
+    ## Summary
+        `decimate` で縮小した配列を、双線形補間で元の大きさに戻す。Nodata のセルは補間の
+        重みから除く。
+    Args:
+        coarse (np.ndarray): 縮小した配列。Nodata は np.nan。
+        factor (int): 間引いた倍率
+        shape (Tuple[int, int]): 元の配列の (rows, cols)
+    Returns:
+        np.ndarray: float32 の拡大した配列。周囲に有効なセルが無い場合は np.nan。
+    """
+    valid = ~np.isnan(coarse)
+    values = np.where(valid, coarse, 0.0)
+    weights = valid.astype("float64")
+    for axis in (0, 1):
+        values = _interpolate_axis(values, shape[axis], factor, axis)
+        weights = _interpolate_axis(weights, shape[axis], factor, axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fine = values / weights
+    fine[weights <= 1e-6] = np.nan
+    return fine.astype("float32")
+
+
+def error_stats(full: np.ndarray, approx: np.ndarray) -> Dict[str, float]:
+    """
+    ## Summary
+        ピラミッドで計算した結果と、元の解像度で計算した結果の差。
+    Args:
+        full (np.ndarray): 元の解像度で計算した配列
+        approx (np.ndarray): ピラミッドで計算した配列
+    Returns:
+        Dict[str, float]: 'rmse'（二乗平均平方根誤差）、'max'（最大の絶対誤差）、
+            'relative_rmse'（rmse を元の結果の標準偏差で割った値）
+    """
+    diff = np.asarray(approx, dtype="float64") - np.asarray(full, dtype="float64")
+    valid = ~np.isnan(diff)
+    if not valid.any():
+        return {"rmse": 0.0, "max": 0.0, "relative_rmse": 0.0}
+    diff = diff[valid]
+    rmse = float(np.sqrt(np.mean(diff**2)))
+    std = float(np.std(np.asarray(full, dtype="float64")[valid]))
+    return {
+        "rmse": rmse,
+        "max": float(np.abs(diff).max()),
+        "relative_rmse": rmse / std if 0 < std else 0.0,
+    }
@@ -0,0 +1,143 @@
+"""
+材料の平滑化（ガウシアンフィルタ）。
+
+2次元のガウシアンカーネルで FFT の畳み込みを行うと、σ が小さくてもラスター全体の 2次元 FFT が
+材料毎に必要になる。ガウシアンは行方向と列方向の 1次元のフィルタに分離できるので、ここでは
+σ の何倍かで打ち切った 1次元のカーネルを2回適用する。カーネルが大きい場合は、各軸の 1次元の
+FFT で畳み込む。FFT はラスター全体ではなく、`apps.spectral.fft_convolve` の overlap-save 法で
+カーネルの軸に沿ったブロック毎に計算し、2次元の FFT は使用しない。
+
+Nodata は、0.0 で埋めて畳み込む方法と、正規化畳み込み（値 x マスクとマスクを畳み込んで割る）
+を選べる。正規化畳み込みは Nodata の周囲とラスターの端で値が小さくならない。
+"""
+
+import math
+
+import numpy as np
+import scipy.ndimage
+
+from .spectral import FFT_MAX_BLOCK
+from .spectral import fft_convolve
+
+# カーネルを打ち切る位置（σ の倍数）
+DEFAULT_TRUNCATE = 4.0
+# この半径（セル数）を超える場合は FFT で畳み込む
+FFT_MIN_RADIUS = 24
+
+
+def gaussian_radius(sigma: float, truncate: float = DEFAULT_TRUNCATE) -> int:
+    """
+    ## Summary
+        打ち切ったガウシアンカーネルの半径（セル数）。
+    Args:
+        sigma (float): 標準偏差（セル数）
+        truncate (float): カーネルを打ち切る位置（σ の倍数）
+    Returns:
+        int: 半径
+    """
+    return max(1, int(math.ceil(truncate * sigma)))
+
+
+def gaussian_kernel_1d(sigma: float, truncate: float = DEFAULT_TRUNCATE) -> np.ndarray:
+    """
+    ## Summary
+        合計が 1 になる様に正規化した 1次元のガウシアンカーネル。
+    Args:
+        sigma (float): 標準偏差（セル数）
+        truncate (float): カーネルを打ち切る位置（σ の倍数）
+    Returns:
+        np.ndarray: 長さ 2 * 半径 + 1 のカーネル
+    """
+    radius = gaussian_radius(sigma, truncate)
+    x = np.arange(-radius, radius + 1, dtype="float64")
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def separable_convolve(
+    ary: np.ndarray,
+    kernel: np.ndarray,
+    fft_min_radius: int = FFT_MIN_RADIUS,
+    max_block: int = FFT_MAX_BLOCK,
+) -> np.ndarray:
+    """
+    ## Summary
+        対称な 1次元のカーネルを行方向と列方向に適用する。範囲外は 0.0 として扱い、
+        `scipy.signal.convolve(..., mode="same")` と同じ結果になる。
+    Args:
+        ary (np.ndarray): 2次元の配列。np.nan を含まないこと。
+        kernel (np.ndarray): 奇数長の対称な 1次元のカーネル
+        fft_min_radius (int): この半径を超える場合は FFT で畳み込む
+        max_block (int): FFT のブロックの1辺の長さの上限
+    Returns:
+        np.ndarray: 畳み込んだ配列
+    """
+    kernel = kernel.astype(ary.dtype, copy=False)
+    if fft_min_radius < len(kernel) // 2:
+        out = fft_convolve(ary, kernel[None, :], max_block)
+        return fft_convolve(out, kernel[:, None], max_block)
+    out = scipy.ndimage.correlate1d(ary, kernel, axis=1, mode="constant", cval=0.0)
+    return scipy.ndimage.correlate1d(out, kernel, axis=0, mode="constant", cval=0.0)
+
+
+def _weights(
+    valid: np.ndarray, kernel: np.ndarray, fft_min_radius: int, max_block: int
+) -> np.ndarray:
+    """
+    ## Summary
+        正規化畳み込みの重み（有効なセルのカーネルの重みの合計）。Nodata が無い場合は
+        ラスターの端だけが 1 未満になり、行方向と列方向の重みの積で計算できる。
+    """
+    if valid.all():
+        rows, cols = (
+            scipy.ndimage.correlate1d(np.ones(size), kernel, mode="constant", cval=0.0)
+            for size in valid.shape
+        )
+        return np.outer(rows, cols)
+    return separable_convolve(
+        valid.astype("float64"), kernel, fft_min_radius, max_block
+    )
+
+
+def gaussian_filter(
+    ary: np.ndarray,
+    sigma: float,
+    truncate: float = DEFAULT_TRUNCATE,
+    fft_min_radius: int = FFT_MIN_RADIUS,
+    max_block: int = FFT_MAX_BLOCK,
+    normalized: bool = False,
+) -> np.ndarray:
+    """
+    ## Summary
+        ガウシアンフィルタを適用する。Nodata(np.nan)は元の位置に戻す。
+    Args:
+        ary (np.ndarray): 平滑化する配列
+        sigma (float): 標準偏差（セル数）
+        truncate (float): カーネルを打ち切る位置（σ の倍数）
+        fft_min_radius (int): カーネルの半径がこの値を超える場合は FFT で畳み込む
+        max_block (int): FFT のブロックの1辺の長さの上限
+        normalized (bool): True の場合は正規化畳み込み（値 x マスクとマスクをそれぞれ畳み込み、
+            割る）で計算し、Nodata とラスターの外側を平均に含めない。False の場合は
+            Nodata とラスターの外側を 0.0 として計算する。
+    Returns:
+        np.ndarray: 平滑化した配列
+    """
+    ary = np.asarray(ary)
+    if not np.issubdtype(ary.dtype, np.floating):
+        ary = ary.astype("float32")
+    kernel = gaussian_kernel_1d(sigma, truncate)
+    nan_idx = np.isnan(ary)
+    has_nan = nan_idx.any()
+    if not has_nan and not normalized:
+        return separable_convolve(ary, kernel, fft_min_radius, max_block)
+    filled = np.where(nan_idx, 0.0, ary) if has_nan else ary
+    smoothed = separable_convolve(filled, kernel, fft_min_radius, max_block)
+    del filled
+    if normalized:
+        weights = _weights(~nan_idx, kernel, fft_min_radius, max_block)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            smoothed /= weights
+        # 周囲に有効なセルが無い場合
+        smoothed[weights <= 1e-6] = np.nan
+    smoothed[nan_idx] = np.nan
+    return smoothed
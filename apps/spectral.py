@@ -0,0 +1,323 @@
+"""
+複数のカーネルで同じ配列を FFT で畳み込む。
+
+TPI と 2枚目の TPI を別々に畳み込むと、DEM の FFT がカーネル毎に計算される。ここでは DEM の
+スペクトルを1度だけ計算し、各カーネルのスペクトルを掛けて逆変換する。カーネルのスペクトルは
+(カーネルの種類, 大きさ, 解像度, FFT の配列の形) 毎にキャッシュするので、同じ解像度のタイルを
+続けて計算する場合はカーネルの FFT を省略できる。
+
+ラスター全体を1つの FFT で畳み込むと、30000 x 30000 の DEM では complex128 の配列だけで
+数十 GB になる。ここでは overlap-save 法で、決まった大きさのブロック毎に FFT で畳み込む。
+ブロックの大きさは、カーネルの大きさから出力1セル当たりの計算量が最小になる様に選び、
+メモリ使用量はブロックの大きさで決まる。ラスター全体が1つのブロックに収まる場合は
+ブロックに分割しない。
+
+Nodata(np.nan) とラスターの外側は平均に含まない（`apps.focal` と同じ）。
+"""
+
+import hashlib
+import itertools
+from typing import Hashable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import scipy.fft
+
+from .cache import LayerCache
+
+# カーネルのスペクトルを保持する合計バイト数の上限
+SPECTRUM_CACHE_MAX_BYTES = 512 * 1024**2
+
+# FFT のブロックの1辺の長さの上限。complex128 のスペクトル1つで約 32MB になる
+FFT_MAX_BLOCK = 2048
+# ブロック1つ当たりの FFT 以外の処理の時間を、FFT の計算量（セル数 x log2）で表した値
+BLOCK_OVERHEAD = 2**16
+# 1次元の FFT でまとめて変換するブロックのセル数（float64 で 2MB）
+AXIS_BLOCK_CELLS = 2**18
+
+# セッション中に共有するカーネルのスペクトルのキャッシュ
+spectrum_cache = LayerCache(SPECTRUM_CACHE_MAX_BYTES)
+
+
+def fft_shape(
+    shape: Tuple[int, int], kernel_shapes: Sequence[Tuple[int, int]]
+) -> Tuple[int, int]:
+    """
+    ## Summary
+        循環畳み込みにならない、FFT の計算が速い配列の形。
+    Args:
+        shape (Tuple[int, int]): 畳み込む配列の (rows, cols)
+        kernel_shapes (Sequence[Tuple[int, int]]): カーネルの形のリスト
+    Returns:
+        Tuple[int, int]: FFT の配列の (rows, cols)
+    """
+    return tuple(
+        scipy.fft.next_fast_len(
+            size + max(kernel_shape[axis] for kernel_shape in kernel_shapes) - 1,
+            real=True,
+        )
+        for axis, size in enumerate(shape)
+    )
+
+
+def _block_lengths(size: int, kernel_size: int, max_block: int) -> List[int]:
+    """
+    ## Summary
+        1つの軸のブロックの長さの候補。
+    """
+    whole = scipy.fft.next_fast_len(size + kernel_size - 1, real=True)
+    if whole <= max_block:
+        return [whole]
+    # カーネルがブロックに収まらない場合は、メモリ使用量よりも畳み込めることを優先する
+    lower = scipy.fft.next_fast_len(2 * kernel_size, real=True)
+    if max_block <= lower:
+        return [lower]
+    step = max(1, (max_block - lower) // 32)
+    lengths = {
+        scipy.fft.next_fast_len(length, real=True)
+        for length in range(lower, max_block + 1, step)
+    }
+    return sorted(length for length in lengths if length <= max_block) or [lower]
+
+
+def block_shape(
+    shape: Tuple[int, int],
+    kernel_shape: Tuple[int, int],
+    max_block: int = FFT_MAX_BLOCK,
+) -> Tuple[int, int]:
+    """
+    ## Summary
+        overlap-save 法の FFT のブロックの形。ブロック1つから出力できるセル数は
+        (ブロック - カーネル + 1) なので、出力1セル当たりの計算量が最小になる形を選ぶ。
+    Args:
+        shape (Tuple[int, int]): 畳み込む配列の (rows, cols)
+        kernel_shape (Tuple[int, int]): カーネルの (rows, cols)
+        max_block (int): ブロックの1辺の長さの上限
+    Returns:
+        Tuple[int, int]: ブロックの (rows, cols)
+    """
+    candidates = [
+        _block_lengths(size, kernel_size, max_block)
+        for size, kernel_size in zip(shape, kernel_shape)
+    ]
+
+    def cost(block: Tuple[int, int]) -> float:
+        cells = block[0] * block[1]
+        outputs = (block[0] - kernel_shape[0] + 1) * (block[1] - kernel_shape[1] + 1)
+        return (cells * np.log2(cells) + BLOCK_OVERHEAD) / outputs
+
+    return min(itertools.product(*candidates), key=cost)
+
+
+def kernel_spectrum(
+    kernel: np.ndarray, fshape: Tuple[int, int], key: Optional[Hashable] = None
+) -> np.ndarray:
+    """
+    ## Summary
+        カーネルのスペクトル。`key` を指定した場合はキャッシュする。
+    Args:
+        kernel (np.ndarray): 2次元のカーネル
+        fshape (Tuple[int, int]): FFT の配列の形
+        key (Hashable): キャッシュのキー。カーネルの種類と解像度等。
+    Returns:
+        np.ndarray: 読み取り専用の complex128 のスペクトル
+    """
+    if key is None:
+        return scipy.fft.rfft2(kernel.astype("float64"), fshape)
+    # 同じ種類と大きさでも、設定が違えば値が異なるので、カーネルの値もキーに含める
+    digest = hashlib.sha1(np.ascontiguousarray(kernel, dtype="float64")).hexdigest()
+    full_key = (key, kernel.shape, fshape, digest)
+    spectrum = spectrum_cache.get(full_key)
+    if spectrum is None:
+        spectrum = scipy.fft.rfft2(kernel.astype("float64"), fshape)
+        spectrum_cache.put(full_key, spectrum)
+    return spectrum
+
+
+def _iter_blocks(
+    shape: Tuple[int, int], kernel_shape: Tuple[int, int], fshape: Tuple[int, int]
+) -> Iterator[Tuple[slice, slice]]:
+    """
+    ## Summary
+        overlap-save 法の出力のブロックを列挙する。
+    Yields:
+        Tuple[slice, slice]: 出力の (行の範囲, 列の範囲)
+    """
+    steps = [f - k + 1 for f, k in zip(fshape, kernel_shape)]
+    for top in range(0, shape[0], steps[0]):
+        for left in range(0, shape[1], steps[1]):
+            yield (
+                slice(top, min(shape[0], top + steps[0])),
+                slice(left, min(shape[1], left + steps[1])),
+            )
+
+
+def _read_block(
+    ary: np.ndarray,
+    rows: slice,
+    cols: slice,
+    kernel_shape: Tuple[int, int],
+    fshape: Tuple[int, int],
+) -> np.ndarray:
+    """
+    ## Summary
+        出力のブロックの計算に必要な入力の範囲を、float64 の配列に読み込む。
+        ラスターの外側は np.nan。
+    """
+    top = rows.start - kernel_shape[0] // 2
+    left = cols.start - kernel_shape[1] // 2
+    block = np.full(fshape, np.nan, dtype="float64")
+    src_top, src_left = max(0, top), max(0, left)
+    src_bottom = min(ary.shape[0], top + fshape[0])
+    src_right = min(ary.shape[1], left + fshape[1])
+    block[
+        src_top - top : src_bottom - top, src_left - left : src_right - left
+    ] = ary[src_top:src_bottom, src_left:src_right]
+    return block
+
+
+def _crop(
+    full: np.ndarray,
+    rows: slice,
+    cols: slice,
+    kernel_shape: Tuple[int, int],
+    max_shape: Tuple[int, int],
+) -> np.ndarray:
+    """
+    ## Summary
+        ブロックの循環畳み込みから、`scipy.signal.convolve(..., mode="same")` と同じ値の範囲を
+        切り出す。入力は最も大きいカーネルに合わせて読み込んでいる。
+    """
+    top = max_shape[0] // 2 + (kernel_shape[0] - 1) // 2
+    left = max_shape[1] // 2 + (kernel_shape[1] - 1) // 2
+    return full[
+        top : top + rows.stop - rows.start, left : left + cols.stop - cols.start
+    ]
+
+
+def convolved_means(
+    ary: np.ndarray,
+    kernels: List[np.ndarray],
+    keys: Optional[List[Hashable]] = None,
+    max_block: int = FFT_MAX_BLOCK,
+) -> List[np.ndarray]:
+    """
+    ## Summary
+        配列の FFT をブロック毎に1度だけ計算し、各カーネルで重み付けした近傍の平均を計算する。
+        Nodata とラスターの外側は平均に含まない。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        kernels (List[np.ndarray]): 2次元のカーネルのリスト
+        keys (List[Hashable]): カーネル毎のスペクトルのキャッシュのキー。None の場合は
+            キャッシュしない。
+        max_block (int): FFT のブロックの1辺の長さの上限
+    Returns:
+        List[np.ndarray]: カーネル毎の float32 の平均。周囲に有効なセルが無い場合は np.nan。
+    """
+    if keys is None:
+        keys = [None] * len(kernels)
+    shape = ary.shape
+    max_shape = tuple(max(kernel.shape[axis] for kernel in kernels) for axis in (0, 1))
+    fshape = block_shape(shape, max_shape, max_block)
+    # 標高の大きさで FFT の誤差が大きくならない様に、平均を引いてから計算する
+    offset = float(np.nanmean(ary)) if not np.isnan(ary).all() else 0.0
+    means = [np.empty(shape, dtype="float32") for _ in kernels]
+    for rows, cols in _iter_blocks(shape, max_shape, fshape):
+        block = _read_block(ary, rows, cols, max_shape, fshape)
+        valid = ~np.isnan(block)
+        block -= offset
+        block[~valid] = 0.0
+        data_spectrum = scipy.fft.rfft2(block, fshape)
+        valid_spectrum = scipy.fft.rfft2(valid, fshape)
+        del block, valid
+        for kernel, key, mean in zip(kernels, keys, means):
+            spectrum = kernel_spectrum(kernel, fshape, key)
+            sums = scipy.fft.irfft2(data_spectrum * spectrum, fshape)
+            sums = _crop(sums, rows, cols, kernel.shape, max_shape)
+            weights = scipy.fft.irfft2(valid_spectrum * spectrum, fshape)
+            weights = _crop(weights, rows, cols, kernel.shape, max_shape)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                block_mean = sums / weights
+            # FFT の誤差で 0 にならない重みは、有効なセルが無いものとする
+            block_mean[np.abs(weights) <= 1e-6 * np.abs(kernel).sum()] = np.nan
+            block_mean += offset
+            mean[rows, cols] = block_mean
+    return means
+
+
+def _fft_convolve_axis(
+    ary: np.ndarray, kernel: np.ndarray, axis: int, max_block: int
+) -> np.ndarray:
+    """
+    ## Summary
+        1次元のカーネルを1つの軸に沿って、1次元の FFT の overlap-save 法で畳み込む。
+        ブロックはカーネルの軸だけで重ねて分割し、もう一方の軸は重ねずに
+        `AXIS_BLOCK_CELLS` 程度のセル数ずつまとめて変換する。
+    """
+    src = np.moveaxis(ary, axis, -1)
+    out = np.empty(ary.shape, dtype=ary.dtype)
+    dst = np.moveaxis(out, axis, -1)
+    lines, size = src.shape
+    size_k = len(kernel)
+
+    def cost(length: int) -> float:
+        cells = AXIS_BLOCK_CELLS
+        return (cells * np.log2(length) + BLOCK_OVERHEAD) / (length - size_k + 1)
+
+    length = min(_block_lengths(size, size_k, max_block), key=cost)
+    batch = max(1, min(lines, AXIS_BLOCK_CELLS // length))
+    spectrum = scipy.fft.rfft(kernel.astype("float64"), length)
+    step = length - size_k + 1
+    # ブロックの循環畳み込みの内、`mode="same"` の出力の先頭の位置
+    crop = size_k // 2 + (size_k - 1) // 2
+    for top in range(0, lines, batch):
+        bottom = min(lines, top + batch)
+        for left in range(0, size, step):
+            right = min(size, left + step)
+            start = left - size_k // 2
+            src_left, src_right = max(0, start), min(size, start + length)
+            block = np.zeros((bottom - top, length), dtype="float64")
+            block[:, src_left - start : src_right - start] = src[
+                top:bottom, src_left:src_right
+            ]
+            block[np.isnan(block)] = 0.0
+            block_spectrum = scipy.fft.rfft(block, axis=-1)
+            block_spectrum *= spectrum
+            full = scipy.fft.irfft(block_spectrum, length, axis=-1)
+            dst[top:bottom, left:right] = full[:, crop : crop + right - left]
+    return out
+
+
+def fft_convolve(
+    ary: np.ndarray, kernel: np.ndarray, max_block: int = FFT_MAX_BLOCK
+) -> np.ndarray:
+    """
+    ## Summary
+        overlap-save 法で FFT の畳み込みを行う。範囲外は 0.0 として扱い、
+        `scipy.signal.fftconvolve(..., mode="same")` と同じ結果になる。
+        (1, n) と (n, 1) のカーネルは、その軸に沿った 1次元の FFT だけで畳み込む。
+    Args:
+        ary (np.ndarray): 2次元の配列。np.nan を含まないこと。
+        kernel (np.ndarray): 2次元のカーネル。1次元のフィルタは (1, n) か (n, 1) にする。
+        max_block (int): FFT のブロックの1辺の長さの上限
+    Returns:
+        np.ndarray: 入力と同じ型の畳み込んだ配列
+    """
+    if kernel.shape[0] == 1:
+        return _fft_convolve_axis(ary, kernel[0], 1, max_block)
+    if kernel.shape[1] == 1:
+        return _fft_convolve_axis(ary, kernel[:, 0], 0, max_block)
+    shape = ary.shape
+    fshape = block_shape(shape, kernel.shape, max_block)
+    spectrum = kernel_spectrum(kernel, fshape)
+    out = np.empty(shape, dtype=ary.dtype)
+    for rows, cols in _iter_blocks(shape, kernel.shape, fshape):
+        block = _read_block(ary, rows, cols, kernel.shape, fshape)
+        block[np.isnan(block)] = 0.0
+        full = scipy.fft.irfft2(scipy.fft.rfft2(block) * spectrum, fshape)
+        out[rows, cols] = _crop(full, rows, cols, kernel.shape, kernel.shape)
+    return out
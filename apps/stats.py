@@ -0,0 +1,526 @@
+"""
+各材料（Slope, TPI, TRI, Hillshade）の統計値。
+
+外れ値処理の閾値とカラーマップの値の範囲はここで計算した統計値から決める。
+タイル毎に計算すると色が変わってしまうので、タイル処理では全体の統計値を1度だけ計算して
+全てのタイルで同じ値を使用する。
+全体の統計値はタイルを計算しながら `StatsSketch` に追加して求める。`StatsSketch` は
+値の範囲を事前に決めずに作成でき、タイル毎やプロセス毎に作成したものを後からまとめられる。
+
+四分位数は既定では細かいヒストグラムから求める。np.nanquantile の様に配列を並べ替えずに、
+ビンの番号を数えるだけなので配列の大きさに比例した時間で計算でき、誤差はビンの幅以下になる。
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+from typing import Callable
+from typing import Hashable
+from typing import Iterator
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+# 四分位数を求めるヒストグラムのビンの数。誤差は (最大値 - 最小値) / ビンの数 以下。
+QUANTILE_BINS = 65536
+# ヒストグラムを数える際に1度に処理するセル数
+HISTOGRAM_CHUNK = 4 * 1024**2
+# 求める順位の入ったビンに、全体のこの割合を超える値がある場合はそのビンを数え直す
+REFINE_FRACTION = 1e-3
+# `FloatHistogram` で float32 の仮数部の上位何ビットまでを区別するか。
+# 分位数の誤差は値の絶対値の 2 ** -SKETCH_MANTISSA_BITS 倍以下になる。
+SKETCH_MANTISSA_BITS = 10
+
+
+@dataclass
+class LayerStats:
+    """
+    ## Summary
+        1つの材料の統計値。
+    Args:
+        vmin (float): 最小値
+        vmax (float): 最大値
+        q1 (float): 第1四分位数。外れ値処理を行わない場合は None。
+        q3 (float): 第3四分位数。外れ値処理を行わない場合は None。
+        quartile_error (float): 四分位数の誤差の上限。np.nanquantile で計算した場合は 0.0。
+    """
+
+    vmin: float
+    vmax: float
+    q1: Optional[float] = None
+    q3: Optional[float] = None
+    quartile_error: Optional[float] = None
+
+    def outlier_bounds(self, threshold: float) -> Tuple[float, float]:
+        """
+        ## Summary
+            IQRによる外れ値処理の下限と上限を返す。
+        Args:
+            threshold (float): IQRの倍率
+        Returns:
+            Tuple[float, float]: (下限, 上限)
+        """
+        iqr = self.q3 - self.q1
+        return (self.q1 - threshold * iqr, self.q3 + threshold * iqr)
+
+    def value_range(self, threshold: Optional[float] = None) -> Tuple[float, float]:
+        """
+        ## Summary
+            カラーマップに使用する値の範囲を返す。外れ値処理を行う場合は、処理後の範囲を返す。
+        Args:
+            threshold (float): IQRの倍率。外れ値処理を行わない場合は None。
+        Returns:
+            Tuple[float, float]: (最小値, 最大値)
+        """
+        if threshold is None:
+            return (self.vmin, self.vmax)
+        lower, upper = self.outlier_bounds(threshold)
+        return (max(self.vmin, lower), min(self.vmax, upper))
+
+
+class Histogram(object):
+    """
+    ## Summary
+        最小値から最大値までを等間隔に分けたヒストグラム。配列を少しずつ追加でき、
+        同じ範囲のヒストグラム同士は度数を足し合わせるだけでまとめられる。
+    Args:
+        vmin (float): 最小値
+        vmax (float): 最大値
+        bins (int): ビンの数
+    """
+
+    def __init__(self, vmin: float, vmax: float, bins: int = QUANTILE_BINS):
+        self.vmin = float(vmin)
+        self.vmax = float(vmax)
+        self.bins = int(bins)
+        self.counts = np.zeros(self.bins, dtype="int64")
+        self._cumsum = None
+
+    @property
+    def width(self) -> float:
+        """
+        ## Summary
+            ビンの幅。求めた分位数の誤差の上限になる。
+        """
+        return (self.vmax - self.vmin) / self.bins
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def _index(self, values: np.ndarray) -> np.ndarray:
+        """
+        ## Summary
+            値が入るビンの番号。範囲外の値は端のビンに入れる。
+        """
+        scale = self.bins / (self.vmax - self.vmin) if self.vmin < self.vmax else 0.0
+        # float32 で計算する。ビンの境界付近の値が隣のビンに入ることがあるが、
+        # 同じ値は常に同じビンに入るので、数え直した度数とは一致する。
+        idx = np.subtract(values, np.float32(self.vmin), dtype="float32")
+        idx *= np.float32(scale)
+        np.clip(idx, 0, self.bins - 1, out=idx)
+        return idx.astype("int32")
+
+    def add(self, ary: np.ndarray) -> None:
+        """
+        ## Summary
+            配列の値を数える。np.nan は無視する。
+        Args:
+            ary (np.ndarray): 数える配列
+        """
+        for chunk in _valid_chunks(ary):
+            self.counts += np.bincount(self._index(chunk), minlength=self.bins)
+        self._cumsum = None
+
+    def merge(self, other: "Histogram") -> None:
+        """
+        ## Summary
+            同じ範囲とビンの数のヒストグラムの度数を足し合わせる。
+        """
+        if (self.vmin, self.vmax, self.bins) != (other.vmin, other.vmax, other.bins):
+            raise ValueError("Histogram ranges do not match.")
+        self.counts += other.counts
+        self._cumsum = None
+
+    def locate(self, rank: int) -> Tuple[int, int]:
+        """
+        ## Summary
+            0 から数えて 'rank' 番目の値が入っているビンと、そのビンの中での順位。
+        """
+        if self._cumsum is None:
+            self._cumsum = np.cumsum(self.counts)
+        b = int(np.searchsorted(self._cumsum, rank, side="right"))
+        before = int(self._cumsum[b - 1]) if 0 < b else 0
+        return b, int(rank) - before
+
+    def rank_value(self, rank: int) -> float:
+        """
+        ## Summary
+            'rank' 番目の値を、ビンの中では値が等間隔に並んでいるとみなして求める。
+            値は求めたビンの中にあるので、誤差は `width` 以下になる。
+        """
+        b, inner = self.locate(rank)
+        return self.vmin + (b + (inner + 0.5) / self.counts[b]) * self.width
+
+    def refine(self, ary: np.ndarray, b: int) -> "Histogram":
+        """
+        ## Summary
+            ビン 'b' に入る値だけを、そのビンの範囲を同じ数のビンに分けて数え直す。
+        Args:
+            ary (np.ndarray): このヒストグラムに追加した配列
+            b (int): 数え直すビン
+        Returns:
+            Histogram: ビン 'b' の範囲のヒストグラム
+        """
+        lower = self.vmin + b * self.width
+        sub = Histogram(lower, lower + self.width, self.bins)
+        for chunk in _valid_chunks(ary):
+            values = chunk[self._index(chunk) == b]
+            sub.counts += np.bincount(sub._index(values), minlength=sub.bins)
+        return sub
+
+    def quantiles(self, probs: Sequence[float]) -> np.ndarray:
+        """
+        ## Summary
+            np.nanquantile（method='linear'）と同じ順位の値から分位数を求める。
+            誤差は `width` 以下。
+        Args:
+            probs (Sequence[float]): 0.0 から 1.0 の確率
+        Returns:
+            np.ndarray: float64 の分位数。値が無い場合は np.nan。
+        """
+        total = self.total
+        probs = np.asarray(probs, dtype="float64")
+        if total == 0:
+            return np.full(probs.shape, np.nan)
+        return _interpolate_ranks(probs, total, self.rank_value)
+
+
+def _valid_chunks(ary: np.ndarray) -> Iterator[np.ndarray]:
+    """
+    ## Summary
+        配列を 'HISTOGRAM_CHUNK' セル毎に分け、np.nan を除いて返す。
+    """
+    flat = np.asarray(ary).reshape(-1)
+    for start in range(0, flat.size, HISTOGRAM_CHUNK):
+        chunk = flat[start : start + HISTOGRAM_CHUNK]
+        yield chunk[~np.isnan(chunk)]
+
+
+def _interpolate_ranks(
+    probs: np.ndarray, total: int, rank_value: Callable[[int], float]
+) -> np.ndarray:
+    """
+    ## Summary
+        np.nanquantile（method='linear'）と同様に、前後の順位の値を線形補間する。
+    """
+    position = probs * (total - 1)
+    lower = np.floor(position).astype("int64")
+    upper = np.minimum(lower + 1, total - 1)
+    values = {int(rank): rank_value(int(rank)) for rank in np.union1d(lower, upper)}
+    low = np.array([values[int(rank)] for rank in lower.reshape(-1)])
+    high = np.array([values[int(rank)] for rank in upper.reshape(-1)])
+    result = low + (position.reshape(-1) - lower.reshape(-1)) * (high - low)
+    return result.reshape(probs.shape)
+
+
+def approx_quantiles(
+    ary: np.ndarray,
+    probs: Sequence[float],
+    bins: int = QUANTILE_BINS,
+    value_range: Optional[Tuple[float, float]] = None,
+    max_passes: int = 3,
+) -> Tuple[np.ndarray, float]:
+    """
+    ## Summary
+        ヒストグラムから分位数を求める。配列の大きさに比例した時間で計算できる。
+        裾の重い分布で求める順位の入ったビンに値が集中している場合（全体の 'REFINE_FRACTION'
+        を超える場合）は、そのビンだけを数え直して誤差を小さくする。
+    Args:
+        ary (np.ndarray): 配列。np.nan は無視する。
+        probs (Sequence[float]): 0.0 から 1.0 の確率
+        bins (int): ビンの数
+        value_range (Tuple[float, float]): 計算済みの (最小値, 最大値)
+        max_passes (int): 配列を数える回数の上限（順位毎）
+    Returns:
+        Tuple[np.ndarray, float]: 分位数と、その誤差の上限
+    """
+    if value_range is None:
+        value_range = (float(np.nanmin(ary)), float(np.nanmax(ary)))
+    hist = Histogram(value_range[0], value_range[1], bins)
+    hist.add(ary)
+    total = hist.total
+    probs = np.asarray(probs, dtype="float64")
+    if total == 0:
+        return np.full(probs.shape, np.nan), 0.0
+    refined = {}
+    errors = []
+
+    def rank_value(rank: int) -> float:
+        current, key = hist, ()
+        for _ in range(max_passes - 1):
+            b, inner = current.locate(rank)
+            if current.counts[b] <= total * REFINE_FRACTION or current.width == 0:
+                break
+            key = key + (b,)
+            if key not in refined:
+                refined[key] = current.refine(ary, b)
+            current, rank = refined[key], inner
+        errors.append(current.width)
+        return current.rank_value(rank)
+
+    values = _interpolate_ranks(probs, total, rank_value)
+    return values, max(errors)
+
+
+class FloatHistogram(object):
+    """
+    ## Summary
+        float32 のビット列の上位ビットをビンの番号にしたヒストグラム。ビンの幅は値の
+        絶対値に比例するので、値の範囲を事前に決める必要が無い。ビンは全ての配列で共通なので、
+        度数を足し合わせるだけでまとめられる。
+    Args:
+        mantissa_bits (int): 区別する仮数部のビット数。ビンの幅は値の絶対値の
+            2 ** -mantissa_bits 倍以下。
+    """
+
+    def __init__(self, mantissa_bits: int = SKETCH_MANTISSA_BITS):
+        self.mantissa_bits = int(mantissa_bits)
+        self._shift = 23 - self.mantissa_bits
+        # 正の値のビンの開始位置。負の値はこれより前のビンに逆順に入れる
+        self._half = 1 << (8 + self.mantissa_bits)
+        self.counts = np.zeros(2 * self._half, dtype="int64")
+        self._cumsum = None
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def _index(self, values: np.ndarray) -> np.ndarray:
+        """
+        ## Summary
+            値が入るビンの番号。値の大小とビンの番号の大小は一致する。
+        """
+        bits = np.ascontiguousarray(values, dtype="float32").view("int32")
+        magnitude = bits & 0x7FFFFFFF
+        magnitude >>= self._shift
+        # 負の値は符号ビットから作った -1 との XOR で -magnitude - 1 にする
+        magnitude ^= bits >> 31
+        magnitude += self._half
+        return magnitude
+
+    def bin_edges(self, b: int) -> Tuple[float, float]:
+        """
+        ## Summary
+            ビン 'b' に入る値の (下限, 上限)。
+        """
+        magnitude = b - self._half if self._half <= b else self._half - 1 - b
+        edges = np.array(
+            [magnitude << self._shift, (magnitude + 1) << self._shift], dtype="int64"
+        )
+        lower, upper = edges.astype("int32").view("float32").astype("float64")
+        if b < self._half:
+            return (-upper, -lower)
+        return (lower, upper)
+
+    def add(self, ary: np.ndarray) -> None:
+        """
+        ## Summary
+            配列の値を数える。np.nan は無視する。
+        """
+        for chunk in _valid_chunks(ary):
+            self.counts += np.bincount(self._index(chunk), minlength=self.counts.size)
+        self._cumsum = None
+
+    def merge(self, other: "FloatHistogram") -> None:
+        """
+        ## Summary
+            同じビット数のヒストグラムの度数を足し合わせる。
+        """
+        if self.mantissa_bits != other.mantissa_bits:
+            raise ValueError("Histogram resolutions do not match.")
+        self.counts += other.counts
+        self._cumsum = None
+
+    def rank_value(self, rank: int) -> Tuple[float, float]:
+        """
+        ## Summary
+            'rank' 番目の値を、ビンの中では値が等間隔に並んでいるとみなして求める。
+        Returns:
+            Tuple[float, float]: 値と、その誤差の上限（ビンの幅）
+        """
+        if self._cumsum is None:
+            self._cumsum = np.cumsum(self.counts)
+        b = int(np.searchsorted(self._cumsum, rank, side="right"))
+        before = int(self._cumsum[b - 1]) if 0 < b else 0
+        lower, upper = self.bin_edges(b)
+        frac = (int(rank) - before + 0.5) / self.counts[b]
+        return lower + frac * (upper - lower), upper - lower
+
+    def quantiles(self, probs: Sequence[float]) -> Tuple[np.ndarray, float]:
+        """
+        ## Summary
+            np.nanquantile（method='linear'）と同じ順位の値から分位数を求める。
+        Args:
+            probs (Sequence[float]): 0.0 から 1.0 の確率
+        Returns:
+            Tuple[np.ndarray, float]: 分位数と、その誤差の上限。値が無い場合は np.nan。
+        """
+        total = self.total
+        probs = np.asarray(probs, dtype="float64")
+        if total == 0:
+            return np.full(probs.shape, np.nan), 0.0
+        errors = [0.0]
+
+        def rank_value(rank: int) -> float:
+            value, error = self.rank_value(rank)
+            errors.append(error)
+            return value
+
+        return _interpolate_ranks(probs, total, rank_value), max(errors)
+
+
+def layer_stats(
+    ary: np.ndarray, quartiles: bool = False, method: str = "histogram"
+) -> LayerStats:
+    """
+    ## Summary
+        配列全体から統計値を計算する。
+    Args:
+        ary (np.ndarray): 材料の配列。np.nan は無視する。
+        quartiles (bool): 四分位数も計算するかどうか。
+        method (str): 四分位数の計算方法。'histogram' は `approx_quantiles` で、
+            'exact' は np.nanquantile で計算する。
+    Returns:
+        LayerStats: 統計値
+    """
+    if np.isnan(ary).all():
+        return LayerStats(vmin=np.nan, vmax=np.nan, q1=np.nan, q3=np.nan)
+    stats = LayerStats(vmin=float(np.nanmin(ary)), vmax=float(np.nanmax(ary)))
+    if quartiles:
+        if method == "exact":
+            q1, q3 = np.nanquantile(ary, [0.25, 0.75])
+            error = 0.0
+        else:
+            (q1, q3), error = approx_quantiles(
+                ary, [0.25, 0.75], value_range=(stats.vmin, stats.vmax)
+            )
+        stats.q1 = float(q1)
+        stats.q3 = float(q3)
+        stats.quartile_error = float(error)
+    return stats
+
+
+class StatsSketch(object):
+    """
+    ## Summary
+        1つの材料の統計値を、配列を少しずつ追加しながら求める。最小値と最大値は正確な値で、
+        四分位数は `FloatHistogram` から求める。タイル毎やプロセス毎に作成した
+        `StatsSketch` は `merge` でまとめられる。
+    Args:
+        quartiles (bool): 四分位数も求めるかどうか。
+        mantissa_bits (int): `FloatHistogram` の仮数部のビット数
+    """
+
+    def __init__(
+        self, quartiles: bool = False, mantissa_bits: int = SKETCH_MANTISSA_BITS
+    ):
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.histogram = FloatHistogram(mantissa_bits) if quartiles else None
+
+    def add(self, ary: np.ndarray) -> None:
+        """
+        ## Summary
+            配列を追加する。np.nan は無視する。
+        """
+        ary = np.asarray(ary)
+        if ary.size == 0 or np.isnan(ary).all():
+            return
+        self.vmin = min(self.vmin, float(np.nanmin(ary)))
+        self.vmax = max(self.vmax, float(np.nanmax(ary)))
+        if self.histogram is not None:
+            self.histogram.add(ary)
+
+    def merge(self, other: "StatsSketch") -> None:
+        """
+        ## Summary
+            別の配列から作成した `StatsSketch` をまとめる。
+        """
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+
+    def stats(self) -> LayerStats:
+        """
+        ## Summary
+            追加した全ての配列の統計値。
+        Returns:
+            LayerStats: 統計値。四分位数は最小値と最大値の範囲に収める。
+        """
+        if self.vmax < self.vmin:
+            return LayerStats(vmin=np.nan, vmax=np.nan, q1=np.nan, q3=np.nan)
+        stats = LayerStats(vmin=self.vmin, vmax=self.vmax)
+        if self.histogram is not None:
+            (q1, q3), error = self.histogram.quantiles([0.25, 0.75])
+            stats.q1 = float(np.clip(q1, self.vmin, self.vmax))
+            stats.q3 = float(np.clip(q3, self.vmin, self.vmax))
+            stats.quartile_error = float(error)
+        return stats
+
+
+class StatsCache(object):
+    """
+    ## Summary
+        材料の統計値のキャッシュ。材料の配列のキャッシュと同じキーを使用し、
+        見た目の設定だけを変更して再実行した場合は統計値も計算し直さない。
+    Args:
+        max_items (int): 保持する統計値の数の上限
+    """
+
+    def __init__(self, max_items: int = 256):
+        self.max_items = max_items
+        self._items: "OrderedDict[Hashable, LayerStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[LayerStats]:
+        with self._lock:
+            stats = self._items.get(key)
+            if stats is not None:
+                self._items.move_to_end(key)
+            return stats
+
+    def put(self, key: Hashable, stats: LayerStats) -> None:
+        with self._lock:
+            self._items[key] = stats
+            self._items.move_to_end(key)
+            while self.max_items < len(self._items):
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+# セッション中に共有する統計値のキャッシュ
+stats_cache = StatsCache()
+
+
+def outlier_treatment_by_iqr(
+    ary: np.ndarray, threshold: float, stats: LayerStats
+) -> np.ndarray:
+    """
+    ## Summary
+        IQRを使用して外れ値を下限と上限に丸める。
+    Args:
+        ary (np.ndarray): 材料の配列
+        threshold (float): IQRの倍率
+        stats (LayerStats): 四分位数を含む統計値。タイル処理では全体の統計値を渡す。
+    Returns:
+        np.ndarray: 外れ値処理後の配列。np.nan はそのまま残る。
+    """
+    lower, upper = stats.outlier_bounds(threshold)
+    return np.clip(ary, lower, upper)
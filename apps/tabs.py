@@ -1,7 +1,5 @@
-from dataclasses import dataclass
 import datetime
 import os
-import tempfile
 from typing import Dict
 from typing import List
 from pathlib import Path
@@ -17,8 +15,20 @@ from qgis.utils import iface as qgis_iface
 
 from .config import Configs
 from .config import MapColors
+from .config import xyz_tiles_config
 from .custom_color_dialog import CustomColorDialog
+from .engine import generate_kernel
+from .options import FirstResampleSpec
+from .options import HillshadeOptions
+from .options import OthersOptions
+from .options import OutputSpec
+from .options import SlopeOptions
+from .options import TpiOptions
+from .options import TriOptions
 from .visualize import plot_histgram
+from .vsimem import is_memory_path
+from .vsimem import memory_outputs
+from .vsimem import memory_path
 from ..gdal_drawer.kernels import kernels
 from ..gdal_drawer.custom import CustomGdalDataset
 from ..gdal_drawer.utils.colors import LinearColorMap
@@ -28,15 +38,6 @@ configs = Configs()
 
 ################################################################################
 ################# Input tab ####################################################
-@dataclass
-class FirstResampleSpec:
-    execute: bool
-    metre_spec: bool
-    resolution: float
-    denominator: int
-    smooth_alg: str
-
-
 class InputTab(object):
     """This class is used to get the input data from the input tab."""
 
@@ -173,19 +174,6 @@ class InputTab(object):
 
 ################################################################################
 #################### Output tab ###############################################
-@dataclass
-class OutputSpec:
-    sample_only: bool
-    sampling_max_cols: int
-    sampling_max_rows: int
-    add_project: bool
-    output_file_path: str
-    slope_cmap: LinearColorMap
-    tpi_cmap: LinearColorMap
-    tri_cmap: LinearColorMap
-    hillshade_cmap: LinearColorMap
-
-
 class OutputTab(object):
     """
     ## Summary
@@ -269,6 +257,8 @@ class OutputTab(object):
                 - tpi_cmap: The color map for the TPI.
                 - tri_cmap: The color map for the TRI.
                 - hillshade_cmap: The color map for the hillshade.
+                - tile_format, min_zoom, max_zoom: The XYZ tile settings for
+                  '.mbtiles' and '.gpkg' outputs ('XyzTiles' in apps/config.json).
         """
         return OutputSpec(
             sample_only=self.checkBox_Sample.isChecked(),
@@ -280,6 +270,7 @@ class OutputTab(object):
             tpi_cmap=self.get_cmaps()["tpi"],
             tri_cmap=self.get_cmaps()["tri"],
             hillshade_cmap=self.get_cmaps()["hillshade"],
+            **xyz_tiles_config(),
         )
 
     def get_style_name(self) -> str:
@@ -321,25 +312,28 @@ class OutputTab(object):
         """
         locale = QSettings().value("locale/userLocale")[0:2]
         if locale == "ja":
-            txt = "[一時ファイルに保存]"
+            txt = "[メモリ上に一時保存]"
         else:
-            txt = "[Save to temporary file]"
+            txt = "[Keep in memory temporarily]"
         fwgt = self.fileWgt_OutputFile
         fwgt.lineEdit().setPlaceholderText(txt)
-        self.fileWgt_OutputFile.setFilter("GeoTiff (*.tif);;")
+        self.fileWgt_OutputFile.setFilter(
+            "GeoTiff (*.tif);;MBTiles (*.mbtiles);;GeoPackage (*.gpkg)"
+        )
 
     def get_file_path(self) -> Path:
         """
         ## Summary
             Get the file path of the output raster data.
         Returns:
-            Path[str]: The file path of the output raster data. If empty, create temporary file
+            Path[str]: The file path of the output raster data. If empty, a path in
+                /vsimem (see `apps.vsimem`). It is replaced by a temporary file when the
+                output exceeds the memory limit.
         """
         path = self.fileWgt_OutputFile.filePath()
         if path == "":
-            # ファイルパスが空の場合、一時ファイルを作成
-            with tempfile.NamedTemporaryFile(suffix="_topoMaps.tif") as tf:
-                path = tf.name
+            # ファイルパスが空の場合、メモリ上（/vsimem）に出力する
+            path = memory_path()
             # レイヤーも強制的に追加
             self.checkBox_AddProject.setChecked(True)
             self.temp_file = True
@@ -360,9 +354,47 @@ class OutputTab(object):
             else:
                 lyr_name = os.path.basename(output_file_path).split(".")[0]
             lyr = QgsRasterLayer(output_file_path, lyr_name, "gdal")
+            if is_memory_path(output_file_path):
+                self.connect_memory_outputs()
+                memory_outputs.add(lyr, output_file_path)
             QgsProject.instance().addMapLayer(lyr)
         self.temp_file = False
 
+    def connect_memory_outputs(self) -> None:
+        """
+        ## Summary
+            Connect the project signals that manage the outputs kept in /vsimem.
+            When a layer is removed, its output is released. When the project is saved,
+            the output is copied to a temporary file and the saved data source points
+            to it.
+        """
+        if memory_outputs.connected:
+            return
+        project = QgsProject.instance()
+        project.layersWillBeRemoved.connect(
+            lambda layer_ids: [memory_outputs.remove(i) for i in layer_ids]
+        )
+        project.writeMapLayer.connect(self.spill_memory_output)
+        memory_outputs.connected = True
+
+    @staticmethod
+    def spill_memory_output(layer, elem, doc) -> None:
+        """
+        ## Summary
+            Copy the output of the layer in /vsimem to a temporary file while the
+            project is saved, and rewrite the data source of the saved layer.
+        Args:
+            layer (QgsMapLayer): The layer being saved.
+            elem (QDomElement): The element of the layer in the project.
+            doc (QDomDocument): The project document.
+        """
+        new_path = memory_outputs.spill(layer.id())
+        if new_path is None:
+            return
+        source = elem.firstChildElement("datasource")
+        if not source.isNull():
+            source.firstChild().setNodeValue(new_path)
+
     def str_time(self, prefix: str = "", suffix: str = "") -> str:
         """
         ## Summary
@@ -382,17 +414,6 @@ class OutputTab(object):
 
 ################################################################################
 #################### Slope tab ###############################################
-@dataclass
-class SlopeOptions:
-    metre_spec: bool
-    distance: float
-    cells: int
-    execute_gaussian_filter: bool
-    sigma: float
-    change_alpha: bool
-    alpha: float
-
-
 class SlopeTab(object):
     """
     ## Summary
@@ -430,22 +451,6 @@ class SlopeTab(object):
 
 ################################################################################
 #################### TPI tab ###############################################
-@dataclass
-class TpiOptions:
-    kernel_spec: str
-    metre_spec: bool
-    distance: float
-    cells: int
-    sigma: float
-    coef: float
-    execute_outlier_treatment: bool
-    iqr: float
-    change_alpha: bool
-    alpha: float
-    multiple_tpi: bool
-    multiples_distance: float
-
-
 class TpiTab(object):
     def get_tpi_options(self):
         if self.radioBtn_OrgKernel.isChecked():
@@ -473,6 +478,7 @@ class TpiTab(object):
             alpha=self.spinBoxInt_TpiAlpha.value() * 0.01,
             multiple_tpi=self.gpBox_MultipleTpi.isChecked(),
             multiples_distance=self.spinBoxF_TpiMultiplesDistance.value(),
+            algorithm="fast" if self.checkBox_TpiFast.isChecked() else "convolve",
         )
 
     def make_tpi_tab(self) -> None:
@@ -536,30 +542,7 @@ class TpiTab(object):
             np.array: カーネル
         """
         options = self.get_tpi_options()
-        # multiplesが指定されている場合は、カーネルサイズを大きくする
-        sigma = options.sigma * kwargs.get("multiples", 1.0)
-        distance = options.distance * kwargs.get("multiples", 1.0)
-        cells = int(options.cells * kwargs.get("multiples", 1.0))
-        if options.kernel_spec == "org":
-            # gdal.DEMProcessing で計算するため、カーネルは不要
-            kernel = None
-        elif options.kernel_spec == "gauss":
-            kernel = kernels.gaussian_kernel(sigma, options.coef)
-        elif options.kernel_spec == "inv_gauss":
-            kernel = kernels.inverse_gaussian_kernel(sigma, options.coef)
-        elif options.metre_spec:
-            # 畳み込みのカーネルサイズをメートル単位で指定
-            if options.kernel_spec == "mean":
-                kernel = dst.mean_kernel_from_distance(distance, True)
-            else:
-                kernel = dst.doughnut_kernel_from_distance(distance, True)
-        else:
-            # 畳み込みのカーネルサイズをセル数で指定
-            if options.kernel_spec == "mean":
-                kernel = kernels.mean_kernel(cells)
-            else:
-                kernel = kernels.doughnut_kernel(cells)
-        return kernel
+        return generate_kernel(dst, options, kwargs.get("multiples", 1.0))
 
     def show_kernel(self, dst: CustomGdalDataset) -> None:
         """
@@ -585,17 +568,6 @@ class TpiTab(object):
 
 ################################################################################
 #################### TRI tab ###############################################
-@dataclass
-class TriOptions:
-    execute: bool
-    execute_gaussian_filter: bool
-    sigma: float
-    execute_outlier_treatment: bool
-    iqr: float
-    change_alpha: bool
-    alpha: float
-
-
 class TriTab(object):
     def get_tri_options(self):
         return TriOptions(
@@ -616,19 +588,6 @@ class TriTab(object):
 
 ################################################################################
 #################### Hillshade tab #############################################
-@dataclass
-class HillshadeOptions:
-    hillshade_type: str
-    azimuth: float
-    altitude: float
-    z_factor: float
-    combined: bool
-    execute_gaussian_filter: bool
-    sigma: float
-    execute_outlier_treatment: bool
-    iqr: float
-
-
 class HillshadeTab(object):
     def get_hillshade_options(self):
         if self.cmbBox_HillshadeType.currentIndex() == 0:
@@ -665,16 +624,6 @@ class HillshadeTab(object):
 
 ################################################################################
 #################### Others tab ###############################################
-@dataclass
-class OthersOptions:
-    execute_unsharpn_mask: bool
-    unsharpn_radius: float
-    unsharpn_percent: int
-    unsharpn_threshold: int
-    execute_contrast: bool
-    contrast_value: float
-
-
 class OthersTab(object):
     def get_others_options(self):
         return OthersOptions(
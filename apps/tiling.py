@@ -0,0 +1,282 @@
+"""
+ラスターをタイルに分割して計算する為のユーティリティ。
+
+各タイルはカーネルの半径分（ハロー）だけ広げて読み込み、計算後にハローを切り取ってから
+つなぎ合わせる。ハローが使用するカーネルの半径以上であれば、タイルの境界に継ぎ目は出来ない。
+"""
+
+from dataclasses import dataclass
+import math
+from typing import TYPE_CHECKING
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import numpy as np
+import scipy.ndimage
+
+from .smoothing import gaussian_radius
+
+if TYPE_CHECKING:
+    # 型注釈だけに使用する。GDAL と QGIS の無い環境（単体テスト）でも読み込める様にする
+    from ..gdal_drawer.custom import CustomGdalDataset
+    from .options import TopoMapSpec
+
+# 傾斜の Nodata を埋める fill_nodata の平滑化の繰り返し回数
+FILL_NODATA_ITERATIONS = 10
+
+
+@dataclass
+class Window:
+    """
+    ## Summary
+        タイルの範囲。'x_off'等は切り取った後の範囲、'pad_*'はハローを含めた読み込み範囲。
+        全てセル単位。
+    """
+
+    x_off: int
+    y_off: int
+    x_size: int
+    y_size: int
+    pad_x_off: int
+    pad_y_off: int
+    pad_x_size: int
+    pad_y_size: int
+
+    @property
+    def crop(self) -> Tuple[slice, slice]:
+        """
+        ## Summary
+            ハローを含めた配列から、タイル部分を切り取る為のスライス。
+        """
+        top = self.y_off - self.pad_y_off
+        left = self.x_off - self.pad_x_off
+        return (
+            slice(top, top + self.y_size),
+            slice(left, left + self.x_size),
+        )
+
+    @property
+    def slices(self) -> Tuple[slice, slice]:
+        """
+        ## Summary
+            全体の配列の中でタイルが占める範囲のスライス。
+        """
+        return (
+            slice(self.y_off, self.y_off + self.y_size),
+            slice(self.x_off, self.x_off + self.x_size),
+        )
+
+    @property
+    def pad_slices(self) -> Tuple[slice, slice]:
+        """
+        ## Summary
+            全体の配列の中でハローを含めたタイルが占める範囲のスライス。
+        """
+        return (
+            slice(self.pad_y_off, self.pad_y_off + self.pad_y_size),
+            slice(self.pad_x_off, self.pad_x_off + self.pad_x_size),
+        )
+
+
+def iter_windows(
+    x_size: int, y_size: int, tile_size: int, halo: int, align: int = 1
+) -> Iterator[Window]:
+    """
+    ## Summary
+        ラスターをタイルに分割する。
+    Args:
+        x_size (int): ラスターの列数
+        y_size (int): ラスターの行数
+        tile_size (int): タイルの1辺のセル数
+        halo (int): タイルの周囲に追加するセル数
+        align (int): タイルの開始位置をこの値の倍数に揃える。リサンプルを伴う計算で
+            全体を計算した場合とグリッドを一致させる為に使用する。
+    Yields:
+        Window: タイルの範囲
+    """
+    align = max(int(align), 1)
+    tile_size = window_step(tile_size, align)
+    halo = int(math.ceil(halo / align)) * align
+    for y_off in range(0, y_size, tile_size):
+        rows = min(tile_size, y_size - y_off)
+        pad_y_off = max(0, y_off - halo)
+        pad_y_end = min(y_size, y_off + rows + halo)
+        for x_off in range(0, x_size, tile_size):
+            cols = min(tile_size, x_size - x_off)
+            pad_x_off = max(0, x_off - halo)
+            pad_x_end = min(x_size, x_off + cols + halo)
+            yield Window(
+                x_off=x_off,
+                y_off=y_off,
+                x_size=cols,
+                y_size=rows,
+                pad_x_off=pad_x_off,
+                pad_y_off=pad_y_off,
+                pad_x_size=pad_x_end - pad_x_off,
+                pad_y_size=pad_y_end - pad_y_off,
+            )
+
+
+def window_step(tile_size: int, align: int = 1) -> int:
+    """
+    ## Summary
+        `iter_windows` のタイルの間隔。'tile_size' を 'align' の倍数に切り上げる。
+    """
+    align = max(int(align), 1)
+    return max(align, int(math.ceil(tile_size / align)) * align)
+
+
+class EmptyTiles(object):
+    """
+    ## Summary
+        Nodata だけのタイルの位置。`iter_windows` と同じ間隔の格子で記録し、任意の範囲が
+        Nodata だけのタイルに含まれるかどうかを判定する。
+    Args:
+        x_size (int): ラスターの列数
+        y_size (int): ラスターの行数
+        tile_size (int): `iter_windows` に渡したタイルの1辺のセル数
+        align (int): `iter_windows` に渡したタイルの開始位置の倍数
+    """
+
+    def __init__(self, x_size: int, y_size: int, tile_size: int, align: int = 1):
+        self.step = window_step(tile_size, align)
+        self.grid = np.zeros(
+            (-(-y_size // self.step), -(-x_size // self.step)), dtype=bool
+        )
+
+    def add(self, window: Window) -> None:
+        """
+        ## Summary
+            Nodata だけのタイルを記録する。
+        """
+        self.grid[window.y_off // self.step, window.x_off // self.step] = True
+
+    @property
+    def count(self) -> int:
+        return int(np.count_nonzero(self.grid))
+
+    def covers(self, rows: slice, cols: slice) -> bool:
+        """
+        ## Summary
+            範囲の全てのセルが Nodata だけのタイルに含まれるかどうか。
+        Args:
+            rows (slice): 範囲の行
+            cols (slice): 範囲の列
+        Returns:
+            bool: 含まれる場合は True
+        """
+        block = self.grid[
+            rows.start // self.step : (rows.stop - 1) // self.step + 1,
+            cols.start // self.step : (cols.stop - 1) // self.step + 1,
+        ]
+        return bool(block.size) and bool(block.all())
+
+
+def void_windows(
+    nan_idx: np.ndarray, margin: int
+) -> List[Tuple[Tuple[slice, slice], np.ndarray]]:
+    """
+    ## Summary
+        Nodata の領域を、周囲 'margin' セルを含めた範囲毎にまとめる。範囲が重なる Nodata の
+        領域は1つにまとめるので、各範囲は他の範囲と独立して Nodata を埋められる。
+    Args:
+        nan_idx (np.ndarray): Nodata の位置の bool の配列
+        margin (int): Nodata の周囲に含めるセル数（fill_nodata の探索距離等）
+    Returns:
+        List[Tuple[Tuple[slice, slice], np.ndarray]]: 範囲と、その範囲内で埋める Nodata の位置
+    """
+    margin = max(int(margin), 0)
+    if 0 < margin:
+        regions = scipy.ndimage.maximum_filter(
+            nan_idx.view("uint8"), size=2 * margin + 1, mode="constant"
+        )
+    else:
+        regions = nan_idx
+    labels, _ = scipy.ndimage.label(regions, structure=np.ones((3, 3)))
+    del regions
+    windows = []
+    for label, window in enumerate(scipy.ndimage.find_objects(labels), start=1):
+        if window is None:
+            continue
+        windows.append((window, (labels[window] == label) & nan_idx[window]))
+    return windows
+
+
+def slope_step(cell_size: float, spec: "TopoMapSpec") -> int:
+    """
+    ## Summary
+        傾斜を計算する近傍の間隔（セル数）。
+    Args:
+        cell_size (float): セルサイズ（メートル）
+        spec (TopoMapSpec): 微地形図の設定
+    Returns:
+        int: 近傍の間隔
+    """
+    options = spec.slope
+    if options.metre_spec:
+        return max(1, int(math.ceil(options.distance / cell_size)))
+    return max(1, int(options.cells))
+
+
+def fill_nodata_margin(distance: float, cell_size: float) -> int:
+    """
+    ## Summary
+        fill_nodata が Nodata の周囲で参照するセル数。探索距離（メートル）をセル数に変換し、
+        平滑化の繰り返し回数の分を加える。
+    Args:
+        distance (float): 探索距離（メートル）
+        cell_size (float): セルサイズ（メートル）
+    Returns:
+        int: セル数
+    """
+    return int(math.ceil(distance / cell_size)) + FILL_NODATA_ITERATIONS
+
+
+def compute_halo(
+    dst: "CustomGdalDataset", spec: "TopoMapSpec", tpi_kernels: List[np.ndarray]
+) -> int:
+    """
+    ## Summary
+        使用する全てのカーネルの中で最も大きい半径（セル数）を計算する。
+    Args:
+        dst (CustomGdalDataset): 全体のデータセット
+        spec (TopoMapSpec): 微地形図の設定
+        tpi_kernels (List[np.ndarray]): TPIで使用するカーネル（2枚目のTPIを含む）
+    Returns:
+        int: ハローのセル数
+    """
+    truncate = spec.execution.smoothing_truncate
+    # 3x3 の近傍を使用する計算（陰影起伏図、TRI）の分
+    radii = [1]
+    # Slope
+    slope_options = spec.slope
+    cell_size = dst.cell_size_in_metre()
+    slope_radius = slope_step(cell_size.x_size, spec)
+    if slope_options.execute_gaussian_filter:
+        slope_radius += gaussian_radius(slope_options.sigma, truncate)
+        if spec.execution.smoothing_nodata == "fill":
+            # fill_nodata の探索距離と平滑化の繰り返し回数の分も広げる
+            slope_radius += fill_nodata_margin(
+                slope_options.distance, min(cell_size.x_size, cell_size.y_size)
+            )
+    radii.append(slope_radius)
+    # TPI
+    for kernel in tpi_kernels:
+        if kernel is not None:
+            radii.append(max(np.shape(kernel)) // 2 + 1)
+    # TRI
+    if spec.tri.execute and spec.tri.execute_gaussian_filter:
+        radii.append(gaussian_radius(spec.tri.sigma, truncate) + 1)
+    # Hillshade
+    if spec.hillshade.execute_gaussian_filter:
+        radii.append(gaussian_radius(spec.hillshade.sigma, truncate) + 1)
+    return max(radii)
+
+
+def unsharpn_mask_halo(radius: float) -> int:
+    """
+    ## Summary
+        PIL の UnsharpMask（3回のボックスブラー）が参照するセル数。
+    """
+    return int(math.ceil(radius * 6)) + 3
@@ -1,9 +1,14 @@
+from typing import Optional
+
 import matplotlib.pyplot as plt
 from matplotlib.colors import to_rgba
 import numpy as np
 
+from .stats import LayerStats
+from .stats import layer_stats
+
 
-def plot_histgram(data: np.ndarray):
+def plot_histgram(data: np.ndarray, stats: Optional[LayerStats] = None):
     if 1 < len(data.shape):
         data = data.flatten()
     data = data[~np.isnan(data)]
@@ -15,8 +20,10 @@ def plot_histgram(data: np.ndarray):
     color = "#008899"
     ax.hist(data, bins=20, fc=to_rgba(color, 0.5), ec=color, density=True)
 
-    q1 = np.nanquantile(data, 0.25)
-    q3 = np.nanquantile(data, 0.75)
+    # 材料の統計値を計算済みの場合は、その四分位数を使用する
+    if stats is None or stats.q1 is None:
+        stats = layer_stats(data, quartiles=True)
+    q1, q3 = stats.q1, stats.q3
     iqr = q3 - q1
     upper_func = lambda x: q3 + x * iqr
     lower_func = lambda x: q1 - x * iqr
@@ -0,0 +1,173 @@
+"""
+出力ファイルを指定しない場合の微地形図を、メモリ上（GDAL の /vsimem）に保持する。
+
+出力ファイルを指定しない場合は一時ファイルに GeoTIFF を書き込み、それを QGIS で開き直して
+いた。確認の為に何度も作り直す使い方では、このディスクへの書き込みと読み直しが無駄になる。
+ここでは /vsimem に書き込んでそのままレイヤーとして追加する。/vsimem 上の出力の合計が
+上限（`OutputSpec.memory_max_bytes`）を超える場合は、従来通り一時ファイルに書き込む。
+
+/vsimem 上の出力は QGIS を終了すると失われるので、プロジェクトを保存する時に一時ファイル
+にコピーし、レイヤーの参照先を切り替える（`MemoryOutputs.spill`）。レイヤーを削除した
+場合はメモリを解放する。
+"""
+
+import tempfile
+from typing import Optional
+from typing import Tuple
+import uuid
+
+from osgeo import gdal
+
+from .writer import OutputProfile
+
+# /vsimem 上に出力を保持するフォルダ
+VSIMEM_DIR = "/vsimem/topo_maps"
+
+
+def memory_path(suffix: str = "_topoMaps.tif") -> str:
+    """
+    ## Summary
+        /vsimem 上の出力ファイルのパスを作成する。
+    """
+    return f"{VSIMEM_DIR}/{uuid.uuid4().hex}{suffix}"
+
+
+def disk_path(suffix: str = "_topoMaps.tif") -> str:
+    """
+    ## Summary
+        一時フォルダ上の出力ファイルのパスを作成する。
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tf:
+        return tf.name
+
+
+def is_memory_path(path) -> bool:
+    """
+    ## Summary
+        /vsimem 上の出力ファイルのパスかどうか。
+    """
+    return path is not None and str(path).startswith(f"{VSIMEM_DIR}/")
+
+
+def memory_usage() -> int:
+    """
+    ## Summary
+        /vsimem 上に保持している出力（補助ファイルを含む）の合計のバイト数。
+    """
+    total = 0
+    for name in gdal.ReadDir(VSIMEM_DIR) or []:
+        stat = gdal.VSIStatL(f"{VSIMEM_DIR}/{name}")
+        if stat is not None:
+            total += stat.size
+    return total
+
+
+def estimated_size(
+    x_size: int, y_size: int, bands: int, profile: OutputProfile
+) -> int:
+    """
+    ## Summary
+        出力の圧縮前のバイト数。オーバービューを作成する場合はその分（最大 1/3）を含める。
+        圧縮後の大きさは画像によって変わるので、上限との比較には圧縮前の大きさを使用する。
+    """
+    size = x_size * y_size * bands
+    if profile.overview_factors(x_size, y_size):
+        size += size // 3
+    return size
+
+
+def output_location(
+    path: str,
+    x_size: int,
+    y_size: int,
+    bands: int,
+    profile: OutputProfile,
+    max_bytes: int,
+) -> Tuple[str, bool]:
+    """
+    ## Summary
+        /vsimem 上の出力ファイルのパスが指定された場合に、上限を超えないかを確認する。
+        超える場合は一時フォルダ上のパスに変更する。
+    Args:
+        path (str): 出力ファイルのパス
+        x_size (int): 列数
+        y_size (int): 行数
+        bands (int): バンド数
+        profile (OutputProfile): 圧縮方法とオーバービューの設定
+        max_bytes (int): /vsimem 上に保持する出力の合計の上限
+    Returns:
+        Tuple[str, bool]: 出力ファイルのパスと、一時フォルダに変更したかどうか
+    """
+    if not is_memory_path(path):
+        return path, False
+    size = estimated_size(x_size, y_size, bands, profile)
+    if max_bytes < memory_usage() + size:
+        return disk_path(), True
+    return path, False
+
+
+def copy_to_disk(path: str) -> str:
+    """
+    ## Summary
+        /vsimem 上の出力を補助ファイルごと一時フォルダにコピーする。
+    Args:
+        path (str): /vsimem 上の出力ファイルのパス
+    Returns:
+        str: コピーした一時ファイルのパス
+    """
+    new_path = disk_path()
+    gdal.GetDriverByName("GTiff").CopyFiles(new_path, path)
+    return new_path
+
+
+class MemoryOutputs(object):
+    """
+    ## Summary
+        /vsimem 上の出力と、それを参照するレイヤーの対応。
+    """
+
+    def __init__(self):
+        self.layers = {}
+        self.connected = False
+
+    def add(self, layer, path: str) -> None:
+        """
+        ## Summary
+            /vsimem 上の出力を参照するレイヤーを記録する。
+        Args:
+            layer (QgsRasterLayer): 追加したレイヤー
+            path (str): /vsimem 上の出力ファイルのパス
+        """
+        self.layers[layer.id()] = (layer, path)
+
+    def remove(self, layer_id: str) -> None:
+        """
+        ## Summary
+            レイヤーが削除された場合に、/vsimem 上の出力を削除してメモリを解放する。
+        """
+        if layer_id not in self.layers:
+            return
+        _, path = self.layers.pop(layer_id)
+        gdal.GetDriverByName("GTiff").Delete(path)
+
+    def spill(self, layer_id: str) -> Optional[str]:
+        """
+        ## Summary
+            /vsimem 上の出力を一時フォルダにコピーし、レイヤーの参照先を切り替えてから
+            メモリを解放する。プロジェクトにレイヤーを保存する時に呼び出す。
+        Args:
+            layer_id (str): レイヤーのID
+        Returns:
+            str: コピーした一時ファイルのパス。/vsimem 上の出力を参照するレイヤーでない
+                場合は None。
+        """
+        if layer_id not in self.layers:
+            return None
+        layer, path = self.layers.pop(layer_id)
+        new_path = copy_to_disk(path)
+        layer.setDataSource(new_path, layer.name(), "gdal")
+        gdal.GetDriverByName("GTiff").Delete(path)
+        return new_path
+
+
+memory_outputs = MemoryOutputs()
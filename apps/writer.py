@@ -0,0 +1,631 @@
+"""
+微地形図をブロック毎に GeoTIFF に書き込む出力先。
+
+合成した画像全体をメモリ上の Dataset に変換してから保存すると、画像のコピーが何枚も
+メモリに残る。ここではタイル（または行のブロック）が出来上がる度にタイル形式の GeoTIFF に
+書き込み、メモリに残るのは1ブロック分だけにする。
+
+出力の圧縮方法と内部オーバービューは `OutputProfile` で指定する。オーバービューは
+書き込むブロックを縮小して同時に作成するので、書き込んだファイルを読み直さない。
+COG の場合は、オーバービューを含めた GeoTIFF を一時ファイルに書き込んでから、
+オーバービューを作り直さずに COG のレイアウトにコピーする。
+Nodata だけのタイルは書き込まないので、SPARSE_OK によりファイル上では空のブロックになる。
+RGB の出力では、画像のアルファを内部マスク（GMF_PER_DATASET）として書き込む。JPEG（YCbCr）は
+アルファバンドを持てないので、Nodata の範囲はマスクで透明にする。空のブロックのマスクは 0
+（透明）として読み込まれる。
+"""
+
+from dataclasses import dataclass
+import os
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+from osgeo import gdal
+
+from ..gdal_drawer.custom import CustomGdalDataset
+from ..gdal_drawer.custom import gdal_open
+
+
+@dataclass
+class OutputProfile:
+    """
+    ## Summary
+        出力する GeoTIFF の圧縮方法とレイアウト。
+    Args:
+        compress (str): 'JPEG'（YCbCr）、'WEBP'、'DEFLATE'、'ZSTD'。None の場合は圧縮しない。
+        quality (int): JPEG と WEBP の品質（1 - 100）
+        level (int): DEFLATE と ZSTD の圧縮レベル
+        overviews (bool): 内部オーバービューを作成するかどうか
+        cog (bool): Cloud Optimized GeoTIFF として出力するかどうか
+        num_threads (str): 圧縮に使用するスレッド数。'ALL_CPUS' は全てのCPU。
+        block_size (int): 内部タイルの1辺のセル数
+        min_overview_size (int): オーバービューの長辺がこのセル数以下になるまで作成する
+        sparse (bool): 書き込まなかったブロックと全て 0 のブロックをファイルに含めない
+            （SPARSE_OK）かどうか。読み込むと 0（マスクでは透明）になる。
+    """
+
+    compress: Optional[str] = None
+    quality: Optional[int] = None
+    level: Optional[int] = None
+    overviews: bool = False
+    cog: bool = False
+    num_threads: str = "ALL_CPUS"
+    block_size: int = 512
+    min_overview_size: int = 256
+    sparse: bool = True
+
+    def gtiff_options(self) -> List[str]:
+        """
+        ## Summary
+            GTiff ドライバーの作成オプション（タイルとブロックサイズ以外）。
+        """
+        options = [f"NUM_THREADS={self.num_threads}"]
+        if self.sparse:
+            options.append("SPARSE_OK=TRUE")
+        if self.compress is None:
+            return options
+        options.append(f"COMPRESS={self.compress}")
+        if self.compress == "JPEG":
+            options.append("PHOTOMETRIC=YCBCR")
+            if self.quality is not None:
+                options.append(f"JPEG_QUALITY={self.quality}")
+        elif self.compress == "WEBP":
+            if self.quality is not None:
+                options.append(f"WEBP_LEVEL={self.quality}")
+        else:
+            options.append("PREDICTOR=2")
+            if self.level is not None:
+                key = "ZSTD_LEVEL" if self.compress == "ZSTD" else "ZLEVEL"
+                options.append(f"{key}={self.level}")
+        return options
+
+    def overview_config(self) -> Dict[str, str]:
+        """
+        ## Summary
+            内部オーバービューを本体と同じ方法で圧縮する為の設定。
+        """
+        config = {"GDAL_NUM_THREADS": self.num_threads}
+        if self.compress is not None:
+            config["COMPRESS_OVERVIEW"] = self.compress
+        if self.compress == "JPEG":
+            config["PHOTOMETRIC_OVERVIEW"] = "YCBCR"
+            if self.quality is not None:
+                config["JPEG_QUALITY_OVERVIEW"] = str(self.quality)
+        elif self.compress == "WEBP" and self.quality is not None:
+            config["WEBP_LEVEL_OVERVIEW"] = str(self.quality)
+        return config
+
+    def cog_options(self) -> List[str]:
+        """
+        ## Summary
+            COG ドライバーの作成オプション。作成済みのオーバービューをそのまま使用する。
+        """
+        options = [
+            f"BLOCKSIZE={self.block_size}",
+            f"NUM_THREADS={self.num_threads}",
+            "BIGTIFF=IF_SAFER",
+            "OVERVIEWS=FORCE_USE_EXISTING" if self.overviews else "OVERVIEWS=NONE",
+        ]
+        if self.sparse:
+            options.append("SPARSE_OK=TRUE")
+        if self.compress is None:
+            return options + ["COMPRESS=NONE"]
+        options.append(f"COMPRESS={self.compress}")
+        if self.compress in ("JPEG", "WEBP"):
+            if self.quality is not None:
+                options.append(f"QUALITY={self.quality}")
+        else:
+            options.append("PREDICTOR=YES")
+            if self.level is not None:
+                options.append(f"LEVEL={self.level}")
+        return options
+
+    def overview_factors(self, x_size: int, y_size: int) -> List[int]:
+        """
+        ## Summary
+            作成するオーバービューの倍率（2, 4, 8, ...）。
+        """
+        factors = []
+        size = max(x_size, y_size)
+        while self.overviews and self.min_overview_size < size:
+            size = -(-size // 2)
+            factors.append(2 ** (len(factors) + 1))
+        return factors
+
+
+# 出力の設定。'deflate' は保存するファイルの既定値で、可逆圧縮する。'fast_view' は
+# /vsimem 上の表示用の出力の既定値で、JPEG の圧縮が速く拡大縮小しても表示が速いが
+# 非可逆。'cog_*' はファイルサーバーに置いて共有する場合に使用する。
+OUTPUT_PROFILES = {
+    "plain": OutputProfile(),
+    "fast_view": OutputProfile(compress="JPEG", quality=90, overviews=True),
+    "deflate": OutputProfile(compress="DEFLATE", level=6, overviews=True),
+    "cog_jpeg": OutputProfile(compress="JPEG", quality=90, overviews=True, cog=True),
+    "cog_webp": OutputProfile(compress="WEBP", quality=90, overviews=True, cog=True),
+    "cog_deflate": OutputProfile(compress="DEFLATE", level=6, overviews=True, cog=True),
+    "cog_zstd": OutputProfile(compress="ZSTD", level=9, overviews=True, cog=True),
+}
+
+
+def output_profile(name: str) -> OutputProfile:
+    """
+    ## Summary
+        名前から出力の設定を取得する。
+    Args:
+        name (str): `OUTPUT_PROFILES` のキー
+    Returns:
+        OutputProfile: 出力の設定
+    """
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {name}")
+    return OUTPUT_PROFILES[name]
+
+
+def warp_to_profile(
+    output_path: str, src_path: str, dst_srs: str, profile: OutputProfile
+) -> None:
+    """
+    ## Summary
+        座標系を変換して出力する。変換するとセルの格子が変わるので、オーバービューは
+        変換後の画像から作成する。
+        変換前のマスクと変換後の範囲外は、アルファを付けて変換した後に内部マスクにする。
+    Args:
+        output_path (str): 出力ファイルのパス
+        src_path (str): 変換前の GeoTIFF のパス（RGB と内部マスク）
+        dst_srs (str): 変換後の座標系
+        profile (OutputProfile): 圧縮方法とオーバービューの設定
+    """
+    warped = gdal.Warp("", src_path, format="VRT", dstSRS=dst_srs, dstAlpha=True)
+    previous = set_config_options({"GDAL_TIFF_INTERNAL_MASK": "YES"})
+    try:
+        if profile.cog:
+            options = [
+                option
+                for option in profile.cog_options()
+                if not option.startswith("OVERVIEWS=")
+            ]
+            options.append(
+                "OVERVIEWS=AUTO" if profile.overviews else "OVERVIEWS=NONE"
+            )
+            gdal.Translate(
+                output_path,
+                warped,
+                format="COG",
+                bandList=[1, 2, 3],
+                maskBand=4,
+                creationOptions=options,
+            )
+            return
+        options = [
+            "TILED=YES",
+            f"BLOCKXSIZE={profile.block_size}",
+            f"BLOCKYSIZE={profile.block_size}",
+            "BIGTIFF=IF_SAFER",
+        ] + profile.gtiff_options()
+        out = gdal.Translate(
+            output_path,
+            warped,
+            format="GTiff",
+            bandList=[1, 2, 3],
+            maskBand=4,
+            creationOptions=options,
+        )
+    finally:
+        set_config_options(previous)
+        warped = None
+    factors = profile.overview_factors(out.RasterXSize, out.RasterYSize)
+    if factors:
+        previous = set_config_options(profile.overview_config())
+        try:
+            out.BuildOverviews("AVERAGE", factors)
+        finally:
+            set_config_options(previous)
+    out = None
+
+
+def set_config_options(
+    config: Dict[str, Optional[str]], thread_local: bool = False
+) -> Dict[str, Optional[str]]:
+    """
+    ## Summary
+        GDAL の設定を変更し、変更前の値を返す。戻す時は変更前の値を同じ様に渡す。
+    Args:
+        config (Dict[str, Optional[str]]): 設定名と値。None は設定の削除。
+        thread_local (bool): 現在のスレッドだけの設定にするかどうか。他のスレッドで
+            同時に変更と復元を行う設定に使用する。
+    Returns:
+        Dict[str, Optional[str]]: 変更前の値
+    """
+    if thread_local:
+        get_option = gdal.GetThreadLocalConfigOption
+        set_option = gdal.SetThreadLocalConfigOption
+    else:
+        get_option = gdal.GetConfigOption
+        set_option = gdal.SetConfigOption
+    previous = {key: get_option(key) for key in config}
+    for key, value in config.items():
+        set_option(key, value)
+    return previous
+
+
+def half_image(img: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        2 x 2 のセルの平均で画像を縮小する。奇数の行と列は端のセルを繰り返して平均する。
+        RGBA の場合は RGB をアルファで重み付けして平均し、透明な画素の色を混ぜない。
+    Args:
+        img (np.ndarray): (rows, cols, bands) の uint8 の画像
+    Returns:
+        np.ndarray: (ceil(rows / 2), ceil(cols / 2), bands) の uint8 の画像
+    """
+    rows, cols = img.shape[:2]
+    pad = ((0, rows % 2), (0, cols % 2), (0, 0))
+    if any(p[1] for p in pad):
+        img = np.pad(img, pad, mode="edge")
+    blocks = img.reshape(img.shape[0] // 2, 2, img.shape[1] // 2, 2, img.shape[2])
+    total = blocks.sum(axis=(1, 3), dtype="uint16")
+    half = ((total + 2) // 4).astype("uint8")
+    if img.shape[2] == 4:
+        alpha = blocks[..., 3:].astype("uint32")
+        weight = total[..., 3:].astype("uint32")
+        color = (blocks[..., :3] * alpha).sum(axis=(1, 3))
+        color = (color + weight // 2) // np.maximum(weight, 1)
+        half[..., :3] = np.where(0 < weight, color, 0)
+    return half
+
+
+def alpha_to_mask(img: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        画像のアルファからマスクバンドの値（有効 255、無効 0）を作成する。
+        アルファが無い場合は全て有効にする。
+    """
+    if img.shape[2] < 4:
+        return np.full(img.shape[:2], 255, dtype="uint8")
+    return np.where(0 < img[..., 3], 255, 0).astype("uint8")
+
+
+def write_pixels(
+    dataset: gdal.Dataset, img: np.ndarray, x_off: int, y_off: int, bands: int
+) -> None:
+    """
+    ## Summary
+        ピクセルインターリーブの画像を、全てのバンドに1回の WriteRaster で書き込む。
+        バンド毎に書き込むと、JPEG 等のピクセルインターリーブの GeoTIFF では、バンドの間に
+        キャッシュから外れたブロックを読み直して再圧縮することになる。
+        バッファの間隔を指定するので、余分なチャンネル（アルファ）を除いたコピーを作らない。
+    Args:
+        dataset (gdal.Dataset): 書き込むデータセット（オーバービューのデータセットでもよい）
+        img (np.ndarray): (rows, cols, bands以上) の uint8 の画像
+        x_off (int): 書き込む位置の列
+        y_off (int): 書き込む位置の行
+        bands (int): 書き込むバンド数。先頭から 'bands' チャンネルを書き込む。
+    """
+    img = np.ascontiguousarray(img, dtype="uint8")
+    rows, cols, channels = img.shape
+    dataset.WriteRaster(
+        x_off,
+        y_off,
+        cols,
+        rows,
+        img,
+        band_list=list(range(1, bands + 1)),
+        buf_pixel_space=channels,
+        buf_line_space=cols * channels,
+        buf_band_space=1,
+    )
+
+
+def image_dataset(
+    img: np.ndarray, transform: tuple, projection: str
+) -> CustomGdalDataset:
+    """
+    ## Summary
+        (rows, cols, bands) の画像を、コピーせずに参照する MEM データセットにする。
+        ピクセルインターリーブの配列をそのまま GDAL の PIXELOFFSET 等で参照するので、
+        バンド毎の配列を作らない。4チャンネルの場合は4バンド目をアルファバンドにし、
+        GDAL はこれを RGB のマスクバンドとして扱う。
+        データセットは配列を参照するので、配列はデータセットの属性として保持する。
+        GDAL_MEM_ENABLE_OPEN は、このスレッドで開く間だけ有効にする。
+    Args:
+        img (np.ndarray): (rows, cols, bands) の uint8 の画像。書き込む必要の無い配列。
+        transform (tuple): GeoTransform
+        projection (str): 座標系のWKT
+    Returns:
+        CustomGdalDataset: 画像のデータセット
+    """
+    img = np.ascontiguousarray(img, dtype="uint8")
+    rows, cols, bands = img.shape
+    path = (
+        f"MEM:::DATAPOINTER={img.ctypes.data},"
+        f"PIXELS={cols},LINES={rows},BANDS={bands},DATATYPE=Byte,"
+        f"PIXELOFFSET={bands},LINEOFFSET={cols * bands},BANDOFFSET=1"
+    )
+    config = {"GDAL_MEM_ENABLE_OPEN": "YES"}
+    previous = set_config_options(config, thread_local=True)
+    try:
+        dst = gdal_open(path)
+    finally:
+        set_config_options(previous, thread_local=True)
+    dst.SetGeoTransform(transform)
+    dst.SetProjection(projection)
+    colors = [gdal.GCI_RedBand, gdal.GCI_GreenBand, gdal.GCI_BlueBand]
+    if bands == 4:
+        colors.append(gdal.GCI_AlphaBand)
+    for i, color in enumerate(colors[:bands], start=1):
+        dst.GetRasterBand(i).SetColorInterpretation(color)
+    dst.image_buffer = img
+    return dst
+
+
+class GeoTiffBlockWriter(object):
+    """
+    ## Summary
+        タイル形式の GeoTIFF にブロック単位で書き込む。
+    Args:
+        file_path (str): 出力ファイルのパス
+        x_size (int): 列数
+        y_size (int): 行数
+        transform (tuple): GeoTransform
+        projection (str): 座標系のWKT
+        bands (int): バンド数。RGBの場合は3、アルファを含める場合は4。
+        mask (bool): RGB の場合に、画像のアルファを内部マスク（GMF_PER_DATASET）として
+            書き込むかどうか。
+        block_size (int): GeoTIFF の内部タイルの1辺のセル数
+        creation_options (List[str]): GTiff ドライバーに追加で渡すオプション
+        profile (OutputProfile): 圧縮方法とオーバービューの設定。None の場合は圧縮しない。
+    Examples:
+        >>> with GeoTiffBlockWriter.like(dst, "path/to/topo_map.tif") as writer:
+        ...     writer.write(img, x_off=0, y_off=0)
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        x_size: int,
+        y_size: int,
+        transform: tuple,
+        projection: str,
+        bands: int = 3,
+        block_size: int = 512,
+        creation_options: Optional[List[str]] = None,
+        profile: Optional[OutputProfile] = None,
+        mask: bool = True,
+    ):
+        self.file_path = file_path
+        self.bands = bands
+        self.mask = mask and bands == 3
+        self.profile = profile if profile is not None else OutputProfile()
+        self.x_size = x_size
+        self.y_size = y_size
+        self.block_size = block_size
+        # COG は一時ファイルに書き込んでから、オーバービューごとコピーする
+        self._write_path = file_path
+        profile_options = self.profile.gtiff_options()
+        if self.profile.cog:
+            self._write_path = f"{os.path.splitext(file_path)[0]}_tmp.tif"
+            profile_options = OutputProfile(
+                num_threads=self.profile.num_threads, sparse=self.profile.sparse
+            ).gtiff_options()
+        options = [
+            "TILED=YES",
+            f"BLOCKXSIZE={block_size}",
+            f"BLOCKYSIZE={block_size}",
+            "BIGTIFF=IF_SAFER",
+        ]
+        if bands == 3 and "PHOTOMETRIC=YCBCR" not in profile_options:
+            options.append("PHOTOMETRIC=RGB")
+        elif bands == 4:
+            options += ["PHOTOMETRIC=RGB", "ALPHA=YES"]
+        options += profile_options
+        options += creation_options or []
+        driver = gdal.GetDriverByName("GTiff")
+        self.dataset = driver.Create(
+            self._write_path, x_size, y_size, bands, gdal.GDT_Byte, options=options
+        )
+        self.dataset.SetGeoTransform(transform)
+        self.dataset.SetProjection(projection)
+        if self.mask:
+            # オーバービューを作成する前に作成すると、マスクのオーバービューも作成される
+            previous = set_config_options({"GDAL_TIFF_INTERNAL_MASK": "YES"})
+            try:
+                self.dataset.CreateMaskBand(gdal.GMF_PER_DATASET)
+            finally:
+                set_config_options(previous)
+        self.overview_factors = self.profile.overview_factors(x_size, y_size)
+        # 倍率 2 のオーバービューに書き込めなかったブロックがある場合は、閉じる時に
+        # 元の解像度から作り直す
+        self._overviews_complete = True
+        self._overview_dataset = None
+        if self.overview_factors:
+            # 空のオーバービューを作成し、ブロックを書き込む度に縮小した画像を書き込む
+            previous = set_config_options(self._overview_config())
+            try:
+                self.dataset.BuildOverviews("NONE", self.overview_factors)
+            finally:
+                set_config_options(previous)
+            overview = self.dataset.GetRasterBand(1).GetOverview(0)
+            self._overview_dataset = overview.GetDataset()
+
+    @classmethod
+    def like(
+        cls, dst: CustomGdalDataset, file_path: str, **kwargs
+    ) -> "GeoTiffBlockWriter":
+        """
+        ## Summary
+            計算用のデータセットと同じ範囲と座標系で出力先を作成する。
+        Args:
+            dst (CustomGdalDataset): 計算用のデータセット
+            file_path (str): 出力ファイルのパス
+            **kwargs: `GeoTiffBlockWriter` に渡すその他の引数
+        Returns:
+            GeoTiffBlockWriter: 出力先
+        """
+        return cls(
+            file_path,
+            dst.RasterXSize,
+            dst.RasterYSize,
+            dst.GetGeoTransform(),
+            dst.GetProjection(),
+            **kwargs,
+        )
+
+    def write(self, img: np.ndarray, x_off: int, y_off: int) -> None:
+        """
+        ## Summary
+            ブロックを書き込む。
+        Args:
+            img (np.ndarray): (rows, cols, bands以上) の uint8 の画像。余分なチャンネル（アルファ）は書き込まない。
+            x_off (int): 書き込む位置の列
+            y_off (int): 書き込む位置の行
+        """
+        write_pixels(self.dataset, img, x_off, y_off, self.bands)
+        if self.mask:
+            mask_band = self.dataset.GetRasterBand(1).GetMaskBand()
+            mask_band.WriteArray(alpha_to_mask(img), x_off, y_off)
+        if self.overview_factors:
+            self._write_overview(img, x_off, y_off)
+
+    def _overview_config(self) -> Dict[str, str]:
+        """
+        ## Summary
+            オーバービューの圧縮の設定。COG の一時ファイルでは、コピーする時に圧縮するので
+            圧縮しない。
+        """
+        if self.profile.cog:
+            return {"GDAL_NUM_THREADS": self.profile.num_threads}
+        return self.profile.overview_config()
+
+    def _write_overview(self, img: np.ndarray, x_off: int, y_off: int) -> None:
+        """
+        ## Summary
+            ブロックを縮小して倍率 2 のオーバービューに書き込む。ブロックの境界が
+            2 x 2 のセルを分ける場合は書き込まず、閉じる時に作り直す。
+        """
+        rows, cols = img.shape[:2]
+        aligned = (
+            x_off % 2 == 0
+            and y_off % 2 == 0
+            and (cols % 2 == 0 or x_off + cols == self.x_size)
+            and (rows % 2 == 0 or y_off + rows == self.y_size)
+        )
+        if not aligned:
+            self._overviews_complete = False
+            return
+        # アルファで重み付けして縮小し、透明な画素の色を混ぜない
+        half = half_image(img[:, :, :4])
+        write_pixels(self._overview_dataset, half, x_off // 2, y_off // 2, self.bands)
+        if self.mask:
+            mask_band = self.dataset.GetRasterBand(1).GetMaskBand().GetOverview(0)
+            mask_band.WriteArray(alpha_to_mask(half), x_off // 2, y_off // 2)
+
+    def _finish_overviews(self) -> None:
+        """
+        ## Summary
+            倍率 4 以上のオーバービューを、倍率 2 のオーバービューから作成する。
+            マスクを先に作成し、RGB はマスクで無効な画素を除いて平均する。
+        """
+        previous = set_config_options(self._overview_config())
+        try:
+            if not self._overviews_complete:
+                self.dataset.BuildOverviews("AVERAGE", self.overview_factors)
+                return
+            bands = [self.dataset.GetRasterBand(i + 1) for i in range(self.bands)]
+            if self.mask:
+                mask_band = bands[0].GetMaskBand()
+                count = mask_band.GetOverviewCount()
+                overviews = [mask_band.GetOverview(k) for k in range(count)]
+                if 1 < len(overviews):
+                    gdal.RegenerateOverviews(overviews[0], overviews[1:], "NEAREST")
+            for band in bands:
+                count = band.GetOverviewCount()
+                overviews = [band.GetOverview(k) for k in range(count)]
+                if 1 < len(overviews):
+                    gdal.RegenerateOverviews(overviews[0], overviews[1:], "AVERAGE")
+        finally:
+            set_config_options(previous)
+
+    def close(self) -> str:
+        """
+        ## Summary
+            書き込みを完了してファイルを閉じる。
+        Returns:
+            str: 出力ファイルのパス
+        """
+        if self.dataset is None:
+            return self.file_path
+        if self.overview_factors:
+            self.dataset.FlushCache()
+            self._finish_overviews()
+        self.dataset.FlushCache()
+        self._overview_dataset = None
+        self.dataset = None
+        if self.profile.cog:
+            gdal.Translate(
+                self.file_path,
+                self._write_path,
+                format="COG",
+                creationOptions=self.profile.cog_options(),
+            )
+            gdal.GetDriverByName("GTiff").Delete(self._write_path)
+        return self.file_path
+
+    def discard(self) -> None:
+        """
+        ## Summary
+            オーバービュー等を仕上げずにファイルを閉じ、書き込み途中のファイルを削除する。
+            キャンセルされた場合と例外が発生した場合に呼び出す。/vsimem 上のファイルの
+            メモリもここで解放される。
+        """
+        self._overview_dataset = None
+        self.dataset = None
+        driver = gdal.GetDriverByName("GTiff")
+        for path in {self._write_path, self.file_path}:
+            if gdal.VSIStatL(path) is not None:
+                driver.Delete(path)
+
+    def __enter__(self) -> "GeoTiffBlockWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.discard()
+            return
+        self.close()
+
+
+class ArrayBlockWriter(object):
+    """
+    ## Summary
+        一時ファイル上の配列（np.memmap）にブロック単位で書き込む。
+        `GeoTiffBlockWriter` と同じように使用でき、出力先が指定されていない場合に使用する。
+    Args:
+        file_path (str): 一時ファイルのパス
+        x_size (int): 列数
+        y_size (int): 行数
+        bands (int): チャンネル数。RGBAの場合は4。
+    """
+
+    def __init__(self, file_path: str, x_size: int, y_size: int, bands: int = 4):
+        self.file_path = file_path
+        self.array = np.memmap(
+            file_path, dtype="uint8", mode="w+", shape=(y_size, x_size, bands)
+        )
+
+    def write(self, img: np.ndarray, x_off: int, y_off: int) -> None:
+        """
+        ## Summary
+            ブロックを書き込む。
+        Args:
+            img (np.ndarray): (rows, cols, bands) の uint8 の画像
+            x_off (int): 書き込む位置の列
+            y_off (int): 書き込む位置の行
+        """
+        rows, cols = img.shape[:2]
+        self.array[y_off : y_off + rows, x_off : x_off + cols] = img
+
+    def close(self) -> str:
+        self.array.flush()
+        return self.file_path
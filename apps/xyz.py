@@ -0,0 +1,654 @@
+"""
+微地形図を Web メルカトルの XYZ タイルとして MBTiles または GeoPackage に書き出す。
+
+gdal2tiles の様に出力した GeoTIFF を各ズームレベルで読み直して変換するのではなく、
+合成した RGBA の画像を1度だけ EPSG:3857 に変換する VRT を作成し、最大のズームレベルの
+タイルだけをそこから読み込む。それより小さいズームレベルのタイルは、メモリ上にある
+4枚の子タイルを縮小して作成する。ズームレベルを分割したサブツリーはスレッドで並列に
+作成し、全て透明なタイルは書き込まない。
+"""
+
+import concurrent.futures
+from dataclasses import dataclass
+import io
+import math
+import os
+import sqlite3
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+from osgeo import gdal
+from PIL import Image
+
+# Web メルカトルの原点から端までの距離（メートル）
+ORIGIN_SHIFT = 20037508.342789244
+EARTH_RADIUS = 6378137.0
+TILE_SIZE = 256
+MAX_ZOOM = 24
+# 並列に作成するサブツリーの数を、スレッド数のこの倍数以上にする
+SUBTREES_PER_WORKER = 4
+
+# タイルの画像形式と MBTiles の 'format'
+TILE_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+MBTILES_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+WKT_3857 = (
+    'PROJCS["WGS 84 / Pseudo-Mercator",GEOGCS["WGS 84",DATUM["WGS_1984",'
+    'SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],'
+    'UNIT["degree",0.0174532925199433]],PROJECTION["Mercator_1SP"],'
+    'PARAMETER["central_meridian",0],PARAMETER["scale_factor",1],'
+    'PARAMETER["false_easting",0],PARAMETER["false_northing",0],'
+    'UNIT["metre",1],AUTHORITY["EPSG","3857"]]'
+)
+WKT_4326 = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+    'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],'
+    'AUTHORITY["EPSG","4326"]]'
+)
+
+
+@dataclass
+class TileExportOptions:
+    """
+    ## Summary
+        XYZ タイルの書き出しの設定。
+    Args:
+        tile_format (str): 'png', 'jpeg', 'webp'。JPEG は透明な部分を白で塗る。
+        quality (int): JPEG と WEBP の品質
+        min_zoom (int): 最小のズームレベル。None の場合は全体が1枚のタイルに収まるレベル。
+        max_zoom (int): 最大のズームレベル。None の場合は元の解像度以上になるレベル。
+        resample_alg (str): EPSG:3857 に変換する際のリサンプル方法
+        max_workers (int): 並列に作成するスレッド数。None の場合は CPU 数に従う。
+    """
+
+    tile_format: str = "png"
+    quality: int = 90
+    min_zoom: Optional[int] = None
+    max_zoom: Optional[int] = None
+    resample_alg: str = "bilinear"
+    max_workers: Optional[int] = None
+
+
+def zoom_resolution(zoom: int) -> float:
+    """
+    ## Summary
+        ズームレベルのセルサイズ（EPSG:3857 のメートル）。
+    """
+    return 2 * ORIGIN_SHIFT / (TILE_SIZE * 2**zoom)
+
+
+def tile_range(
+    bounds: Tuple[float, float, float, float], zoom: int
+) -> Tuple[int, int, int, int]:
+    """
+    ## Summary
+        範囲に重なるタイルの番号の範囲。
+    Args:
+        bounds (Tuple[float, float, float, float]): EPSG:3857 の
+            (min_x, min_y, max_x, max_y)
+        zoom (int): ズームレベル
+    Returns:
+        Tuple[int, int, int, int]: (x_min, y_min, x_max, y_max)。x_max と y_max を含む。
+    """
+    size = 2 * ORIGIN_SHIFT / 2**zoom
+    last = 2**zoom - 1
+    x_min = int(math.floor((bounds[0] + ORIGIN_SHIFT) / size))
+    x_max = int(math.ceil((bounds[2] + ORIGIN_SHIFT) / size)) - 1
+    y_min = int(math.floor((ORIGIN_SHIFT - bounds[3]) / size))
+    y_max = int(math.ceil((ORIGIN_SHIFT - bounds[1]) / size)) - 1
+    return (
+        min(max(x_min, 0), last),
+        min(max(y_min, 0), last),
+        min(max(x_max, 0), last),
+        min(max(y_max, 0), last),
+    )
+
+
+def lon_lat_bounds(
+    bounds: Tuple[float, float, float, float]
+) -> Tuple[float, float, float, float]:
+    """
+    ## Summary
+        EPSG:3857 の範囲を経緯度に変換する。
+    """
+
+    def lon(x: float) -> float:
+        return x / ORIGIN_SHIFT * 180.0
+
+    def lat(y: float) -> float:
+        return math.degrees(math.atan(math.sinh(y / EARTH_RADIUS)))
+
+    return (lon(bounds[0]), lat(bounds[1]), lon(bounds[2]), lat(bounds[3]))
+
+
+def downsample_rgba(img: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        2 x 2 の画素をアルファで重み付けした平均で縮小する。透明な画素の色は混ぜない。
+    Args:
+        img (np.ndarray): (rows, cols, 4) の uint8 の画像。rows と cols は偶数。
+    Returns:
+        np.ndarray: (rows / 2, cols / 2, 4) の uint8 の画像
+    """
+    rows, cols = img.shape[:2]
+    blocks = img.reshape(rows // 2, 2, cols // 2, 2, 4).astype("uint32")
+    alpha = blocks[..., 3]
+    alpha_sum = alpha.sum(axis=(1, 3))
+    out = np.empty((rows // 2, cols // 2, 4), dtype="uint8")
+    safe = np.maximum(alpha_sum, 1)
+    for i in range(3):
+        color = (blocks[..., i] * alpha).sum(axis=(1, 3))
+        out[..., i] = (color + safe // 2) // safe
+    out[..., 3] = (alpha_sum + 2) // 4
+    return out
+
+
+def parent_tile(children: Dict[Tuple[int, int], np.ndarray]) -> Optional[np.ndarray]:
+    """
+    ## Summary
+        4枚の子タイルを並べて縮小し、親のタイルを作成する。
+    Args:
+        children (Dict[Tuple[int, int], np.ndarray]): 子タイルの (dx, dy) と画像。
+            全て透明な子タイルは含めない。
+    Returns:
+        np.ndarray: (256, 256, 4) の uint8 の画像。全て透明な場合は None。
+    """
+    if not children:
+        return None
+    merged = np.zeros((2 * TILE_SIZE, 2 * TILE_SIZE, 4), dtype="uint8")
+    for (dx, dy), child in children.items():
+        merged[
+            dy * TILE_SIZE : (dy + 1) * TILE_SIZE,
+            dx * TILE_SIZE : (dx + 1) * TILE_SIZE,
+        ] = child
+    img = downsample_rgba(merged)
+    if not img[..., 3].any():
+        return None
+    return img
+
+
+def encode_tile(img: np.ndarray, options: TileExportOptions) -> bytes:
+    """
+    ## Summary
+        タイルの画像を指定した形式に変換する。
+    """
+    image = Image.fromarray(img, "RGBA")
+    if options.tile_format == "jpeg":
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image).convert("RGB")
+    buffer = io.BytesIO()
+    kwargs = {}
+    if options.tile_format in ("jpeg", "webp"):
+        kwargs["quality"] = options.quality
+    image.save(buffer, TILE_FORMATS[options.tile_format], **kwargs)
+    return buffer.getvalue()
+
+
+class MBTilesWriter(object):
+    """
+    ## Summary
+        MBTiles にタイルを書き込む。複数のスレッドから書き込める。
+    Args:
+        file_path (str): 出力ファイルのパス。既にある場合は上書きする。
+        options (TileExportOptions): タイルの書き出しの設定
+    """
+
+    def __init__(self, file_path: str, options: TileExportOptions):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.file_path = file_path
+        self.options = options
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.connection.executescript(self.schema())
+
+    def schema(self) -> str:
+        return """
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (
+                zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                tile_data BLOB
+            );
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """
+
+    def write(self, tiles: List[Tuple[int, int, int, bytes]]) -> None:
+        """
+        ## Summary
+            タイルを書き込む。
+        Args:
+            tiles (List[Tuple[int, int, int, bytes]]): (zoom, x, y, 画像) のリスト。
+                y は北から数えた XYZ の番号。
+        """
+        rows = [(z, x, 2**z - 1 - y, sqlite3.Binary(data)) for z, x, y, data in tiles]
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", rows
+            )
+
+    def close(
+        self, bounds: Tuple[float, float, float, float], min_zoom: int, max_zoom: int
+    ) -> str:
+        """
+        ## Summary
+            メタデータを書き込んでファイルを閉じる。
+        Args:
+            bounds (Tuple[float, float, float, float]): EPSG:3857 のデータの範囲
+            min_zoom (int): 最小のズームレベル
+            max_zoom (int): 最大のズームレベル
+        Returns:
+            str: 出力ファイルのパス
+        """
+        lon_lat = lon_lat_bounds(bounds)
+        metadata = {
+            "name": os.path.splitext(os.path.basename(self.file_path))[0],
+            "type": "overlay",
+            "version": "1.0",
+            "format": MBTILES_FORMATS[self.options.tile_format],
+            "bounds": ",".join(f"{v:.8f}" for v in lon_lat),
+            "center": (
+                f"{(lon_lat[0] + lon_lat[2]) / 2:.8f},"
+                f"{(lon_lat[1] + lon_lat[3]) / 2:.8f},{min_zoom}"
+            ),
+            "minzoom": str(min_zoom),
+            "maxzoom": str(max_zoom),
+        }
+        with self._lock:
+            self.connection.executemany(
+                "INSERT INTO metadata VALUES (?, ?)", list(metadata.items())
+            )
+            self.connection.commit()
+            self.connection.close()
+        return self.file_path
+
+    def discard(self) -> None:
+        """
+        ## Summary
+            書き込みを中止し、途中まで書き込んだファイルを削除する。
+        """
+        with self._lock:
+            self.connection.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+
+class GeoPackageTileWriter(MBTilesWriter):
+    """
+    ## Summary
+        GeoPackage のタイルテーブルにタイルを書き込む。タイル行列は EPSG:3857 の全体を
+        範囲にするので、タイルの番号は XYZ と同じになる。
+    Args:
+        file_path (str): 出力ファイルのパス。既にある場合は上書きする。
+        options (TileExportOptions): タイルの書き出しの設定
+        table_name (str): タイルテーブルの名前
+    """
+
+    def __init__(
+        self, file_path: str, options: TileExportOptions, table_name: str = "topo_map"
+    ):
+        self.table_name = table_name
+        super().__init__(file_path, options)
+
+    def schema(self) -> str:
+        return f"""
+            PRAGMA application_id = 1196444487;
+            PRAGMA user_version = 10200;
+            CREATE TABLE gpkg_spatial_ref_sys (
+                srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+                organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+                definition TEXT NOT NULL, description TEXT
+            );
+            INSERT INTO gpkg_spatial_ref_sys VALUES
+                ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', NULL),
+                ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', NULL),
+                ('WGS 84 geodetic', 4326, 'EPSG', 4326, '{WKT_4326}', NULL),
+                ('WGS 84 / Pseudo-Mercator', 3857, 'EPSG', 3857, '{WKT_3857}', NULL);
+            CREATE TABLE gpkg_contents (
+                table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+                identifier TEXT UNIQUE, description TEXT DEFAULT '',
+                last_change DATETIME NOT NULL
+                    DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+                min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+                srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id)
+            );
+            CREATE TABLE gpkg_tile_matrix_set (
+                table_name TEXT NOT NULL PRIMARY KEY
+                    REFERENCES gpkg_contents(table_name),
+                srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id),
+                min_x DOUBLE NOT NULL, min_y DOUBLE NOT NULL,
+                max_x DOUBLE NOT NULL, max_y DOUBLE NOT NULL
+            );
+            CREATE TABLE gpkg_tile_matrix (
+                table_name TEXT NOT NULL REFERENCES gpkg_contents(table_name),
+                zoom_level INTEGER NOT NULL,
+                matrix_width INTEGER NOT NULL, matrix_height INTEGER NOT NULL,
+                tile_width INTEGER NOT NULL, tile_height INTEGER NOT NULL,
+                pixel_x_size DOUBLE NOT NULL, pixel_y_size DOUBLE NOT NULL,
+                PRIMARY KEY (table_name, zoom_level)
+            );
+            CREATE TABLE gpkg_extensions (
+                table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+                definition TEXT NOT NULL, scope TEXT NOT NULL,
+                UNIQUE (table_name, column_name, extension_name)
+            );
+            CREATE TABLE "{self.table_name}" (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                zoom_level INTEGER NOT NULL, tile_column INTEGER NOT NULL,
+                tile_row INTEGER NOT NULL, tile_data BLOB NOT NULL,
+                UNIQUE (zoom_level, tile_column, tile_row)
+            );
+        """
+
+    def write(self, tiles: List[Tuple[int, int, int, bytes]]) -> None:
+        rows = [(z, x, y, sqlite3.Binary(data)) for z, x, y, data in tiles]
+        with self._lock:
+            self.connection.executemany(
+                f'INSERT OR REPLACE INTO "{self.table_name}" '
+                "(zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(
+        self, bounds: Tuple[float, float, float, float], min_zoom: int, max_zoom: int
+    ) -> str:
+        matrices = [
+            (
+                self.table_name,
+                zoom,
+                2**zoom,
+                2**zoom,
+                TILE_SIZE,
+                TILE_SIZE,
+                zoom_resolution(zoom),
+                zoom_resolution(zoom),
+            )
+            for zoom in range(min_zoom, max_zoom + 1)
+        ]
+        with self._lock:
+            cursor = self.connection
+            cursor.execute(
+                "INSERT INTO gpkg_contents "
+                "(table_name, data_type, identifier, min_x, min_y, max_x, max_y, "
+                "srs_id) VALUES (?, 'tiles', ?, ?, ?, ?, ?, 3857)",
+                (self.table_name, self.table_name) + tuple(bounds),
+            )
+            cursor.execute(
+                "INSERT INTO gpkg_tile_matrix_set VALUES (?, 3857, ?, ?, ?, ?)",
+                (self.table_name, -ORIGIN_SHIFT, -ORIGIN_SHIFT)
+                + (ORIGIN_SHIFT, ORIGIN_SHIFT),
+            )
+            cursor.executemany(
+                "INSERT INTO gpkg_tile_matrix VALUES (?, ?, ?, ?, ?, ?, ?, ?)", matrices
+            )
+            if self.options.tile_format == "webp":
+                cursor.execute(
+                    "INSERT INTO gpkg_extensions VALUES (?, 'tile_data', 'gpkg_webp', "
+                    "'http://www.geopackage.org/spec120/#extension_tiles_webp', "
+                    "'read-write')",
+                    (self.table_name,),
+                )
+            self.connection.commit()
+            self.connection.close()
+        return self.file_path
+
+
+def tile_writer(file_path: str, options: TileExportOptions) -> MBTilesWriter:
+    """
+    ## Summary
+        拡張子から出力先を作成する。'.gpkg' は GeoPackage、それ以外は MBTiles。
+    """
+    if file_path.lower().endswith(".gpkg"):
+        return GeoPackageTileWriter(file_path, options)
+    return MBTilesWriter(file_path, options)
+
+
+def is_tile_output(file_path: Optional[str]) -> bool:
+    """
+    ## Summary
+        出力ファイルが XYZ タイルの形式（MBTiles または GeoPackage）かどうか。
+    """
+    if file_path is None:
+        return False
+    return os.path.splitext(file_path)[1].lower() in (".mbtiles", ".gpkg")
+
+
+class TilePyramid(object):
+    """
+    ## Summary
+        RGBA の GeoTIFF から XYZ タイルを作成する。
+    Args:
+        src_path (str): 合成した RGBA の GeoTIFF のパス（4バンド目がアルファ）
+        options (TileExportOptions): タイルの書き出しの設定
+    """
+
+    def __init__(self, src_path: str, options: TileExportOptions):
+        self.options = options
+        # 元の解像度と範囲を EPSG:3857 で求める
+        suggested = gdal.Warp("", src_path, format="VRT", dstSRS="EPSG:3857")
+        transform = suggested.GetGeoTransform()
+        x_size, y_size = suggested.RasterXSize, suggested.RasterYSize
+        suggested = None
+        self.bounds = (
+            transform[0],
+            transform[3] + transform[5] * y_size,
+            transform[0] + transform[1] * x_size,
+            transform[3],
+        )
+        max_zoom = options.max_zoom
+        if max_zoom is None:
+            # 元の解像度以上になる最小のズームレベル
+            max_zoom = int(math.ceil(math.log2(zoom_resolution(0) / transform[1])))
+        self.max_zoom = min(max(max_zoom, 0), MAX_ZOOM)
+        min_zoom = options.min_zoom
+        if min_zoom is None:
+            min_zoom = self.max_zoom
+            while 0 < min_zoom:
+                x_min, y_min, x_max, y_max = tile_range(self.bounds, min_zoom)
+                if x_min == x_max and y_min == y_max:
+                    break
+                min_zoom -= 1
+        self.min_zoom = min(max(min_zoom, 0), self.max_zoom)
+        # 最大のズームレベルのタイルの境界に揃えた EPSG:3857 の VRT
+        x_min, y_min, x_max, y_max = tile_range(self.bounds, self.max_zoom)
+        self.origin = (x_min, y_min)
+        size = 2 * ORIGIN_SHIFT / 2**self.max_zoom
+        resolution = zoom_resolution(self.max_zoom)
+        self.vrt_path = f"/vsimem/topo_maps_xyz_{id(self)}.vrt"
+        vrt = gdal.Warp(
+            self.vrt_path,
+            src_path,
+            format="VRT",
+            dstSRS="EPSG:3857",
+            outputBounds=(
+                -ORIGIN_SHIFT + x_min * size,
+                ORIGIN_SHIFT - (y_max + 1) * size,
+                -ORIGIN_SHIFT + (x_max + 1) * size,
+                ORIGIN_SHIFT - y_min * size,
+            ),
+            xRes=resolution,
+            yRes=resolution,
+            resampleAlg=options.resample_alg,
+            dstAlpha=True,
+        )
+        vrt = None
+        self._local = threading.local()
+
+    def _dataset(self) -> gdal.Dataset:
+        """
+        ## Summary
+            スレッド毎に開いた VRT。GDAL のデータセットはスレッド間で共有できない。
+        """
+        if getattr(self._local, "dataset", None) is None:
+            self._local.dataset = gdal.Open(self.vrt_path)
+        return self._local.dataset
+
+    def overlaps(self, zoom: int, x: int, y: int) -> bool:
+        """
+        ## Summary
+            タイルがデータの範囲に重なるかどうか。
+        """
+        x_min, y_min, x_max, y_max = tile_range(self.bounds, zoom)
+        return x_min <= x <= x_max and y_min <= y <= y_max
+
+    def read_tile(self, x: int, y: int) -> Optional[np.ndarray]:
+        """
+        ## Summary
+            最大のズームレベルのタイルを VRT から読み込む。
+        Returns:
+            np.ndarray: (256, 256, 4) の uint8 の画像。全て透明な場合は None。
+        """
+        ary = self._dataset().ReadAsArray(
+            (x - self.origin[0]) * TILE_SIZE,
+            (y - self.origin[1]) * TILE_SIZE,
+            TILE_SIZE,
+            TILE_SIZE,
+        )
+        if not ary[3].any():
+            return None
+        return np.ascontiguousarray(np.moveaxis(ary, 0, -1), dtype="uint8")
+
+    def render(
+        self,
+        zoom: int,
+        x: int,
+        y: int,
+        emit: Callable[[int, int, int, np.ndarray], None],
+    ) -> Optional[np.ndarray]:
+        """
+        ## Summary
+            タイルとその子孫のタイルを作成する。子タイルは作成した順に 'emit' に渡し、
+            このタイルの画像を返す。
+        Returns:
+            np.ndarray: (256, 256, 4) の uint8 の画像。全て透明な場合は None。
+        """
+        if not self.overlaps(zoom, x, y):
+            return None
+        if zoom == self.max_zoom:
+            img = self.read_tile(x, y)
+        else:
+            children = {}
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    child = self.render(zoom + 1, 2 * x + dx, 2 * y + dy, emit)
+                    if child is not None:
+                        children[(dx, dy)] = child
+            img = parent_tile(children)
+        if img is not None:
+            emit(zoom, x, y, img)
+        return img
+
+    def tiles(self, zoom: int) -> Iterator[Tuple[int, int]]:
+        x_min, y_min, x_max, y_max = tile_range(self.bounds, zoom)
+        for y in range(y_min, y_max + 1):
+            for x in range(x_min, x_max + 1):
+                yield x, y
+
+    def split_zoom(self, workers: int) -> int:
+        """
+        ## Summary
+            並列に作成するサブツリーの根のズームレベル。スレッド数の 'SUBTREES_PER_WORKER'
+            倍以上のタイルがある最小のレベル。
+        """
+        for zoom in range(self.min_zoom, self.max_zoom + 1):
+            if workers * SUBTREES_PER_WORKER <= len(list(self.tiles(zoom))):
+                return zoom
+        return self.max_zoom
+
+    def close(self) -> None:
+        gdal.Unlink(self.vrt_path)
+
+
+def export_xyz_tiles(
+    src_path: str,
+    output_path: str,
+    options: TileExportOptions,
+    is_canceled: Optional[Callable[[], bool]] = None,
+) -> Optional[Dict[str, int]]:
+    """
+    ## Summary
+        RGBA の GeoTIFF を XYZ タイルにして MBTiles または GeoPackage に書き出す。
+    Args:
+        src_path (str): 合成した RGBA の GeoTIFF のパス
+        output_path (str): 出力ファイルのパス（'.mbtiles' または '.gpkg'）
+        options (TileExportOptions): タイルの書き出しの設定
+        is_canceled (Callable[[], bool]): キャンセルされたかどうかを返す関数
+    Returns:
+        Dict[str, int]: 'min_zoom', 'max_zoom', 'tiles'（書き込んだタイルの数）。
+            キャンセルされた場合は None。
+    """
+    pyramid = TilePyramid(src_path, options)
+    writer = None
+    completed = False
+    workers = options.max_workers or os.cpu_count() or 1
+    counter = {"tiles": 0}
+    counter_lock = threading.Lock()
+
+    def emit_all(tiles: List[Tuple[int, int, int, np.ndarray]]) -> None:
+        encoded = [(z, x, y, encode_tile(img, options)) for z, x, y, img in tiles]
+        writer.write(encoded)
+        with counter_lock:
+            counter["tiles"] += len(encoded)
+
+    def render_subtree(zoom: int, x: int, y: int) -> Optional[np.ndarray]:
+        if is_canceled is not None and is_canceled():
+            return None
+        pending = []
+
+        def emit(z: int, tx: int, ty: int, img: np.ndarray) -> None:
+            pending.append((z, tx, ty, img))
+            if 64 <= len(pending):
+                emit_all(pending)
+                pending.clear()
+
+        img = pyramid.render(zoom, x, y, emit)
+        emit_all(pending)
+        return img
+
+    try:
+        writer = tile_writer(output_path, options)
+        split = pyramid.split_zoom(workers)
+        # 分割したレベルより下はスレッドで並列に作成し、上は返ってきた画像から作成する
+        images = {}
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(render_subtree, split, x, y): (x, y)
+                for x, y in pyramid.tiles(split)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                img = future.result()
+                if img is not None:
+                    images[futures[future]] = img
+        if is_canceled is not None and is_canceled():
+            return None
+        for zoom in range(split - 1, pyramid.min_zoom - 1, -1):
+            parents = {}
+            for x, y in pyramid.tiles(zoom):
+                children = {
+                    (dx, dy): images[(2 * x + dx, 2 * y + dy)]
+                    for dy in (0, 1)
+                    for dx in (0, 1)
+                    if (2 * x + dx, 2 * y + dy) in images
+                }
+                img = parent_tile(children)
+                if img is not None:
+                    parents[(x, y)] = img
+            emit_all([(zoom, x, y, img) for (x, y), img in parents.items()])
+            images = parents
+        writer.close(pyramid.bounds, pyramid.min_zoom, pyramid.max_zoom)
+        completed = True
+    finally:
+        pyramid.close()
+        # キャンセルや例外の場合は、途中まで書き込んだファイルを残さない
+        if writer is not None and not completed:
+            writer.discard()
+    return {
+        "min_zoom": pyramid.min_zoom,
+        "max_zoom": pyramid.max_zoom,
+        "tiles": counter["tiles"],
+    }
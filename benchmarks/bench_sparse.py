@@ -0,0 +1,73 @@
+"""
+細いドーナツカーネルの近傍の平均について、区間毎の合計（`apps.focal.sparse_focal_mean`）と
+ブロック毎の FFT の畳み込み（`apps.spectral.convolved_means`）の計算時間を比較する。
+
+'faster' 列は計測で速かった方、'select' 列は `apps.focal.is_sparse_uniform` が区間毎の合計を
+選ぶかどうか。`apps.focal.FFT_ADDS_PER_LOG2` は、'select' が True の行が全て 'sparse' になる
+様に決めている。
+
+    $ python benchmarks/bench_sparse.py --sizes 1000 3000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps.focal import is_sparse_uniform  # noqa: E402
+from apps.focal import kernel_runs  # noqa: E402
+from apps.focal import sparse_focal_mean  # noqa: E402
+from apps.spectral import convolved_means  # noqa: E402
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def doughnut(radius: int) -> np.ndarray:
+    x = np.arange(-radius, radius + 1)
+    distance = np.hypot(x[:, None], x[None, :])
+    kernel = ((distance <= radius) & (radius - 1 < distance)).astype("float64")
+    return kernel / kernel.sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 3000])
+    parser.add_argument("--radii", type=int, nargs="+", default=[2, 5, 8, 12, 20])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'size':>6} {'radius':>6} {'runs':>5} {'nodata':>6} "
+        f"{'sparse[s]':>10} {'fft[s]':>8} {'faster':>6} {'select':>6}"
+    )
+    for size in args.sizes:
+        dem = rng.normal(size=(size, size)).cumsum(0).cumsum(1).astype("float32")
+        voids = dem.copy()
+        voids[size // 4 : size // 4 + 40, size // 3 : size // 3 + 70] = np.nan
+        for radius in args.radii:
+            kernel = doughnut(radius)
+            runs = len(kernel_runs(kernel))
+            for has_nodata, ary in ((False, dem), (True, voids)):
+                sparse = timeit(sparse_focal_mean, ary, kernel)
+                fft = timeit(convolved_means, ary, [kernel])
+                faster = "sparse" if sparse < fft else "fft"
+                select = is_sparse_uniform(kernel, ary.shape, has_nodata)
+                print(
+                    f"{size:>6} {radius:>6} {runs:>5} {str(has_nodata):>6} "
+                    f"{sparse:>10.3f} {fft:>8.3f} {faster:>6} {str(select):>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
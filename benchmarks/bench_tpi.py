@@ -0,0 +1,90 @@
+"""
+TPI の近傍の平均の計算時間を、カーネルの半径を変えて比較する。
+
+カーネルでの直接の畳み込み（`scipy.ndimage.convolve`）、FFT による畳み込み
+（`scipy.signal.fftconvolve`）と、`apps.focal` の積分画像と再帰型ガウシアンフィルタ（'fast'）を
+計測する。逆ガウシアンカーネルの 'fast' は、その2つの差で計算する。直接の畳み込みは半径の
+2乗に比例して遅くなるので、'--direct-max-radius' 以下の半径だけで計測する。'fast' の計算時間は
+半径に依存しない。
+
+    $ python benchmarks/bench_tpi.py --rows 4000 --cols 4000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.ndimage
+import scipy.signal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps.focal import box_gaussian_mean  # noqa: E402
+from apps.focal import box_gaussian_weights  # noqa: E402
+from apps.focal import box_mean  # noqa: E402
+from apps.focal import gaussian_mean  # noqa: E402
+
+
+def timeit(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def direct_mean(ary: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    return scipy.ndimage.convolve(ary, kernel, mode="constant")
+
+
+def fft_mean(ary: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    return scipy.signal.fftconvolve(ary, kernel, mode="same")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=2000)
+    parser.add_argument("--radii", type=int, nargs="+", default=[5, 25, 100, 200])
+    parser.add_argument("--direct-max-radius", type=int, default=25)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dem = rng.normal(size=(args.rows, args.cols)).cumsum(0).cumsum(1)
+    dem = dem.astype("float32")
+    print(f"DEM: {args.rows} x {args.cols}")
+    print(
+        f"{'radius':>8} {'kernel':>9} {'direct[s]':>10} {'fft[s]':>8} {'fast[s]':>8}"
+    )
+    for radius in args.radii:
+        size = 2 * radius + 1
+        box = np.full((size, size), 1 / size**2, dtype="float32")
+        # 半径を 3σ としたガウシアンカーネル
+        sigma = radius / 3
+        x = np.arange(-radius, radius + 1, dtype="float32")
+        gauss = np.exp(-0.5 * (x[:, None] ** 2 + x[None, :] ** 2) / sigma**2)
+        gauss /= gauss.sum()
+        inv_gauss = gauss.max() - gauss
+        inv_gauss /= inv_gauss.sum()
+        weights = box_gaussian_weights(inv_gauss, sigma)
+        for name, kernel, fast in (
+            ("mean", box, lambda: box_mean(dem, radius)),
+            ("gauss", gauss, lambda: gaussian_mean(dem, sigma)),
+            (
+                "inv_gauss",
+                inv_gauss,
+                lambda: box_gaussian_mean(dem, radius, *weights, sigma),
+            ),
+        ):
+            if radius <= args.direct_max_radius:
+                direct = f"{timeit(direct_mean, dem, kernel):>10.3f}"
+            else:
+                direct = f"{'-':>10}"
+            print(
+                f"{radius:>8} {name:>9} {direct} "
+                f"{timeit(fft_mean, dem, kernel):>8.3f} {timeit(fast):>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
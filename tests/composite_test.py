@@ -0,0 +1,65 @@
+"""
+`apps.composite` の合成結果が `PIL.Image.alpha_composite` と一致することを確認する。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from apps.composite import Compositor
+from apps.composite import alpha_composite_into
+
+
+def random_rgba(rows: int, cols: int, seed: int) -> np.ndarray:
+    """
+    ## Summary
+        完全に透明な画素（Nodata）と不透明な画素を含む、ランダムな RGBA の画像。
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (rows, cols, 4), dtype="uint8")
+    img[rng.random((rows, cols)) < 0.2, 3] = 0
+    img[rng.random((rows, cols)) < 0.2, 3] = 255
+    img[10:20, 5:40, 3] = 0
+    return img
+
+
+def pil_composite(images) -> np.ndarray:
+    result = Image.fromarray(images[0], "RGBA")
+    for img in images[1:]:
+        result = Image.alpha_composite(result, Image.fromarray(img, "RGBA"))
+    return np.asarray(result)
+
+
+class AlphaCompositeTest(unittest.TestCase):
+    def test_matches_pil(self):
+        dst = random_rgba(64, 80, 0)
+        src = random_rgba(64, 80, 1)
+        expected = pil_composite([dst, src])
+        alpha_composite_into(dst, src)
+        np.testing.assert_array_equal(dst, expected)
+
+    def test_transparent_source_keeps_background(self):
+        dst = random_rgba(16, 16, 2)
+        src = random_rgba(16, 16, 3)
+        src[..., 3] = 0
+        expected = dst.copy()
+        alpha_composite_into(dst, src)
+        np.testing.assert_array_equal(dst, expected)
+
+    def test_compositor_blocks_match_pil(self):
+        images = [random_rgba(150, 90, seed) for seed in range(4)]
+        expected = pil_composite(images)
+        for block_rows in (32, 256):
+            compositor = Compositor(
+                images[0].shape[:2], max_workers=2, block_rows=block_rows
+            )
+            for img in images:
+                compositor.over(img)
+            np.testing.assert_array_equal(compositor.image, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
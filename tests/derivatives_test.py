@@ -0,0 +1,80 @@
+"""
+`apps.derivatives.terrain_derivatives` の傾斜、陰影起伏図、TRI を、平面の DEM の解析解と
+比較する。GDAL は使用しない。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+from apps.derivatives import terrain_derivatives
+from apps.options import HillshadeOptions
+from tests.synthetic import synthetic_dem
+
+
+def plane(rows: int, cols: int, east: float, north: float) -> np.ndarray:
+    """
+    ## Summary
+        東に 'east'、北に 'north' ずつ（1セル当たり）高くなる平面。行番号は南向きに増える。
+    """
+    y, x = np.mgrid[0:rows, 0:cols]
+    return (100.0 + east * x - north * y).astype("float32")
+
+
+def hillshade_options(hillshade_type: str = "single") -> HillshadeOptions:
+    return HillshadeOptions(hillshade_type, 315, 45, 1, False, False, 1.0, False, 1.5)
+
+
+class TerrainDerivativesTest(unittest.TestCase):
+    def test_slope_of_plane(self):
+        dem = plane(40, 50, 3.0, 4.0)
+        for x_res, y_res in ((1.0, 1.0), (2.0, 0.5)):
+            for step in (1, 3):
+                slope = terrain_derivatives(dem, x_res, y_res, slope_step=step)["slope"]
+                expected = math.degrees(math.atan(math.hypot(3.0 / x_res, 4.0 / y_res)))
+                inner = slope[step:-step, step:-step]
+                np.testing.assert_allclose(inner, expected, rtol=0, atol=1e-4)
+
+    def test_hillshade_of_plane(self):
+        # 光源（北西、高度 45°）に正対する傾斜 45°の面は最も明るく、平面は sin(高度)
+        g = math.sqrt(0.5)
+        facing = plane(20, 20, g, -g)
+        flat = np.full((20, 20), 100.0, dtype="float32")
+        for hillshade_type in ("single", "multiple"):
+            options = hillshade_options(hillshade_type)
+            shade = terrain_derivatives(flat, 1.0, 1.0, hillshade=options)["hillshade"]
+            np.testing.assert_allclose(shade, 1 + 254 * math.sqrt(0.5), atol=1e-3)
+        options = hillshade_options()
+        shade = terrain_derivatives(facing, 1.0, 1.0, hillshade=options)["hillshade"]
+        np.testing.assert_allclose(shade[1:-1, 1:-1], 255.0, atol=1e-3)
+
+    def test_tri_of_plane(self):
+        dem = plane(30, 30, 3.0, 4.0)
+        tri = terrain_derivatives(dem, 1.0, 1.0)["tri"]
+        # 8近傍との差は ±3, ±4, ±7, ±1 がそれぞれ2つずつ
+        expected = math.sqrt(2 * (9 + 16 + 49 + 1))
+        np.testing.assert_allclose(tri[1:-1, 1:-1], expected, rtol=1e-6)
+
+    def test_blocks_match_single_pass(self):
+        dem = synthetic_dem(97, 83)
+        options = hillshade_options("multiple")
+        whole = terrain_derivatives(dem, 1.0, 1.0, 2, options, block_rows=1000)
+        blocks = terrain_derivatives(dem, 1.0, 1.0, 2, options, block_rows=7)
+        for name, ary in whole.items():
+            np.testing.assert_array_equal(blocks[name], ary, err_msg=name)
+
+    def test_nodata_spreads_to_neighbours_only(self):
+        dem = plane(30, 30, 3.0, 4.0)
+        dem[10, 12] = np.nan
+        outputs = terrain_derivatives(dem, 1.0, 1.0, hillshade=hillshade_options())
+        expected = np.zeros(dem.shape, dtype=bool)
+        expected[9:12, 11:14] = True
+        for name, ary in outputs.items():
+            np.testing.assert_array_equal(np.isnan(ary), expected, err_msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+`TopoMapEngine.generate_tiled` と同じ手順でタイル毎に計算した材料を、全体を一度に計算した
+材料と比較する。TPI はブロック毎の FFT、傾斜の平滑化は FFT の Gaussian になる設定を使用する。
+エンジンは GDAL と gdal_drawer を使用するので、どちらかがない環境ではスキップする。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import importlib
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tests.synthetic import synthetic_dem
+
+# エンジンと設定は相対インポートを使用するので、プラグインのパッケージとして読み込む
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(ROOT))
+try:
+    from osgeo import osr
+
+    engine = importlib.import_module(f"{os.path.basename(ROOT)}.apps.engine")
+    options = importlib.import_module(f"{os.path.basename(ROOT)}.apps.options")
+except ImportError:
+    engine = None
+
+
+def topo_map_spec(kernel_spec: str = "mean", cells: int = 15, **execution):
+    return options.TopoMapSpec(
+        options.FirstResampleSpec(False, True, 1.0, 1, "Bilinear"),
+        options.OutputSpec(False, 0, 0, False, "", None, None, None, None),
+        options.SlopeOptions(True, 1.0, 1, True, 8.0, False, 1.0),
+        options.TpiOptions(
+            kernel_spec, False, 15.0, cells, 2.0, 1.0, True, 1.5, False, 1.0, True, 5.0
+        ),
+        options.TriOptions(True, True, 1.5, True, 1.5, False, 1.0),
+        options.HillshadeOptions("single", 315, 45, 1, False, True, 1.0, False, 1.5),
+        options.OthersOptions(False, 1.0, 50, 0, False, 1.2),
+        options.ExecutionOptions(**execution),
+    )
+
+
+@unittest.skipIf(engine is None, "GDAL or gdal_drawer is not available")
+class TiledLayerTest(unittest.TestCase):
+    def setUp(self):
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(6677)
+        array = synthetic_dem(150, 170)
+        self.dem = engine.DemBuffer(array, (0, 1, 0, 0, 0, -1), srs.ExportToWkt())
+        self.dst = self.dem.dataset()
+
+    def stitched_layers(self, topo_engine, tile_size):
+        spec = topo_engine.spec
+        tpi_kernels = [engine.generate_kernel(self.dst, spec.tpi)]
+        tpi_kernels.append(
+            engine.generate_kernel(self.dst, spec.tpi, spec.tpi.multiples_distance)
+        )
+        halo = engine.compute_halo(self.dst, spec, tpi_kernels)
+        layers = {}
+        for window in engine.iter_windows(170, 150, tile_size, halo):
+            tile_dem = engine.DemBuffer.read(self.dst, window)
+            for name, ary in topo_engine.layer_arrays(tile_dem, report=False).items():
+                if name not in layers:
+                    layers[name] = np.full((150, 170), -9999.0, dtype="float32")
+                layers[name][window.slices] = ary[window.crop]
+        return layers
+
+    def test_tiles_match_whole_raster(self):
+        # 'fill' は Nodata の領域毎に fill_nodata で埋めるので、ハローにその範囲も含める
+        for smoothing_nodata in ("normalized", "fill"):
+            spec = topo_map_spec(smoothing_nodata=smoothing_nodata)
+            topo_engine = engine.TopoMapEngine(spec)
+            expected = topo_engine.layer_arrays(self.dem, report=False)
+            for tile_size in (48, 64):
+                stitched = self.stitched_layers(topo_engine, tile_size)
+                self.assertEqual(sorted(stitched), sorted(expected))
+                for name, ary in expected.items():
+                    np.testing.assert_allclose(
+                        stitched[name], ary, rtol=0, atol=1e-3, err_msg=name
+                    )
+
+
+    def test_thin_doughnut_uses_run_sums(self):
+        # 小さなドーナツカーネルは FFT ではなく区間毎の合計で計算する
+        spec = topo_map_spec("doughnut", 5, smoothing_nodata="normalized")
+        spec.tpi.multiple_tpi = False
+        topo_engine = engine.TopoMapEngine(spec)
+        with mock.patch.object(
+            engine, "sparse_focal_mean", wraps=engine.sparse_focal_mean
+        ) as sparse, mock.patch.object(
+            engine, "convolved_means", wraps=engine.convolved_means
+        ) as fft:
+            tpi = topo_engine.layer_arrays(self.dem, report=False)["tpi"]
+        self.assertEqual(sparse.call_count, 1)
+        self.assertFalse(fft.called)
+        self.assertFalse(np.isnan(tpi[~np.isnan(self.dem.array)]).any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+`apps.focal` の積分画像と再帰型ガウシアンフィルタによる近傍の平均（TPI の 'fast'）を、
+カーネルで直接畳み込んだ結果と比較する。GDAL は使用しない。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from apps import focal
+from apps.focal import box_gaussian_weights
+from apps.focal import box_mean
+from apps.focal import fast_focal_mean
+from apps.focal import gaussian_mean
+from apps.focal import is_sparse_uniform
+from apps.focal import kernel_runs
+from apps.focal import recursive_gaussian
+from apps.focal import sparse_focal_mean
+from tests.synthetic import doughnut_kernel
+from tests.synthetic import normalized_convolve
+from tests.synthetic import synthetic_dem
+
+
+def gaussian_kernel(sigma: float) -> np.ndarray:
+    radius = int(np.ceil(3 * sigma))
+    y, x = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    kernel = np.exp(-(x * x + y * y) / (2 * sigma * sigma))
+    return kernel / kernel.sum()
+
+
+def inverse_gaussian_kernel(sigma: float) -> np.ndarray:
+    kernel = gaussian_kernel(sigma)
+    kernel = kernel.max() - kernel
+    return kernel / kernel.sum()
+
+
+def tpi_error(dem: np.ndarray, mean: np.ndarray, expected: np.ndarray) -> float:
+    """
+    ## Summary
+        ラスターの端と Nodata から離れたセルでの TPI の誤差を、TPI の標準偏差との比で返す。
+    """
+    inner = (slice(60, -10), slice(80, -20))
+    tpi = dem[inner] - expected[inner]
+    return float(np.nanmax(np.abs(mean[inner] - expected[inner])) / np.nanstd(tpi))
+
+
+class FocalMeanTest(unittest.TestCase):
+    def setUp(self):
+        self.dem = synthetic_dem(140, 160).astype("float64")
+        y, x = np.mgrid[0:140, 0:160]
+        self.dem += 5.0 * np.sin(x / 6.0) * np.cos(y / 9.0)
+
+    def test_box_mean_matches_convolution(self):
+        for radius in (1, 4, 11):
+            size = 2 * radius + 1
+            kernel = np.full((size, size), 1.0 / size**2)
+            expected = normalized_convolve(self.dem, kernel)
+            np.testing.assert_allclose(
+                box_mean(self.dem, radius), expected, rtol=0, atol=1e-4
+            )
+
+    def test_recursive_gaussian_impulse(self):
+        impulse = np.zeros((201, 201))
+        impulse[100, 100] = 1.0
+        for sigma in (1.5, 4.0, 8.0):
+            response = recursive_gaussian(impulse, sigma)
+            self.assertAlmostEqual(response.sum(), 1.0, places=5)
+            peak = 1 / (2 * np.pi * sigma * sigma)
+            self.assertLess(abs(response[100, 100] / peak - 1), 0.1)
+
+    def test_gaussian_mean_close_to_convolution(self):
+        for sigma in (2.0, 4.0):
+            expected = normalized_convolve(self.dem, gaussian_kernel(sigma))
+            mean = gaussian_mean(self.dem, sigma)
+            # 再帰型フィルタは近似で、参照のカーネルは 3σ で打ち切っているので誤差が大きい
+            self.assertLess(tpi_error(self.dem, mean, expected), 0.25)
+
+    def test_box_gaussian_weights(self):
+        for sigma in (1.0, 3.5):
+            kernel = inverse_gaussian_kernel(sigma)
+            alpha, beta = box_gaussian_weights(kernel, sigma)
+            radius = kernel.shape[0] // 2
+            y, x = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+            gauss = np.exp(-(x * x + y * y) / (2 * sigma * sigma))
+            np.testing.assert_allclose(alpha + beta * gauss, kernel, atol=1e-12)
+        doughnut = np.ones((7, 7))
+        doughnut[1:-1, 1:-1] = 0.0
+        self.assertIsNone(box_gaussian_weights(doughnut, 2.0))
+        self.assertIsNone(box_gaussian_weights(gaussian_kernel(2.0), 3.0))
+
+    def test_inverse_gaussian_mean_close_to_convolution(self):
+        for sigma in (2.0, 4.0):
+            kernel = inverse_gaussian_kernel(sigma)
+            expected = normalized_convolve(self.dem, kernel)
+            mean = fast_focal_mean(self.dem, "inv_gauss", kernel, sigma)
+            self.assertLess(tpi_error(self.dem, mean, expected), 0.05)
+
+    def test_unsupported_kernels_fall_back(self):
+        doughnut = np.ones((7, 7))
+        doughnut[1:-1, 1:-1] = 0.0
+        self.assertIsNone(fast_focal_mean(self.dem, "doughnut", doughnut, 2.0))
+        self.assertIsNone(fast_focal_mean(self.dem, "inv_gauss", doughnut, 2.0))
+
+
+
+class SparseFocalMeanTest(unittest.TestCase):
+    def test_kernel_runs(self):
+        kernel = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 1]])
+        self.assertEqual(
+            kernel_runs(kernel), [(0, 1, 2), (1, 0, 1), (1, 2, 3), (2, 1, 3)]
+        )
+
+    def test_matches_convolution(self):
+        dem = synthetic_dem(90, 110)
+        full = np.nan_to_num(dem, nan=100.0)
+        # 行のまとまり（ストリップ）の境界をまたぐ様に、1度に7行ずつ計算する
+        with mock.patch.object(focal, "SPARSE_STRIP_BYTES", 8 * 110 * 7):
+            for radius in (2, 5):
+                kernel = doughnut_kernel(radius)
+                for ary in (dem, full):
+                    np.testing.assert_allclose(
+                        sparse_focal_mean(ary, kernel),
+                        normalized_convolve(ary, kernel),
+                        rtol=0,
+                        atol=1e-4,
+                    )
+
+    def test_selected_only_when_faster_than_fft(self):
+        # benchmarks/bench_sparse.py で区間毎の合計の方が速かった組み合わせだけを選ぶ
+        shape = (3000, 3000)
+        self.assertTrue(is_sparse_uniform(doughnut_kernel(2), shape, True))
+        self.assertTrue(is_sparse_uniform(doughnut_kernel(8), shape, False))
+        self.assertFalse(is_sparse_uniform(doughnut_kernel(8), shape, True))
+        self.assertFalse(is_sparse_uniform(doughnut_kernel(12), shape, False))
+        self.assertTrue(is_sparse_uniform(np.full((5, 5), 1 / 25), shape, True))
+        self.assertFalse(is_sparse_uniform(gaussian_kernel(1.0), shape, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
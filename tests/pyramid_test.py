@@ -0,0 +1,84 @@
+"""
+`apps.pyramid` の間引きと双線形補間を確認し、間引いた DEM で平滑化した結果が元の解像度で
+平滑化した結果に近いことを `error_stats` で確認する。GDAL は使用しない。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+
+import numpy as np
+
+from apps.pyramid import decimate
+from apps.pyramid import decimation_factor
+from apps.pyramid import error_stats
+from apps.pyramid import upsample
+from apps.smoothing import gaussian_filter
+from tests.synthetic import synthetic_dem
+
+
+class DecimationFactorTest(unittest.TestCase):
+    def test_factor_follows_kernel_size(self):
+        self.assertEqual(decimation_factor(31, 32, 4), 1)
+        self.assertEqual(decimation_factor(32, 32, 4), 2)
+        self.assertEqual(decimation_factor(63, 32, 4), 2)
+        self.assertEqual(decimation_factor(64, 32, 4), 4)
+        self.assertEqual(decimation_factor(1000, 32, 4), 4)
+        self.assertEqual(decimation_factor(1000, 32, 2), 2)
+
+
+class DecimateTest(unittest.TestCase):
+    def test_block_means_skip_nodata(self):
+        ary = np.arange(30, dtype="float64").reshape(5, 6)
+        ary[0, 0] = np.nan
+        ary[4, :] = np.nan
+        coarse = decimate(ary, 2)
+        self.assertEqual(coarse.shape, (3, 3))
+        self.assertAlmostEqual(coarse[0, 0], (1 + 6 + 7) / 3, places=5)
+        self.assertAlmostEqual(coarse[1, 2], (16 + 17 + 22 + 23) / 4, places=5)
+        # 半端な行は Nodata だけなので np.nan
+        self.assertTrue(np.isnan(coarse[2]).all())
+
+    def test_upsample_keeps_linear_surfaces(self):
+        y, x = np.mgrid[0:64, 0:72]
+        ary = (3.0 * x - 2.0 * y).astype("float32")
+        for factor in (2, 4):
+            fine = upsample(decimate(ary, factor), factor, ary.shape)
+            self.assertEqual(fine.shape, ary.shape)
+            # 端の半セル分は端の値を延長するので、内側だけを比較する
+            inner = (slice(factor, -factor), slice(factor, -factor))
+            np.testing.assert_allclose(fine[inner], ary[inner], atol=1e-3)
+
+    def test_upsample_nodata(self):
+        coarse = np.full((4, 4), np.nan, dtype="float32")
+        coarse[0, 0] = 1.0
+        fine = upsample(coarse, 2, (8, 8))
+        self.assertEqual(fine[0, 0], 1.0)
+        self.assertTrue(np.isnan(fine[6:, 6:]).all())
+
+
+class PyramidSmoothingTest(unittest.TestCase):
+    def test_decimated_smoothing_error(self):
+        dem = synthetic_dem(256, 288, void_ratio=0.0)
+        y, x = np.mgrid[0:256, 0:288]
+        dem += (20.0 * np.sin(x / 40.0) * np.cos(y / 30.0)).astype("float32")
+        sigma = 16.0
+        full = gaussian_filter(dem, sigma, normalized=True)
+        for factor in (2, 4):
+            coarse = gaussian_filter(
+                decimate(dem, factor), sigma / factor, normalized=True
+            )
+            approx = upsample(coarse, factor, dem.shape)
+            approx[np.isnan(dem)] = np.nan
+            stats = error_stats(full, approx)
+            self.assertLess(stats["relative_rmse"], 0.02, msg=f"factor {factor}")
+
+    def test_error_stats(self):
+        full = np.array([1.0, 2.0, 3.0, np.nan])
+        stats = error_stats(full, full + np.array([0.0, 0.5, -0.5, 0.0]))
+        self.assertAlmostEqual(stats["max"], 0.5)
+        self.assertAlmostEqual(stats["rmse"], np.sqrt(0.5 / 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+`apps.spectral` のブロック毎の FFT の畳み込みが、`scipy.signal` で全体を一度に畳み込んだ
+結果と一致することを確認する。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+
+import numpy as np
+import scipy.signal
+
+from apps.spectral import convolved_means
+from apps.spectral import fft_convolve
+from tests.synthetic import doughnut_kernel
+from tests.synthetic import normalized_convolve
+from tests.synthetic import synthetic_dem
+
+
+class FftConvolveTest(unittest.TestCase):
+    def test_matches_fftconvolve(self):
+        rng = np.random.default_rng(1)
+        ary = rng.normal(size=(150, 170))
+        kernels = [
+            rng.normal(size=(9, 13)),
+            rng.normal(size=(1, 21)),
+            rng.normal(size=(17, 1)),
+        ]
+        for kernel in kernels:
+            expected = scipy.signal.fftconvolve(ary, kernel, mode="same")
+            # ブロックに分割する場合と、全体が1つのブロックに収まる場合
+            for max_block in (64, 4096):
+                result = fft_convolve(ary, kernel, max_block)
+                np.testing.assert_allclose(result, expected, rtol=0, atol=1e-9)
+
+    def test_keeps_dtype(self):
+        ary = np.ones((20, 30), dtype="float32")
+        result = fft_convolve(ary, np.ones((1, 5)) / 5, 16)
+        self.assertEqual(result.dtype, np.float32)
+
+
+class ConvolvedMeansTest(unittest.TestCase):
+    def test_matches_normalized_convolution(self):
+        dem = synthetic_dem(160, 190)
+        kernels = [np.ones((11, 11)) / 121, doughnut_kernel(12, 2)]
+        for max_block in (64, 4096):
+            means = convolved_means(dem, kernels, max_block=max_block)
+            for kernel, mean in zip(kernels, means):
+                expected = normalized_convolve(dem, kernel)
+                self.assertEqual(mean.dtype, np.float32)
+                np.testing.assert_allclose(mean, expected, rtol=0, atol=1e-3)
+
+    def test_no_valid_neighbours_is_nodata(self):
+        dem = synthetic_dem(120, 120)
+        dem[40:100, 30:90] = np.nan
+        kernel = np.ones((7, 7)) / 49
+        (mean,) = convolved_means(dem, [kernel], max_block=64)
+        self.assertTrue(np.isnan(mean[60:80, 50:70]).all())
+        self.assertFalse(np.isnan(mean[110:]).any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+`apps.stats` の近似の分位数が、示した誤差の範囲で `np.nanquantile` と一致することを確認する。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+
+import numpy as np
+
+from apps.stats import StatsSketch
+from apps.stats import approx_quantiles
+from apps.stats import layer_stats
+
+PROBS = [0.0, 0.01, 0.25, 0.5, 0.75, 0.99, 1.0]
+
+
+def synthetic_layer(rows: int, cols: int, seed: int) -> np.ndarray:
+    """
+    ## Summary
+        裾の重い値と Nodata(np.nan) の穴を含む、float32 の材料の配列。
+    """
+    rng = np.random.default_rng(seed)
+    ary = rng.standard_t(2.0, (rows, cols)).astype("float32") * 5.0
+    ary[rng.random((rows, cols)) < 0.05] = np.nan
+    ary[40:90, 10:60] = np.nan
+    return ary
+
+
+class ApproxQuantilesTest(unittest.TestCase):
+    def test_within_reported_error(self):
+        for seed in range(3):
+            ary = synthetic_layer(300, 400, seed)
+            expected = np.nanquantile(ary, PROBS)
+            values, error = approx_quantiles(ary, PROBS)
+            np.testing.assert_allclose(values, expected, rtol=0, atol=error + 1e-6)
+            # 裾の重い分布でもビンを数え直すので、値の範囲の 1/65536 程度に収まる
+            value_range = float(np.nanmax(ary) - np.nanmin(ary))
+            self.assertLessEqual(error, value_range / 65536)
+
+    def test_constant_and_empty(self):
+        values, error = approx_quantiles(np.full((10, 10), 3.5), [0.25, 0.75])
+        np.testing.assert_array_equal(values, [3.5, 3.5])
+        self.assertEqual(error, 0.0)
+        values, _ = approx_quantiles(np.full((4, 4), np.nan), [0.5], value_range=(0, 1))
+        self.assertTrue(np.isnan(values).all())
+
+    def test_layer_stats_histogram_matches_exact(self):
+        ary = synthetic_layer(200, 250, 7)
+        exact = layer_stats(ary, quartiles=True, method="exact")
+        approx = layer_stats(ary, quartiles=True, method="histogram")
+        self.assertEqual(approx.vmin, exact.vmin)
+        self.assertEqual(approx.vmax, exact.vmax)
+        self.assertAlmostEqual(approx.q1, exact.q1, delta=approx.quartile_error + 1e-6)
+        self.assertAlmostEqual(approx.q3, exact.q3, delta=approx.quartile_error + 1e-6)
+
+
+class StatsSketchTest(unittest.TestCase):
+    def test_merged_tiles_match_nanquantile(self):
+        ary = synthetic_layer(300, 400, 11)
+        sketches = []
+        for top in range(0, ary.shape[0], 128):
+            for left in range(0, ary.shape[1], 128):
+                sketch = StatsSketch(quartiles=True)
+                sketch.add(ary[top : top + 128, left : left + 128])
+                sketches.append(sketch)
+        merged = StatsSketch(quartiles=True)
+        for sketch in sketches:
+            merged.merge(sketch)
+        stats = merged.stats()
+        q1, q3 = np.nanquantile(ary, [0.25, 0.75])
+        self.assertEqual(stats.vmin, float(np.nanmin(ary)))
+        self.assertEqual(stats.vmax, float(np.nanmax(ary)))
+        self.assertAlmostEqual(stats.q1, q1, delta=stats.quartile_error + 1e-6)
+        self.assertAlmostEqual(stats.q3, q3, delta=stats.quartile_error + 1e-6)
+        # 誤差は値の絶対値の 2 ** -10 倍以下
+        bound = max(abs(q1), abs(q3)) * 2.0**-10
+        self.assertLessEqual(stats.quartile_error, bound * 2)
+
+    def test_all_nodata(self):
+        sketch = StatsSketch(quartiles=True)
+        sketch.add(np.full((8, 8), np.nan, dtype="float32"))
+        stats = sketch.stats()
+        self.assertTrue(np.isnan(stats.vmin))
+        self.assertTrue(np.isnan(stats.q1))
+
+
+if __name__ == "__main__":
+    unittest.main()
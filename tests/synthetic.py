@@ -0,0 +1,60 @@
+"""
+テストで共通して使用する合成データと、比較に使用する参照の計算。
+"""
+
+import numpy as np
+import scipy.signal
+
+
+def synthetic_dem(
+    rows: int, cols: int, seed: int = 0, void_ratio: float = 0.01
+) -> np.ndarray:
+    """
+    ## Summary
+        傾斜とノイズに、Nodata(np.nan) の穴とラスターの端に接する欠損を加えた合成の DEM。
+    Args:
+        rows (int): 行数。
+        cols (int): 列数。
+        seed (int): 乱数のシード。
+        void_ratio (float): ランダムに Nodata にするセルの割合。
+    Returns:
+        np.ndarray: float32 の DEM。
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:rows, 0:cols]
+    dem = 100.0 + 0.3 * x - 0.2 * y + rng.normal(0.0, 1.0, (rows, cols))
+    dem[20:45, 30:70] = np.nan
+    dem[:5, -12:] = np.nan
+    dem[rng.random((rows, cols)) < void_ratio] = np.nan
+    return dem.astype("float32")
+
+
+def doughnut_kernel(radius: int, width: int = 1) -> np.ndarray:
+    """
+    ## Summary
+        中心からの距離が (radius - width, radius] のセルを同じ重みにしたドーナツカーネル。
+    """
+    x = np.arange(-radius, radius + 1)
+    distance = np.hypot(x[:, None], x[None, :])
+    kernel = ((distance <= radius) & (radius - width < distance)).astype("float64")
+    return kernel / kernel.sum()
+
+
+def normalized_convolve(ary: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """
+    ## Summary
+        Nodata とラスターの外側を除いた重み付き平均を、全体を一度に直接畳み込んで計算する。
+    Args:
+        ary (np.ndarray): 2次元の配列。Nodata は np.nan。
+        kernel (np.ndarray): カーネル
+    Returns:
+        np.ndarray: float64 の平均。重みの合計が 0 のセルは np.nan。
+    """
+    valid = ~np.isnan(ary)
+    filled = np.where(valid, ary, 0.0).astype("float64")
+    sums = scipy.signal.convolve(filled, kernel, mode="same", method="direct")
+    weights = scipy.signal.convolve(
+        valid.astype("float64"), kernel, mode="same", method="direct"
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / weights
@@ -0,0 +1,70 @@
+"""
+`apps.tiling.iter_windows` のタイルをつなぎ合わせた結果が、全体を一度に計算した結果と
+一致することを確認する。GDAL は使用しない。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import unittest
+
+import numpy as np
+
+from apps.focal import box_mean
+from apps.tiling import FILL_NODATA_ITERATIONS
+from apps.tiling import fill_nodata_margin
+from apps.tiling import iter_windows
+from tests.synthetic import synthetic_dem
+
+
+class IterWindowsTest(unittest.TestCase):
+    def test_windows_cover_raster_once(self):
+        for align in (1, 2, 4):
+            covered = np.zeros((123, 157), dtype="int32")
+            for window in iter_windows(157, 123, 50, 7, align):
+                covered[window.slices] += 1
+                self.assertEqual(window.y_off % align, 0)
+                self.assertEqual(window.x_off % align, 0)
+            np.testing.assert_array_equal(covered, 1)
+
+    def test_crop_matches_slices(self):
+        for window in iter_windows(157, 123, 50, 7):
+            rows, cols = window.pad_slices
+            top, left = window.crop
+            self.assertEqual(rows.start + top.start, window.y_off)
+            self.assertEqual(cols.start + left.start, window.x_off)
+            self.assertEqual(top.stop - top.start, window.y_size)
+            self.assertEqual(left.stop - left.start, window.x_size)
+
+    def test_stitched_tiles_match_whole_raster(self):
+        dem = synthetic_dem(123, 157)
+        radius = 6
+        expected = box_mean(dem, radius)
+        for tile_size in (32, 50, 200):
+            stitched = np.full(dem.shape, -9999.0, dtype="float32")
+            for window in iter_windows(dem.shape[1], dem.shape[0], tile_size, radius):
+                tile = box_mean(dem[window.pad_slices], radius)
+                stitched[window.slices] = tile[window.crop]
+            np.testing.assert_allclose(stitched, expected, rtol=0, atol=1e-4)
+
+    def test_short_halo_leaves_seams(self):
+        dem = synthetic_dem(123, 157)
+        radius = 6
+        expected = box_mean(dem, radius)
+        stitched = np.empty(dem.shape, dtype="float32")
+        for window in iter_windows(dem.shape[1], dem.shape[0], 32, radius - 2):
+            tile = box_mean(dem[window.pad_slices], radius)
+            stitched[window.slices] = tile[window.crop]
+        self.assertGreater(np.nanmax(np.abs(stitched - expected)), 1e-3)
+
+
+
+class FillNodataMarginTest(unittest.TestCase):
+    def test_distance_is_converted_to_cells(self):
+        # 探索距離はメートルなので、セルが小さいほど多くのセルを参照する
+        self.assertEqual(fill_nodata_margin(5.0, 0.5), 10 + FILL_NODATA_ITERATIONS)
+        self.assertEqual(fill_nodata_margin(5.0, 2.0), 3 + FILL_NODATA_ITERATIONS)
+        self.assertEqual(fill_nodata_margin(5.0, 5.0), 1 + FILL_NODATA_ITERATIONS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+`apps.xyz` のタイルの縮小と、キャンセルした場合に途中まで書き込んだ出力を削除することを
+確認する。`apps.xyz` は GDAL を使用するので、GDAL がない環境ではスキップする。
+
+    $ python -m unittest discover -s . -p "*test.py"
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    from apps import xyz
+except ImportError:
+    xyz = None
+
+
+class FakePyramid(object):
+    """
+    ## Summary
+        1枚のタイルだけを作成する `apps.xyz.TilePyramid` の代わり。
+    """
+
+    def __init__(self, src_path, options):
+        self.bounds = (0.0, 0.0, 1.0, 1.0)
+        self.min_zoom = 0
+        self.max_zoom = 0
+        self.closed = False
+
+    def split_zoom(self, workers):
+        return 0
+
+    def tiles(self, zoom):
+        yield 0, 0
+
+    def render(self, zoom, x, y, emit):
+        img = np.full((xyz.TILE_SIZE, xyz.TILE_SIZE, 4), 255, dtype="uint8")
+        emit(zoom, x, y, img)
+        return img
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(xyz is None, "GDAL is not available")
+class DownsampleTest(unittest.TestCase):
+    def test_transparent_pixels_do_not_mix(self):
+        img = np.zeros((2, 2, 4), dtype="uint8")
+        img[0, 0] = (200, 100, 50, 255)
+        out = xyz.downsample_rgba(img)
+        self.assertEqual(out.shape, (1, 1, 4))
+        np.testing.assert_array_equal(out[0, 0, :3], (200, 100, 50))
+        self.assertEqual(out[0, 0, 3], 64)
+
+    def test_parent_tile(self):
+        self.assertIsNone(xyz.parent_tile({}))
+        child = np.full((xyz.TILE_SIZE, xyz.TILE_SIZE, 4), 255, dtype="uint8")
+        parent = xyz.parent_tile({(1, 0): child})
+        half = xyz.TILE_SIZE // 2
+        self.assertTrue((parent[:half, half:] == 255).all())
+        self.assertFalse(parent[:, :half].any())
+        self.assertFalse(parent[half:].any())
+
+    def test_tile_range(self):
+        shift = xyz.ORIGIN_SHIFT
+        world = (-shift, -shift, shift, shift)
+        self.assertEqual(xyz.tile_range(world, 2), (0, 0, 3, 3))
+        self.assertEqual(xyz.tile_range((1.0, 1.0, 2.0, 2.0), 1), (1, 0, 1, 0))
+
+
+@unittest.skipIf(xyz is None, "GDAL is not available")
+class ExportCleanupTest(unittest.TestCase):
+    def export(self, file_name, is_canceled):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, file_name)
+        options = xyz.TileExportOptions(max_workers=1)
+        with mock.patch.object(xyz, "TilePyramid", FakePyramid):
+            result = xyz.export_xyz_tiles("src.tif", path, options, is_canceled)
+        return path, result
+
+    def test_completed(self):
+        for file_name in ("out.mbtiles", "out.gpkg"):
+            path, result = self.export(file_name, lambda: False)
+            self.assertEqual(result["tiles"], 1)
+            self.assertTrue(os.path.exists(path))
+            os.remove(path)
+
+    def test_canceled_output_is_removed(self):
+        for file_name in ("out.mbtiles", "out.gpkg"):
+            path, result = self.export(file_name, lambda: True)
+            self.assertIsNone(result)
+            self.assertFalse(os.path.exists(path))
+
+    def test_failed_output_is_removed(self):
+        path = os.path.join(tempfile.mkdtemp(), "out.mbtiles")
+        options = xyz.TileExportOptions(max_workers=1)
+        failure = RuntimeError("read error")
+        with mock.patch.object(xyz, "TilePyramid", FakePyramid):
+            with mock.patch.object(FakePyramid, "render", side_effect=failure):
+                with self.assertRaises(RuntimeError):
+                    xyz.export_xyz_tiles("src.tif", path, options)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -182,18 +182,15 @@ class TopoMaps:
         if task.new_dst:
             self.new_dst = task.new_dst
             msg.created_infomation(self.MESSAGE_CATEGORY, self.new_dst)
-            output_spec = self.dlg.get_output_spec()
+            output_spec = task.spec.output
             if output_spec.sample_only:
                 # サンプルのみの場合は出力ファイルを指定しなくともよい
                 self.dlg.show_sample_dst(self.new_dst)
             else:
-                # 出力を書く####################################################
-                self.new_dst.save_dst(output_spec.output_file_path)
+                # 出力ファイルはタスク内でブロック毎に書き込み済み
                 self.new_dst = None
                 if output_spec.add_project:
-                    self.dlg.add_lyr(
-                        output_spec.output_file_path, self.dlg.get_style_name()
-                    )
+                    self.dlg.add_lyr(task.output_path, self.dlg.get_style_name())
 
             computing = round(time() - self.time, 3)
             msg.computing_time(self.MESSAGE_CATEGORY, computing)